@@ -92,22 +92,22 @@ def contextualize(state: Dict[str, Any]) -> Dict[str, Any]:
     """
     Prepara el 'summary' para el validador y el usuario final, basándose
     directamente en los resultados de PandasAI (sin usar LLM aquí).
-    Pasa la ruta del plot si existe.
+    Si hay un gráfico (bytes en el estado), el validador lo entrega.
     """
     original_query = state.get('original_query', "Consulta no especificada") # Fallback
     pandasai_result = state.get('pandasai_result')
     pandasai_result_type = state.get('pandasai_result_type')
-    pandasai_plot_path = state.get('pandasai_plot_path')
+    pandasai_plot_bytes = state.get('pandasai_plot_bytes')
     pandasai_error = state.get('pandasai_error')
 
     logger.info("Contextualizador (PandasAI-only - Flujo Simplificado): Iniciando...")
-    logger.debug(f"  Recibido del estado: ResultType='{pandasai_result_type}', PlotPath='{pandasai_plot_path}', Error='{pandasai_error}'")
+    logger.debug(f"  Recibido del estado: ResultType='{pandasai_result_type}', PlotBytes={len(pandasai_plot_bytes) if pandasai_plot_bytes else None}, Error='{pandasai_error}'")
 
     output_summary: Optional[str] = None
 
     # Si hay un plot generado por PandasAI o un error, el validador los manejará.
     # Aquí solo generamos un summary textual si NO hay plot Y NO hay error.
-    if not pandasai_plot_path and not pandasai_error:
+    if not pandasai_plot_bytes and not pandasai_error:
         logger.info("Contextualizador: No hay plot ni error de PandasAI, formateando resultado para summary.")
         output_summary = format_pandasai_data_for_summary(
             pandasai_result,
@@ -115,8 +115,8 @@ def contextualize(state: Dict[str, Any]) -> Dict[str, Any]:
             original_query
         )
         logger.info(f"Contextualizador: Summary formateado (sin LLM): '{str(output_summary)[:150]}...'")
-    elif pandasai_plot_path:
-        logger.info("Contextualizador: Se detectó ruta de plot. El validador la manejará.")
+    elif pandasai_plot_bytes:
+        logger.info("Contextualizador: Se detectó un gráfico. El validador lo manejará.")
         # Podemos poner un texto genérico que el validador usará si la imagen se procesa bien
         output_summary = "Se ha generado una visualización para tu consulta."
     elif pandasai_error:
@@ -130,5 +130,5 @@ def contextualize(state: Dict[str, Any]) -> Dict[str, Any]:
 
 
     # El estado devuelto solo necesita el summary.
-    # El Validador leerá pandasai_plot_path y pandasai_error directamente del estado global.
+    # El Validador leerá pandasai_plot_bytes y pandasai_error directamente del estado global.
     return {"summary": output_summary}
\ No newline at end of file
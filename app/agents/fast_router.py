@@ -0,0 +1,402 @@
+# app/agents/fast_router.py
+import re
+import logging
+import threading
+import unicodedata
+from typing import Dict, Optional, Any, List, Tuple
+from app.core.config import settings
+from app.core.dataframe_loader import get_dataframe, get_dataset_version
+
+logger = logging.getLogger(__name__)
+
+# Pre-enrutador determinista que se ejecuta antes del LLM moderador.
+# Reconoce las formas de consulta más frecuentes (en español) y construye
+# directamente la invocación de la skill correspondiente. Si no reconoce la
+# consulta, o la confianza es baja, devuelve None y el moderador usa el LLM.
+
+# --- Sinónimos de columnas (texto normalizado -> columna del DataFrame) ---
+# El orden importa: las expresiones más específicas van primero.
+COLUMN_SYNONYMS: List[Tuple[str, str]] = [
+    (r"tipos? de (?:barcos?|buques?|embarcacion(?:es)?)", "ship_type"),
+    (r"puertos? de (?:salida|origen|procedencia|partida)", "travel_departure_port"),
+    (r"puertos? de (?:llegada|destino|arribo)", "travel_arrival_port"),
+    (r"secciones|seccion(?:es)? del (?:diario|periodico)", "news_section"),
+    (r"capitanes|maestres|capitan(?:es)?", "master_name"),
+    (r"roles? del? capitan|roles?", "master_role"),
+    (r"nombres? de (?:los )?(?:barcos?|buques?)|barcos|buques|navios|embarcaciones", "ship_name"),
+    (r"puertos", "travel_departure_port"),
+]
+
+# Dimensiones de los conteos agrupados ("... por <dimensión>"); la dimensión debe
+# ocupar todo el resto de la consulta para no descartar filtros adicionales.
+GROUP_BY_SYNONYMS: List[Tuple[str, str]] = [
+    (r"(?:cada )?anos?(?: de publicacion)?", "publication_year"),
+    (r"(?:cada )?mes(?:es)?(?: de publicacion)?", "publication_month"),
+    (r"(?:cada )?(?:seccion(?:es)?)(?: del (?:diario|periodico))?", "news_section"),
+    (r"(?:cada )?tipos?(?: de (?:barcos?|buques?|embarcacion(?:es)?))?", "ship_type"),
+    (r"(?:cada )?puertos? de (?:salida|origen|procedencia|partida)", "travel_departure_port"),
+    (r"(?:cada )?puertos? de (?:llegada|destino|arribo)", "travel_arrival_port"),
+]
+
+# Etiquetas en español para títulos de gráficos y descripciones
+COLUMN_LABELS: Dict[str, str] = {
+    "ship_type": "Tipos de Barco",
+    "travel_departure_port": "Puertos de Salida",
+    "travel_arrival_port": "Puertos de Llegada",
+    "news_section": "Secciones del Diario",
+    "master_name": "Capitanes",
+    "master_role": "Roles del Capitán",
+    "ship_name": "Nombres de Barco",
+    "publication_year": "Años de Publicación",
+    "publication_month": "Meses de Publicación",
+}
+
+NUMBER_WORDS: Dict[str, int] = {
+    "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7, "ocho": 8,
+    "nueve": 9, "diez": 10, "doce": 12, "quince": 15, "veinte": 20,
+}
+
+# Columnas cuyo vocabulario se usa para validar los valores capturados
+VOCABULARY_COLUMNS: List[str] = ["ship_name", "master_name", "travel_departure_port", "travel_arrival_port"]
+
+DEFAULT_TOP_N = 15
+HIGH_CONFIDENCE = 0.95
+LOW_CONFIDENCE = 0.4
+
+# --- Gramática (sobre el texto normalizado) ---
+_VISUAL_RE = re.compile(r"\b(?:grafic[oa]s?|graficar?|grafique|visualiz\w*|diagrama|barras|plot)\b")
+_FREQUENCY_RE = re.compile(r"\b(?:top|mas (?:comunes|frecuentes|repetid[oa]s|habituales|usad[oa]s)|frecuencias?|principales|ranking)\b")
+_TOP_N_RE = re.compile(
+    r"\b(?:top|los|las|primer[oa]s)?\s*(?P<n>\d{1,3}|" + "|".join(NUMBER_WORDS) + r")\b"
+)
+_SHIP_DATA_RE = re.compile(
+    r"^(?:dame |muestrame |quiero |necesito |obtener |ver )?"
+    r"(?:todos los datos|toda la informacion|la informacion|informacion|los datos|datos|los registros|registros)"
+    r" (?:del|sobre el|de la|acerca del) (?:barco|buque|vapor|navio|embarcacion|bergantin|fragata|goleta) "
+    r"(?P<name>.+)$"
+)
+_SHIPS_FROM_PORT_RE = re.compile(
+    r"^(?:que |cuales |lista(?:r)? (?:de )?(?:los )?|dame (?:los )?|muestrame (?:los )?)?"
+    r"(?:barcos|buques|navios|embarcaciones)"
+    r"(?: que)? (?:salieron|partieron|vinieron|venian|llegaron|zarparon|procedentes|provenientes|salidos|llegados)?\s*"
+    r"(?P<prep>de|desde|a) (?P<port>.+?)"
+    r"(?: en (?:el )?(?:ano )?(?P<year>1[6-9]\d\d))?$"
+)
+_SHIPS_BY_MASTER_RE = re.compile(
+    r"^(?:que |cuales |dame (?:los )?|lista(?:r)? (?:de )?(?:los )?)?"
+    r"(?:barcos|buques|navios|embarcaciones)"
+    r"(?: (?:comandados|capitaneados|dirigidos) por)? (?:el |del )?(?:capitan|cap) (?P<name>.+)$"
+)
+# Palabras de relleno que puede contener una petición de gráfico Top N sin añadir filtros
+_PLOT_FILLER_WORDS = {
+    "haz", "hazme", "crea", "creame", "genera", "generame", "muestra", "muestrame", "dame", "quiero",
+    "necesito", "ver", "mostrar", "un", "una", "el", "la", "los", "las", "de", "del", "con", "en",
+    "sobre", "por", "su", "sus", "barras", "frecuencia", "cuales", "son",
+}
+_COUNT_BY_GROUP_RE = re.compile(
+    r"^(?:cuantos|cuantas|numero de|cantidad de|conteo de|total de) "
+    r"(?:registros|barcos|buques|navios|embarcaciones|viajes|entradas|noticias)"
+    r"(?: hay| (?:se )?registran?)? (?:por|segun|de|en) (?P<dim>.+)$"
+)
+
+# --- Contadores de aciertos/fallos (compartidos entre hilos) ---
+_stats_lock = threading.Lock()
+_stats: Dict[str, Any] = {"hits": 0, "misses": 0, "low_confidence": 0, "by_rule": {}}
+
+# --- Vocabulario del dataset (singleton por versión, normalizado -> valores exactos) ---
+_vocabulary: Optional[Dict[str, Dict[str, List[str]]]] = None
+_vocabulary_version: Optional[str] = None
+_vocabulary_lock = threading.Lock()
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas, sin acentos ni signos de interrogación/exclamación y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.lower()
+    text = re.sub(r"[¿?¡!]", " ", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _clean_value(value: str) -> str:
+    """Limpia un valor capturado (comillas, puntuación final)."""
+    return value.strip().strip("'\"`«»“”‘’").strip(" .,;:").strip()
+
+
+def _get_vocabulary() -> Dict[str, Dict[str, List[str]]]:
+    """Vocabulario normalizado de las columnas de entidades, reconstruido si cambia el dataset."""
+    global _vocabulary, _vocabulary_version
+    version = get_dataset_version()
+    if _vocabulary is not None and _vocabulary_version == version:
+        return _vocabulary
+    with _vocabulary_lock:
+        if _vocabulary is not None and _vocabulary_version == version:
+            return _vocabulary
+        vocabulary: Dict[str, Dict[str, List[str]]] = {}
+        df = get_dataframe()
+        if df is not None:
+            for col in VOCABULARY_COLUMNS:
+                if col not in df.columns:
+                    continue
+                mapping: Dict[str, List[str]] = {}
+                # value_counts ordena por frecuencia: la forma más común es la canónica (la primera)
+                for value in df[col].dropna().astype(str).value_counts().index:
+                    mapping.setdefault(normalize_text(value), []).append(value)
+                vocabulary[col] = mapping
+            logger.info(f"FastRouter: Vocabulario construido para {list(vocabulary.keys())}.")
+        else:
+            logger.warning("FastRouter: DataFrame no disponible; no se podrá validar valores.")
+        _vocabulary, _vocabulary_version = vocabulary, version
+        return _vocabulary
+
+
+def _lookup_values(column: str, raw_value: str) -> Optional[List[str]]:
+    """
+    Valores exactos del dataset que coinciden con 'raw_value' sin mayúsculas ni acentos
+    (el canónico primero), o None si no existe ninguno.
+    """
+    return _get_vocabulary().get(column, {}).get(normalize_text(_clean_value(raw_value)))
+
+
+def _equality_condition(column: str, values: List[str]) -> str:
+    """Filtro de igualdad exacta con todas las variantes del valor en el dataset."""
+    if len(values) == 1:
+        return f"{column} == {values[0]!r}"
+    return f"{column} in {values!r}"
+
+
+def find_entities(query: str, max_words: int = 8) -> List[Tuple[str, str]]:
+    """
+    Valores del vocabulario del dataset (barcos, capitanes, puertos) mencionados en la
+    consulta, como pares (columna, valor canónico). Se buscan los n-gramas de palabras de
+    la consulta normalizada; se ignoran los valores de menos de 3 caracteres.
+    """
+    words = normalize_text(query).split()
+    vocabulary = _get_vocabulary()
+    found = set()
+    for size in range(1, min(max_words, len(words)) + 1):
+        for start in range(len(words) - size + 1):
+            candidate = " ".join(words[start:start + size])
+            if len(candidate) < 3:
+                continue
+            for column, mapping in vocabulary.items():
+                values = mapping.get(candidate)
+                if values is not None:
+                    found.add((column, values[0]))
+    return sorted(found)
+
+
+def _resolve_column(normalized_query: str) -> Optional[str]:
+    """Encuentra la columna mencionada en la consulta usando COLUMN_SYNONYMS."""
+    for pattern, column in COLUMN_SYNONYMS:
+        if re.search(r"\b(?:" + pattern + r")\b", normalized_query):
+            return column
+    return None
+
+
+def _resolve_column_span(normalized_query: str) -> Optional[Tuple[str, Tuple[int, int]]]:
+    """Como _resolve_column, pero devuelve también la posición del texto que nombra la columna."""
+    for pattern, column in COLUMN_SYNONYMS:
+        match = re.search(r"\b(?:" + pattern + r")\b", normalized_query)
+        if match:
+            return column, match.span()
+    return None
+
+
+def _format_skill_query(skill_name: str, args: Dict[str, Any]) -> str:
+    """Formatea la invocación de la skill con el mismo estilo que genera el LLM moderador."""
+    parts = [f"`{key}={value!r}`" for key, value in args.items()]
+    joined = ", ".join(parts[:-1]) + f", y {parts[-1]}" if len(parts) > 1 else parts[0]
+    return f"Usa la habilidad `{skill_name}` con el DataFrame `df`, {joined}"
+
+
+# --- Reglas ---
+def _rule_top_n_plot(normalized: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """
+    'Gráfico de los 10 tipos de barco más comunes' -> plot_top_n_frequencies.
+    La gramática debe consumir toda la consulta: si quedan palabras fuera de ella
+    (años, puertos, exclusiones...) la skill perdería ese filtro y se usa el LLM.
+    """
+    if not _VISUAL_RE.search(normalized) or not _FREQUENCY_RE.search(normalized):
+        return None
+    resolved = _resolve_column_span(normalized)
+    if resolved is None:
+        return None
+    column, (column_start, column_end) = resolved
+    remainder = normalized[:column_start] + " " + normalized[column_end:]
+    top_n = DEFAULT_TOP_N
+    match = _TOP_N_RE.search(remainder)
+    if match:
+        raw_n = match.group("n")
+        top_n = int(raw_n) if raw_n.isdigit() else NUMBER_WORDS[raw_n]
+        remainder = remainder[:match.start()] + " " + remainder[match.end():]
+    if not 1 <= top_n <= 100:
+        return None
+    remainder = _FREQUENCY_RE.sub(" ", _VISUAL_RE.sub(" ", remainder))
+    unconsumed = [word for word in re.findall(r"\w+", remainder) if word not in _PLOT_FILLER_WORDS]
+    if unconsumed:
+        logger.info(f"FastRouter: Gráfico Top N con términos no reconocidos {unconsumed}; se usará el LLM.")
+        return LOW_CONFIDENCE, {}
+    label = COLUMN_LABELS.get(column, column.replace("_", " ").title())
+    args = {
+        "column_name": column,
+        "top_n": top_n,
+        "chart_title": f"Top {top_n} {label} por Frecuencia",
+        "normalize_ship_types": column == "ship_type",
+        "query_description": f"Gráfico de los {top_n} {label.lower()} más comunes.",
+    }
+    return HIGH_CONFIDENCE, {"intent": "visual", "skill": "plot_top_n_frequencies", "args": args}
+
+
+def _rule_ship_data(normalized: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """'Dame todos los datos del barco Perla' -> get_tabular_data con filtro por ship_name."""
+    match = _SHIP_DATA_RE.match(normalized)
+    if not match:
+        return None
+    ship_names = _lookup_values("ship_name", match.group("name"))
+    if ship_names is None:
+        return LOW_CONFIDENCE, {}
+    ship_name = ship_names[0]
+    args = {
+        "filter_conditions": _equality_condition("ship_name", ship_names),
+        "query_description": f"Todos los datos del barco {ship_name}.",
+    }
+    return HIGH_CONFIDENCE, {"intent": "text", "skill": "get_tabular_data", "args": args}
+
+
+def _rule_ships_from_port(normalized: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """'Barcos que salieron de Halifax en 1851' -> get_tabular_data con filtro por puerto y año."""
+    match = _SHIPS_FROM_PORT_RE.match(normalized)
+    if not match:
+        return None
+    column = "travel_arrival_port" if match.group("prep") == "a" else "travel_departure_port"
+    ports = _lookup_values(column, match.group("port"))
+    if ports is None:
+        return LOW_CONFIDENCE, {}
+    port = ports[0]
+    conditions = [_equality_condition(column, ports)]
+    year = match.group("year")
+    description = f"Barcos llegados a {port}" if column == "travel_arrival_port" else f"Barcos procedentes de {port}"
+    if year:
+        conditions.append(f"publication_date.dt.year == {int(year)}")
+        description += f" en {year}"
+    args = {
+        "columns_to_select": ["ship_name", "ship_type", "master_name", column, "publication_date"],
+        "filter_conditions": " and ".join(conditions),
+        "sort_by": [{"column": "publication_date", "order": "asc"}],
+        "query_description": description + ".",
+    }
+    return HIGH_CONFIDENCE, {"intent": "text", "skill": "get_tabular_data", "args": args}
+
+
+def _rule_ships_by_master(normalized: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """'Barcos del capitán Smith' -> get_tabular_data con filtro por master_name."""
+    match = _SHIPS_BY_MASTER_RE.match(normalized)
+    if not match:
+        return None
+    masters = _lookup_values("master_name", match.group("name"))
+    if masters is None:
+        return LOW_CONFIDENCE, {}
+    master = masters[0]
+    args = {
+        "columns_to_select": ["ship_name", "ship_type", "master_name", "travel_departure_port", "publication_date"],
+        "filter_conditions": _equality_condition("master_name", masters),
+        "sort_by": [{"column": "publication_date", "order": "asc"}],
+        "query_description": f"Barcos comandados por el capitán {master}.",
+    }
+    return HIGH_CONFIDENCE, {"intent": "text", "skill": "get_tabular_data", "args": args}
+
+
+def _rule_count_by_group(normalized: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """'¿Cuántos barcos hay por tipo?' / 'Número de registros por año' -> count_by_group."""
+    match = _COUNT_BY_GROUP_RE.match(normalized)
+    if not match:
+        return None
+    dimension = match.group("dim").strip(" .")
+    column = next((col for pattern, col in GROUP_BY_SYNONYMS if re.fullmatch(pattern, dimension)), None)
+    if column is None:
+        return None
+    label = COLUMN_LABELS.get(column, column.replace("_", " ").title())
+    args = {
+        "group_by": column,
+        "query_description": f"Número de registros por {label.lower()}.",
+    }
+    return HIGH_CONFIDENCE, {"intent": "text", "skill": "count_by_group", "args": args}
+
+
+RULES = [
+    ("top_n_plot", _rule_top_n_plot),
+    ("ship_data", _rule_ship_data),
+    ("ships_by_master", _rule_ships_by_master),
+    ("ships_from_port", _rule_ships_from_port),
+    ("count_by_group", _rule_count_by_group),
+]
+
+
+def _record(outcome: str, rule: Optional[str] = None) -> None:
+    with _stats_lock:
+        _stats[outcome] += 1
+        if rule is not None:
+            _stats["by_rule"][rule] = _stats["by_rule"].get(rule, 0) + 1
+
+
+def route_query(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Intenta enrutar la consulta sin LLM. Devuelve un diccionario con el mismo
+    formato que el moderador ('intent', 'pandasai_query', 'skill_call') más
+    'route' y 'confidence', o None si el moderador debe usar el LLM.
+    """
+    if not settings.FAST_ROUTER_ENABLED or not query:
+        return None
+
+    normalized = normalize_text(query)
+    # Se evalúan todas las reglas y gana la de mayor confianza: una regla que encaja
+    # con confianza baja no debe ocultar a otra posterior que encaja con confianza alta.
+    best: Optional[Tuple[float, str, Dict[str, Any]]] = None
+    for rule_name, rule in RULES:
+        try:
+            result = rule(normalized)
+        except Exception as e:
+            logger.exception(f"FastRouter: Error en la regla '{rule_name}': {e}")
+            continue
+        if result is None:
+            continue
+        confidence, routed = result
+        if best is None or confidence > best[0]:
+            best = (confidence, rule_name, routed)
+
+    if best is None:
+        logger.debug(f"FastRouter: Sin coincidencia para '{normalized}'.")
+        _record("misses")
+        return None
+
+    confidence, rule_name, routed = best
+    if confidence < settings.FAST_ROUTER_MIN_CONFIDENCE:
+        logger.info(f"FastRouter: Regla '{rule_name}' con confianza baja ({confidence}). Se usará el LLM.")
+        _record("low_confidence")
+        _record("misses")
+        return None
+    response = {
+        "intent": routed["intent"],
+        "pandasai_query": _format_skill_query(routed["skill"], routed["args"]),
+        "skill_call": {"name": routed["skill"], "args": routed["args"]},
+        "route": rule_name,
+        "confidence": confidence,
+    }
+    logger.info(f"FastRouter: Acierto con regla '{rule_name}' (confianza={confidence}): {response['pandasai_query']}")
+    _record("hits", rule_name)
+    return response
+
+
+def get_router_stats() -> Dict[str, Any]:
+    """Devuelve los contadores de aciertos/fallos y la tasa de aciertos del pre-enrutador."""
+    with _stats_lock:
+        total = _stats["hits"] + _stats["misses"]
+        return {
+            "enabled": settings.FAST_ROUTER_ENABLED,
+            "hits": _stats["hits"],
+            "misses": _stats["misses"],
+            "low_confidence": _stats["low_confidence"],
+            "hit_rate": round(_stats["hits"] / total, 4) if total else 0.0,
+            "by_rule": dict(_stats["by_rule"]),
+        }
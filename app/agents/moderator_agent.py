@@ -1,8 +1,11 @@
+import asyncio
 import json
 import re
 import logging
-from typing import Dict, Optional, Any
+from typing import Any, Dict, Optional, Tuple
 from app.core.llm import get_llm
+from app.agents import fast_router
+from app.pandasai_utils.skills import validate_skill_call
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.messages import SystemMessage, HumanMessage
 
@@ -29,11 +32,24 @@ SYSTEM_INSTRUCTIONS = """**Tarea:** Eres un asistente experto en traducir consul
     *   `chart_title`: Título para el gráfico (ej. `'Top 15 Puertos de Salida'`).
     *   `normalize_ship_types`: Booleano. Poner a `True` **solo** si `column_name` es `'ship_type'` y se desea ver nombres completos en el gráfico.
     *   `query_description`: Breve descripción en texto de la operación.
+3.  **`search_keywords(df, keywords, columns_to_search, columns_to_select, limit, query_description)`**:
+    *   Usa esta habilidad para buscar palabras en el texto libre (`parsed_text`, `cargo_list`), ej. "tormenta", "cacao", "azúcar". No distingue mayúsculas, acentos ni plurales.
+    *   `keywords`: Palabras separadas por espacios (deben aparecer todas), `OR` entre alternativas y frases exactas entre comillas dobles (ej. `'cacao OR azucar'`).
+    *   `columns_to_search`: Lista con `'parsed_text'` y/o `'cargo_list'`. Omitir para buscar en ambas (usa `['cargo_list']` para preguntas sobre la carga).
+    *   `columns_to_select`: Columnas a devolver (siempre se añade `row_id`). Omitir para todas.
+    *   `limit`: Número entero para limitar filas. Omitir si no hay límite.
+    *   `query_description`: Breve descripción en texto de la operación.
+4.  **`count_by_group(df, group_by, top_n, ascending, query_description)`**:
+    *   Usa esta habilidad para contar registros por grupo (ej. "¿cuántos barcos hay de cada tipo?", "los 5 puertos de llegada con más arribos", "registros por año").
+    *   `group_by`: Columna por la que agrupar (ej. `'ship_type'`, `'travel_departure_port'`, `'travel_arrival_port'`, `'news_section'`), o `'publication_year'` / `'publication_month'` para agrupar por año o mes de publicación.
+    *   `top_n`: Número de grupos a devolver. Omitir para todos.
+    *   `ascending`: `True` para los grupos menos frecuentes primero. Omitir en los demás casos.
+    *   `query_description`: Breve descripción en texto de la operación.
 
 **Instrucciones Detalladas para Formular `pandasai_query`:**
 1.  **Determina la Intención (`intent`):** 'visual' si se pide un gráfico, 'text' en los demás casos.
 2.  **Si es `intent: 'text'` (obtener datos):**
-    *   **SIEMPRE** usa la habilidad `get_tabular_data`.
+    *   **SIEMPRE** usa la habilidad `get_tabular_data`, salvo que haya que buscar palabras dentro del texto libre (entonces usa `search_keywords`) o contar registros por grupo sin filtros (entonces usa `count_by_group`).
     *   Analiza la consulta del usuario para extraer `columns_to_select`, `filter_conditions`, `sort_by` y `limit`.
     *   **Ejemplo:** Usuario "Lista los nombres de los barcos que llegaron a La Habana en 1851, ordenados por fecha de publicación."
         *   La `pandasai_query` que debes generar para PandasAI es un string como este: "Usa la habilidad `get_tabular_data` con el DataFrame `df`, `columns_to_select=['ship_name', 'publication_date']`, `filter_conditions=\"df['travel_arrival_port'] == 'La Habana' and df['publication_date'].dt.year == 1851\"`, `sort_by=[{{'column': 'publication_date', 'order': 'asc'}}]`, y `query_description='Nombres de barcos llegados a La Habana en 1851 ordenados.'`"
@@ -47,21 +63,25 @@ SYSTEM_INSTRUCTIONS = """**Tarea:** Eres un asistente experto en traducir consul
         *   La `pandasai_query` que debes generar para PandasAI es un string como este: "Usa la habilidad `plot_top_n_frequencies` con el DataFrame `df`, `column_name='ship_type'`, `top_n=10`, `chart_title='Top 10 Tipos de Barco por Frecuencia'`, `normalize_ship_types=True`, y `query_description='Gráfico de los 10 tipos de barco más comunes.'`"
 4.  **Si la consulta es muy general o no encaja en las habilidades (Fallback):**
     *   Puedes generar una `pandasai_query` directa para PandasAI (ej. "Calcula el promedio de df['travel_duration_days'] y devuelve solo el número."). Esto debería ser menos común.
+5.  **Búsqueda de un registro concreto (`search_query`):** El texto proviene de OCR y los nombres suelen estar partidos o mal escritos (ej. "Philadel phia", "borg ing."). Si la consulta busca UN registro concreto descrito de forma aproximada (ej. "la noticia del bergantín que trajo cacao de Philadel phia"), genera en `search_query` una frase corta con esas entidades para una búsqueda vectorial sobre `parsed_text`; solo servirá para acotar las filas candidatas. Mantén **SIEMPRE** en `filter_conditions` todos los filtros de la consulta, incluidos los nombres (para nombres con ruido de OCR usa `columna.str.contains('fragmento', case=False)`). Para conteos, gráficos, rankings o listas de todos los registros de un barco, capitán o puerto, `search_query` debe ser `null`, igual que en los demás casos.
 
-**Formato de Salida Requerido:** Responde **ÚNICAMENTE** con un objeto JSON válido con las claves: "intent" (string: 'text' o 'visual') y "pandasai_query" (string).
+**Formato de Salida Requerido:** Responde **ÚNICAMENTE** con un objeto JSON válido con las claves: "intent" (string: 'text' o 'visual'), "pandasai_query" (string), "skill_call" y "search_query" (string o `null`, ver instrucción 5).
+*   `skill_call`: Si usas una habilidad, un objeto `{{"name": <nombre de la habilidad>, "args": {{<argumentos con sus tipos JSON>}}}}` con los MISMOS argumentos que describes en `pandasai_query` (sin `df`). En `args`, `filter_conditions` usa la sintaxis de `df.query()` con los nombres de columna directamente (ej. `"ship_type == 'berg. am.' and publication_date.dt.year == 1851"`). Si la consulta es un Fallback sin habilidad, `skill_call` debe ser `null`.
 
 **Ejemplo Salida 1 (Pide Datos con Skill) - ESTO ES LO QUE DEBES GENERAR:**
 ```json
 {{
   "intent": "text",
-  "pandasai_query": "Usa la habilidad `get_tabular_data` con el DataFrame `df`, `columns_to_select=['ship_name', 'publication_date']`, `filter_conditions=df['master_name'] == 'Smith' and df['travel_departure_port'] == 'Nueva York'`, `sort_by=[{{'column': 'publication_date', 'order': 'asc'}}]`, `query_description='Barcos del Cap. Smith desde Nueva York.'`"
+  "pandasai_query": "Usa la habilidad `get_tabular_data` con el DataFrame `df`, `columns_to_select=['ship_name', 'publication_date']`, `filter_conditions=df['master_name'] == 'Smith' and df['travel_departure_port'] == 'Nueva York'`, `sort_by=[{{'column': 'publication_date', 'order': 'asc'}}]`, `query_description='Barcos del Cap. Smith desde Nueva York.'`",
+  "skill_call": {{"name": "get_tabular_data", "args": {{"columns_to_select": ["ship_name", "publication_date"], "filter_conditions": "master_name == 'Smith' and travel_departure_port == 'Nueva York'", "sort_by": [{{"column": "publication_date", "order": "asc"}}], "query_description": "Barcos del Cap. Smith desde Nueva York."}}}}
 }}
 
 **Ejemplo Salida 2 (Pide Gráfico con Skill) - ESTO ES LO QUE DEBES GENERAR:**
 ```json
 {{
   "intent": "visual",
-  "pandasai_query": "Usa la habilidad `plot_top_n_frequencies` con el DataFrame `df`, `column_name='travel_departure_port'`, `top_n=5`, `chart_title='Top 5 Puertos de Salida Más Comunes'`, `normalize_ship_types=False`, `query_description='Gráfico de los 5 puertos de salida más comunes.'`"
+  "pandasai_query": "Usa la habilidad `plot_top_n_frequencies` con el DataFrame `df`, `column_name='travel_departure_port'`, `top_n=5`, `chart_title='Top 5 Puertos de Salida Más Comunes'`, `normalize_ship_types=False`, `query_description='Gráfico de los 5 puertos de salida más comunes.'`",
+  "skill_call": {{"name": "plot_top_n_frequencies", "args": {{"column_name": "travel_departure_port", "top_n": 5, "chart_title": "Top 5 Puertos de Salida Más Comunes", "normalize_ship_types": false, "query_description": "Gráfico de los 5 puertos de salida más comunes."}}}}
 }}
 
 ```
@@ -70,16 +90,18 @@ SYSTEM_INSTRUCTIONS = """**Tarea:** Eres un asistente experto en traducir consul
 ```json
 {{
   "intent": "text",
-  "pandasai_query": "Usa la habilidad `get_tabular_data` con el DataFrame `df`, `columns_to_select=['ship_type']`, `filter_conditions=\"df['travel_arrival_port'] == 'La Habana'\"`, `query_description='Lista de ship_type de barcos que entraron a La Habana.'`"
+  "pandasai_query": "Usa la habilidad `get_tabular_data` con el DataFrame `df`, `columns_to_select=['ship_type']`, `filter_conditions=\"df['travel_arrival_port'] == 'La Habana'\"`, `query_description='Lista de ship_type de barcos que entraron a La Habana.'`",
+  "skill_call": {{"name": "get_tabular_data", "args": {{"columns_to_select": ["ship_type"], "filter_conditions": "travel_arrival_port == 'La Habana'", "query_description": "Lista de ship_type de barcos que entraron a La Habana."}}}}
 }}
 
 ```
 
-**Ejemplo Salida 4 (Busca en Texto y pide columnas específicas - Fallback sin Skill) - ESTO ES LO QUE DEBES GENERAR:**
+**Ejemplo Salida 4 (Busca en Texto y pide columnas específicas con Skill) - ESTO ES LO QUE DEBES GENERAR:**
 ```json
 {{
   "intent": "text",
-  "pandasai_query": "Devuelve un DataFrame con las columnas 'ship_name' y 'parsed_text' de df donde la columna df['parsed_text'] contenga la palabra 'tormenta'."
+  "pandasai_query": "Usa la habilidad `search_keywords` con el DataFrame `df`, `keywords='tormenta'`, `columns_to_search=['parsed_text']`, `columns_to_select=['ship_name', 'parsed_text']`, y `query_description='Registros cuyo texto menciona una tormenta.'`",
+  "skill_call": {{"name": "search_keywords", "args": {{"keywords": "tormenta", "columns_to_search": ["parsed_text"], "columns_to_select": ["ship_name", "parsed_text"], "query_description": "Registros cuyo texto menciona una tormenta."}}}}
 }}
 
 ```
@@ -104,52 +126,87 @@ try:
 except Exception as e:
     logger.exception(f"Error CRÍTICO al crear ChatPromptTemplate para Moderador: {e}.")
 
-def analyze_query(query: str) -> Dict[str, Any]:
-    """
-    Analiza la consulta, determina la intención final, y genera
-    la consulta optimizada para PandasAI.
-    """
-    logger.info(f"Moderador: Iniciando análisis para query: '{query}'")
-
+def _build_chain():
+    """Construye la cadena prompt | LLM del moderador, o None si no está disponible."""
     if prompt_template is None:
          logger.error("Plantilla de prompt del Moderador inválida. Usando fallback.")
-         return {"intent": "text", "pandasai_query": query}
+         return None
 
     llm = get_llm()
     if not llm:
         logger.error("Error Crítico: LLM no disponible para el agente moderador.")
-        return {"intent": "text", "pandasai_query": query}
+        return None
 
-    chain = prompt_template | llm
+    return prompt_template | llm
 
-    try:
-        logger.debug("Invocando cadena del moderador...")
-        response = chain.invoke({"query": query})
-        content = response.content
-        logger.info(f"Moderador: Respuesta cruda del LLM (primeros 500 chars):\n---\n{content[:500]}\n---")
+def _process_llm_content(content: str, query: str) -> Dict[str, Any]:
+    """Extrae, parsea y valida el JSON devuelto por el LLM moderador."""
+    logger.info(f"Moderador: Respuesta cruda del LLM (primeros 500 chars):\n---\n{content[:500]}\n---")
 
-        json_str = extract_json(content)
-        if json_str is None:
-            logger.error("No se pudo extraer JSON de la respuesta del LLM moderador.")
-            return {"intent": "text", "pandasai_query": query}
+    json_str = extract_json(content)
+    if json_str is None:
+        logger.error("No se pudo extraer JSON de la respuesta del LLM moderador.")
+        return {"intent": "text", "pandasai_query": query}
 
-        logger.debug(f"Moderador: String JSON a parsear:\n---\n{repr(json_str)}\n---")
+    logger.debug(f"Moderador: String JSON a parsear:\n---\n{repr(json_str)}\n---")
+    try:
         parsed_response = json.loads(json_str)
-        validated_response = validate_parsed_pandasai_response(parsed_response, query)
-        logger.info(f"Moderador: Análisis finalizado: {validated_response}")
-        return validated_response
-
     except json.JSONDecodeError as e:
         logger.error(f"Error Crítico: Fallo al parsear JSON: {e}")
         logger.error(f"Respuesta LLM que causó el error:\n{content}")
         return {"intent": "text", "pandasai_query": query}
+
+    try:
+        validated_response = validate_parsed_pandasai_response(parsed_response, query)
     except ValueError as e:
         logger.error(f"Error durante la validación de la respuesta parseada: {e}")
         return {"intent": "text", "pandasai_query": query}
+
+    logger.info(f"Moderador: Análisis finalizado: {validated_response}")
+    return validated_response
+
+def _prepare_analysis(query: str) -> Tuple[Optional[Dict[str, Any]], Any]:
+    """
+    Pre-proceso común: devuelve (resultado, None) si la consulta se resuelve sin LLM
+    (pre-enrutador o moderador no disponible), o (None, cadena) si hay que invocarlo.
+    """
+    fast_result = fast_router.route_query(query)
+    if fast_result is not None:
+        return fast_result, None
+
+    chain = _build_chain()
+    if chain is None:
+        return {"intent": "text", "pandasai_query": query}, None
+    return None, chain
+
+async def aanalyze_query(query: str) -> Dict[str, Any]:
+    """
+    Analiza la consulta, determina la intención final, y genera
+    la consulta optimizada para PandasAI. La llamada al LLM se hace con
+    'ainvoke' para no bloquear el event loop mientras se espera al proveedor.
+    """
+    logger.info(f"Moderador: Iniciando análisis para query: '{query}'")
+
+    result, chain = _prepare_analysis(query)
+    if chain is None:
+        return result
+
+    try:
+        logger.debug("Invocando cadena del moderador (ainvoke)...")
+        response = await chain.ainvoke({"query": query})
+        # HuggingFacePipeline (huggingface_local) es un LLM de texto y devuelve un str, no un mensaje
+        return _process_llm_content(getattr(response, "content", response), query)
     except Exception as e:
         logger.exception(f"Error Inesperado en el agente moderador: {e}")
         return {"intent": "text", "pandasai_query": query}
 
+def analyze_query(query: str) -> Dict[str, Any]:
+    """
+    Versión síncrona de aanalyze_query para scripts y pruebas manuales.
+    No debe llamarse desde código que ya corre dentro de un event loop.
+    """
+    return asyncio.run(aanalyze_query(query))
+
 def extract_json(content: str) -> Optional[str]:
     """Extrae el primer bloque JSON ```json ... ``` o el primer objeto JSON { ... }."""
     json_block_match = re.search(r"```json\s*(\{[\s\S]+?\})\s*```", content, re.DOTALL)
@@ -158,6 +215,10 @@ def extract_json(content: str) -> Optional[str]:
         logger.debug(f"JSON extraído (```json): {extracted[:100]}...")
         return extracted
     stripped_content = content.strip()
+    # Respuesta compuesta solo por el objeto JSON (puede contener objetos anidados, ej. skill_call)
+    if stripped_content.startswith('{') and stripped_content.endswith('}'):
+        logger.debug("Respuesta es un único objeto JSON.")
+        return stripped_content
     # Buscar un JSON que ocupe toda la línea o esté indentado
     json_object_match = re.search(r"^\s*(\{[\s\S]*?\})\s*$", stripped_content, re.MULTILINE)
     if json_object_match:
@@ -185,8 +246,22 @@ def validate_parsed_pandasai_response(parsed_response: Dict[str, Any], original_
         logger.warning(f"'pandasai_query' inválido o vacío. Usando original.")
         parsed_response["pandasai_query"] = original_query
 
+    # Validar la invocación estructurada de skill (si no es válida, se usa solo pandasai_query)
+    skill_call = parsed_response.get("skill_call")
+    if skill_call is not None:
+        try:
+            parsed_response["skill_call"] = validate_skill_call(skill_call)
+        except ValueError as e:
+            logger.warning(f"'skill_call' inválido ({e}). Se usará solo 'pandasai_query'.")
+            parsed_response["skill_call"] = None
+    else:
+        parsed_response["skill_call"] = None
+
+    # Consulta para la búsqueda vectorial (solo en búsquedas difusas por nombre o descripción)
+    search_query = parsed_response.get("search_query")
+    parsed_response["search_query"] = search_query.strip() if isinstance(search_query, str) and search_query.strip() else None
+
     # Añadir claves faltantes con None para consistencia del estado
     parsed_response.setdefault("filters", None) # Ya no lo generamos pero lo mantenemos None
-    parsed_response.setdefault("search_query", None) # Ya no lo generamos
 
     return parsed_response
\ No newline at end of file
@@ -1,9 +1,13 @@
 # app/agents/pandasai_agent.py
 import os
+import numpy as np
 import pandas as pd
 import logging
 import time
-from typing import Optional, Any, Dict, List # Añadido List para type hinting
+import queue
+import threading
+from contextlib import contextmanager
+from typing import Optional, Any, Dict, List, Iterator, Tuple # Añadido List para type hinting
 
 # Importar SmartDataframe
 try:
@@ -15,10 +19,12 @@ except ImportError:
 
 # --- Importaciones de la Aplicación ---
 from app.core.llm import get_llm
-from app.core.dataframe_loader import get_dataframe
+from app.core.dataframe_loader import get_dataframe, get_dataset_version, plain_text_view
 from app.core.config import settings
-from app.pandasai_utils.response_parsers import FullDataFrameResponseParser # Asegúrate que esta ruta sea correcta
-from app.pandasai_utils.skills import plot_top_n_frequencies, get_tabular_data
+from app.pandasai_utils.response_parsers import FullDataFrameResponseParser, dataframe_to_records # Asegúrate que esta ruta sea correcta
+from app.pandasai_utils.skills import plot_top_n_frequencies, get_tabular_data, search_keywords, count_by_group, execute_skill_call
+from app.pandasai_utils.code_sandbox import install_code_sandbox, pop_sandbox_failure, restrict_rows
+from app.core.code_cache import lookup_code, store_code, discard_code, schema_fingerprint
 
 logger = logging.getLogger(__name__)
 
@@ -43,108 +49,335 @@ FIELD_DESCRIPTIONS: Dict[str, str] = {
 }
 logger.info(f"Cargadas {len(FIELD_DESCRIPTIONS)} descripciones de campos para PandasAI.")
 
-# --- Singletons para el SmartDataframe y el LLM usado por PandasAI ---
-_smart_df_instance: Optional[SmartDataframe] = None
-_pandasai_llm_instance_cache = None
+# --- Pool de motores SmartDataframe ---
+# Un SmartDataframe guarda estado por consulta (contexto intermedio, memoria, último
+# código), así que no se comparte entre hilos: se mantiene un pool de instancias creadas
+# una sola vez por (configuración del LLM, versión del dataset), con las skills ya
+# registradas. Cada petición toma una instancia libre y la devuelve al terminar; el
+# DataFrame nunca se copia ni se reconstruye en la ruta de la petición.
+PANDASAI_SKILLS = (get_tabular_data, plot_top_n_frequencies, search_keywords, count_by_group)
 
-def _initialize_pandasai_components() -> Optional[SmartDataframe]:
-    global _smart_df_instance, _pandasai_llm_instance_cache
-    
-    # 1. Comprobar si la instancia ya existe y las configs son las mismas
-    if _smart_df_instance is not None and \
-       _pandasai_llm_instance_cache is not None and \
-       _pandasai_llm_instance_cache.temperature == settings.PANDASAI_TEMPERATURE and \
-       (not hasattr(_pandasai_llm_instance_cache, 'model_kwargs') or \
-        getattr(_pandasai_llm_instance_cache.model_kwargs, 'get', lambda k,d: d)('seed', None) == settings.PANDASAI_SEED):
-        logger.debug("Reutilizando instancia existente de SmartDataframe y LLM para PandasAI.")
-        # Asegurarse que los skills estén registrados incluso si se reutiliza la instancia
-        # (Podría ser redundante si no cambian, pero es seguro)
-        try:
-            if hasattr(_smart_df_instance, 'add_skills'):
-                # Podrías tener una bandera para no añadirlos múltiples veces si no es necesario
-                # o si add_skills maneja duplicados internamente (revisar doc de PandasAI)
-                _smart_df_instance.add_skills(get_tabular_data, plot_top_n_frequencies)
-                logger.debug("Skills verificados/re-añadidos a instancia de SmartDataframe cacheada.")
-            else:
-                logger.warning("Instancia cacheada de SmartDataframe no tiene 'add_skills'.")
-        except Exception as e_skill_cache:
-            logger.error(f"Error añadiendo skills a instancia cacheada: {e_skill_cache}")
-        return _smart_df_instance
-    
-    logger.info("PandasAI Agent: Inicializando componentes (SmartDataframe)...")
-
-    # Obtener LLM configurado con temperatura y seed desde settings
-    # Esto asegura que si las settings cambian, el LLM se reinstancia.
-    current_llm = get_llm(
-        temperature=settings.PANDASAI_TEMPERATURE,
-        seed=settings.PANDASAI_SEED
-    )
-    if not current_llm:
-        logger.error("No se pudo obtener LLM para PandasAI.")
-        _smart_df_instance = None # Asegurar que se resetee si falla
-        return None
-    _pandasai_llm_instance_cache = current_llm # Actualizar caché del LLM
-    logger.info(f"LLM obtenido/reutilizado para PandasAI con temp={settings.PANDASAI_TEMPERATURE}, seed={settings.PANDASAI_SEED}.")
+EngineKey = Tuple[str, str, float, Optional[int], Optional[str]]
 
-    base_df = get_dataframe()
-    if base_df is None:
-        logger.error("No se pudo obtener DataFrame base para PandasAI.")
-        _smart_df_instance = None
-        return None
-    logger.info(f"DataFrame base obtenido con {len(base_df)} filas.")
+def _engine_key() -> EngineKey:
+    """Identifica la configuración de los motores: proveedor, modelo, temperatura, seed y versión del dataset."""
+    provider = settings.LLM_PROVIDER
+    model_name = {"google": settings.GEMINI_MODEL_NAME, "openai": settings.OPENAI_MODEL_NAME}.get(provider, settings.HUGGINGFACE_MODEL_ID)
+    return (provider, model_name, settings.PANDASAI_TEMPERATURE, settings.PANDASAI_SEED, get_dataset_version())
 
-    try:
-        chart_dir = settings.PANDASAI_CHART_DIR_NAME
-        if not os.path.exists(chart_dir):
-            os.makedirs(chart_dir)
-            logger.info(f"Directorio de gráficos PandasAI creado: {chart_dir}")
 
-        # Crear el PandasConnector con el DataFrame y field_descriptions
-        # Usamos una copia del DataFrame para evitar modificaciones accidentales a la instancia global.
+class SmartDataframePool:
+    """Instancias de SmartDataframe para una misma configuración, con checkout seguro entre hilos."""
+
+    def __init__(self, key: EngineKey, llm: Any, base_df: pd.DataFrame, size: int):
+        self.key = key
+        self.size = max(1, size)
+        self._llm = llm
+        # El código generado por PandasAI trabaja con las columnas categóricas como texto
+        self._base_df = plain_text_view(base_df)
+        self._idle: "queue.Queue[SmartDataframe]" = queue.Queue()
+        self._created = 0
+        self._create_lock = threading.Lock()
+
+    def _create(self) -> SmartDataframe:
+        """Crea una instancia con las skills registradas y el paso de ejecución de código del sandbox."""
+        # Copia superficial: comparte los buffers de las columnas con la instancia global
+        # (no duplica memoria), pero añadir o reasignar columnas no la modifica.
         connector = PandasConnector(
-            {"original_df": base_df.copy()}, # PandasAI v2 espera un dict de DataFrames
+            {"original_df": self._base_df.copy(deep=False)}, # PandasAI v2 espera un dict de DataFrames
             field_descriptions=FIELD_DESCRIPTIONS,
-            name="HistoricoMaritimoConnector"
+            name="HistoricoMaritimoConnector",
         )
-        logger.info(f"PandasConnector inicializado con {len(FIELD_DESCRIPTIONS)} descripciones de campos.")
-
         sdf_config: Dict[str, Any] = {
-            "llm": _pandasai_llm_instance_cache,
+            "llm": self._llm,
             "verbose": settings.PANDASAI_VERBOSE,
             "enable_cache": settings.PANDASAI_ENABLE_CACHE,
             "save_charts": True, # Permitir a PandasAI guardar gráficos si la query lo indica
-            "save_charts_path": chart_dir,
+            "save_charts_path": settings.PANDASAI_CHART_DIR_NAME,
             "max_retries": settings.PANDASAI_MAX_RETRIES,
             "response_parser": FullDataFrameResponseParser, # Usar nuestro parser personalizado
             # PandasAI v2 ya no usa 'language' directamente en la config general del SmartDataframe.
             # Se gestiona a través del LLM o de los prompts.
-            # "custom_whitelisted_dependencies": [], # Añadir si se usan skills con dependencias no estándar
         }
+        smart_df = SmartDataframe(connector, config=sdf_config)
+        smart_df.add_skills(*PANDASAI_SKILLS)
+        # El código generado se ejecuta en procesos aislados con timeout y límite de memoria
+        sandboxed = install_code_sandbox(smart_df)
+        logger.info(f"SmartDataframe #{self._created + 1} creado para {self.key[:4]} (sandbox={'sí' if sandboxed else 'no'}).")
+        return smart_df
 
-        _smart_df_instance = SmartDataframe(
-            connector, # Pasar el conector
-            config=sdf_config
-        )
-        logger.info(f"SmartDataframe inicializado con PandasConnector y configuraciones: {sdf_config}")
-        return _smart_df_instance
+    @contextmanager
+    def checkout(self) -> Iterator[SmartDataframe]:
+        """Toma una instancia libre (creándola si el pool aún no está lleno) y la devuelve al salir."""
+        smart_df: Optional[SmartDataframe] = None
+        try:
+            smart_df = self._idle.get_nowait()
+        except queue.Empty:
+            with self._create_lock:
+                if self._created < self.size:
+                    smart_df = self._create()
+                    self._created += 1
+            if smart_df is None:
+                with _engine_stats_lock:
+                    _engine_stats["waits"] += 1
+                smart_df = self._idle.get()
+        with _engine_stats_lock:
+            _engine_stats["checkouts"] += 1
+        try:
+            yield smart_df
+        finally:
+            self._idle.put(smart_df)
 
-    except ImportError: # Ya se maneja al inicio del archivo, pero por si acaso.
-        logger.error("Falta la librería 'pandasai'. Ejecuta pip install pandasai")
-        raise
-    except Exception as e:
-        logger.exception(f"Error crítico al inicializar SmartDataframe: {e}")
-        _smart_df_instance = None # Resetear en caso de fallo
+    def describe(self) -> Dict[str, Any]:
+        return {"size": self.size, "created": self._created, "idle": self._idle.qsize()}
+
+
+_engine_pool: Optional[SmartDataframePool] = None
+_engine_pool_lock = threading.Lock()
+_engine_stats_lock = threading.Lock()
+_engine_stats: Dict[str, int] = {"checkouts": 0, "waits": 0, "pool_builds": 0}
+
+def get_engine_pool() -> Optional[SmartDataframePool]:
+    """
+    Devuelve el pool de motores para la configuración actual, creándolo la primera vez o
+    cuando cambian el LLM de PandasAI o la versión del dataset. None si falta el LLM o los datos.
+    """
+    global _engine_pool
+    key = _engine_key()
+    pool = _engine_pool
+    if pool is not None and pool.key == key:
+        return pool
+    with _engine_pool_lock:
+        if _engine_pool is not None and _engine_pool.key == key:
+            return _engine_pool
+        logger.info("PandasAI Agent: Inicializando pool de motores SmartDataframe...")
+        # Obtener LLM configurado con temperatura y seed desde settings
+        llm = get_llm(temperature=settings.PANDASAI_TEMPERATURE, seed=settings.PANDASAI_SEED)
+        if not llm:
+            logger.error("No se pudo obtener LLM para PandasAI.")
+            return None
+        base_df = get_dataframe()
+        if base_df is None:
+            logger.error("No se pudo obtener DataFrame base para PandasAI.")
+            return None
+        chart_dir = settings.PANDASAI_CHART_DIR_NAME
+        if not os.path.exists(chart_dir):
+            os.makedirs(chart_dir)
+            logger.info(f"Directorio de gráficos PandasAI creado: {chart_dir}")
+        # Las instancias del pool anterior que estén en uso terminan su consulta y se descartan
+        _engine_pool = SmartDataframePool(key, llm, base_df, settings.PANDASAI_ENGINE_POOL_SIZE)
+        with _engine_stats_lock:
+            _engine_stats["pool_builds"] += 1
+        logger.info(f"Pool de motores PandasAI listo (hasta {_engine_pool.size} instancias, {len(base_df)} filas, "
+                    f"temp={settings.PANDASAI_TEMPERATURE}, seed={settings.PANDASAI_SEED}).")
+        return _engine_pool
+
+def get_engine_pool_stats() -> Dict[str, Any]:
+    """Checkouts, esperas por una instancia libre y estado del pool de motores SmartDataframe."""
+    with _engine_stats_lock:
+        stats: Dict[str, Any] = dict(_engine_stats)
+    pool = _engine_pool
+    stats.update(pool.describe() if pool is not None else {"size": settings.PANDASAI_ENGINE_POOL_SIZE, "created": 0, "idle": 0})
+    return stats
+
+def _fill_output_from_response(response_data: Any, output: Dict[str, Any]) -> None:
+    """Clasifica la respuesta (de PandasAI o de una skill directa) en los campos del estado."""
+    # Las skills ejecutadas directamente devuelven DataFrames/Series sin pasar por el ResponseParser
+    if isinstance(response_data, pd.DataFrame):
+        response_data = dataframe_to_records(response_data)
+    elif isinstance(response_data, pd.Series):
+        response_data = dataframe_to_records(response_data.to_frame(name=response_data.name or 'value'))
+
+    if isinstance(response_data, bytes):
+        # Gráfico renderizado en memoria por una skill ejecutada directamente
+        output["pandasai_plot_bytes"] = response_data
+        output["pandasai_plot_mime"] = "image/svg+xml" if response_data.lstrip().startswith(b"<") else "image/png"
+        output["pandasai_result_type"] = "plot"
+        output["pandasai_result"] = "Se generó un gráfico."
+        logger.info(f"Skill devolvió un gráfico en memoria ({len(response_data)} bytes).")
+
+    elif isinstance(response_data, str) and (settings.PANDASAI_CHART_DIR_NAME in response_data or response_data.endswith((".png", ".jpg", ".jpeg", ".svg", ".pdf"))):
+        # PandasAI solo devuelve gráficos como rutas: se leen a memoria y se borra el archivo aquí,
+        # para que el resto del flujo no dependa del disco ni deje archivos huérfanos.
+        logger.info(f"PandasAI (post-parser) devolvió una ruta de gráfico: {response_data}")
+        try:
+            with open(response_data, "rb") as img_file:
+                output["pandasai_plot_bytes"] = img_file.read()
+            output["pandasai_plot_mime"] = "image/svg+xml" if response_data.endswith(".svg") else "image/png"
+            output["pandasai_result_type"] = "plot"
+            output["pandasai_result"] = "Se generó un gráfico."
+        except OSError as e:
+            logger.error(f"No se pudo leer el gráfico generado por PandasAI ({response_data}): {e}")
+            output["pandasai_error"] = "Se intentó generar un gráfico, pero ocurrió un problema al guardarlo o encontrarlo."
+        finally:
+            try:
+                os.remove(response_data)
+            except OSError:
+                pass
+    
+    elif isinstance(response_data, list): # Asumimos lista de diccionarios del parser
+        output["pandasai_result"] = response_data
+        output["pandasai_result_type"] = "list_of_dicts"
+        count = len(response_data)
+        logger.info(f"PandasAI (post-parser) devolvió una lista con {count} elementos.")
+        if count > 0 and not isinstance(response_data[0], dict):
+            logger.warning("La lista devuelta no contiene diccionarios como se esperaba.")
+    
+    elif isinstance(response_data, (str, int, float, bool, dict)):
+        output["pandasai_result"] = response_data
+        output["pandasai_result_type"] = type(response_data).__name__.lower()
+        logger.info(f"PandasAI (post-parser) devolvió un tipo estándar: {output['pandasai_result_type']}, valor: {str(response_data)[:200]}...")
+
+    elif response_data is None:
+         logger.warning("PandasAI (post-parser) devolvió None como respuesta.")
+         output["pandasai_result"] = None # El Contextualizador decidirá cómo presentarlo
+         output["pandasai_result_type"] = "none"
+    
+    else: 
+         logger.warning(f"PandasAI (post-parser) devolvió un tipo inesperado: {type(response_data)}. Se intentará convertir a string.")
+         try:
+             output["pandasai_result"] = str(response_data)
+         except Exception as str_conv_error:
+             logger.error(f"No se pudo convertir el tipo inesperado {type(response_data)} a string: {str_conv_error}")
+             output["pandasai_result"] = f"Respuesta de tipo no manejable: {type(response_data)}"
+         output["pandasai_result_type"] = "string_fallback"
+
+def _log_output_summary(output: Dict[str, Any]) -> None:
+    """Loguea el resultado final del nodo de forma resumida."""
+    log_summary: Dict[str, Any] = {}
+    for k, v in output.items():
+        if k == 'pandasai_plot_bytes' and v is not None:
+            log_summary[k] = f"bytes (len={len(v)})"
+        elif k == 'pandasai_result' and v is not None:
+            if isinstance(v, list):
+                log_summary[k] = f"list_of_dicts (len={len(v)})"
+            else:
+                log_summary[k] = f"{type(v).__name__} (value_snippet='{str(v)[:50]}...')"
+        else:
+            log_summary[k] = v
+    logger.info(f"PandasAI Agent: Salida del nodo: {log_summary}")
+
+def _row_positions(base_df: pd.DataFrame, row_ids: Optional[List[int]]) -> Optional[np.ndarray]:
+    """Posiciones (ordenadas) de las etiquetas de fila recuperadas, o None si no hay ninguna válida."""
+    if not row_ids:
+        return None
+    positions = base_df.index.get_indexer(row_ids)
+    positions = np.sort(positions[positions >= 0])
+    if positions.size == 0:
+        logger.warning("PandasAI Agent: Ninguna de las filas recuperadas existe en el DataFrame; se usa completo.")
         return None
+    return positions
 
-def run_pandasai(query: Optional[str]) -> Dict[str, Any]:
+@contextmanager
+def _restricted_to_rows(smart_df: SmartDataframe, positions: Optional[np.ndarray]) -> Iterator[None]:
+    """Limita temporalmente la instancia (y el sandbox de este hilo) a las filas indicadas."""
+    if positions is None:
+        yield
+        return
+    connector = smart_df._agent.context.dfs[0]
+    full_df = connector.pandas_df
+    connector.pandas_df = full_df.iloc[positions]
+    try:
+        with restrict_rows(positions.tolist()):
+            yield
+    finally:
+        connector.pandas_df = full_df
+
+def run_skill_call(skill_call: Dict[str, Any], row_ids: Optional[List[int]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Ejecuta directamente la skill indicada por el moderador sobre el DataFrame
+    cacheado (o sobre las filas recuperadas, si las hay), sin la ronda extra de
+    generación de código de PandasAI.
+    Devuelve None si la invocación no es válida (se debe usar PandasAI como fallback).
+    """
+    output: Dict[str, Any] = {
+        "pandasai_result": None,
+        "pandasai_result_type": None,
+        "pandasai_plot_bytes": None,
+        "pandasai_plot_mime": None,
+        "pandasai_error": None
+    }
+
+    base_df = get_dataframe()
+    if base_df is None:
+        logger.error("PandasAI Agent: DataFrame base no disponible para la ejecución directa de skills.")
+        output["pandasai_error"] = "Error interno: DataFrame de datos no disponible."
+        return output
+
+    positions = _row_positions(base_df, row_ids)
+    target_df = base_df.iloc[positions] if positions is not None else base_df
+
+    start_time = time.time()
+    try:
+        response_data = execute_skill_call(target_df, skill_call)
+        if positions is not None and isinstance(response_data, pd.DataFrame) and response_data.empty:
+            # Los filtros de la consulta se mantienen: sobre el DataFrame completo siguen siendo correctos
+            logger.info("PandasAI Agent: Sin resultados en las filas recuperadas; se repite sobre el DataFrame completo.")
+            target_df = base_df
+            response_data = execute_skill_call(target_df, skill_call)
+    except ValueError as e:
+        logger.warning(f"PandasAI Agent: Invocación de skill inválida ({e}). Se usará PandasAI como fallback.")
+        return None
+    except Exception as e:
+        logger.exception(f"PandasAI Agent: Error ejecutando la skill '{skill_call.get('name')}' directamente: {e}")
+        output["pandasai_error"] = f"Error ejecutando la consulta: {str(e)[:300]}"
+        return output
+
+    logger.info(f"PandasAI Agent: Skill '{skill_call.get('name')}' ejecutada directamente sobre {len(target_df)} filas en {time.time() - start_time:.3f}s.")
+    _fill_output_from_response(response_data, output)
+    _log_output_summary(output)
+    return output
+
+def _successful_code(smart_df: SmartDataframe) -> Optional[str]:
+    """Código (antes de la limpieza de PandasAI) que se ejecutó con éxito en la última llamada, o None."""
+    return smart_df._agent.context.get("last_successful_code") or None
+
+def _chat_with_code_cache(smart_df: SmartDataframe, query: str) -> Any:
+    """
+    Responde la consulta re-ejecutando el código cacheado para ella si existe (sin generar
+    código con el LLM); si no hay entrada o el código cacheado falla, usa smart_df.chat()
+    y guarda el código que terminó ejecutándose con éxito.
+    """
+    fingerprint = schema_fingerprint(get_dataframe(), FIELD_DESCRIPTIONS)
+    cached_code = lookup_code(query, fingerprint)
+    if cached_code:
+        response_data = smart_df._agent.execute_code(cached_code)
+        code = _successful_code(smart_df)
+        if code:
+            logger.info("PandasAI Agent: Consulta respondida con código cacheado (sin generación con el LLM).")
+            if code != cached_code: # Corregido por el framework de corrección de errores
+                store_code(query, fingerprint, code)
+            return response_data
+        logger.warning("PandasAI Agent: El código cacheado para la consulta ya no se ejecuta correctamente; se descarta y se regenera.")
+        discard_code(query, fingerprint)
+        pop_sandbox_failure()
+
+    response_data = smart_df.chat(query)
+    code = _successful_code(smart_df)
+    if code:
+        store_code(query, fingerprint, code)
+    return response_data
+
+def run_pandasai(query: Optional[str], skill_call: Optional[Dict[str, Any]] = None,
+                 row_ids: Optional[List[int]] = None) -> Dict[str, Any]:
     """
     Ejecuta una consulta en lenguaje natural usando PandasAI y devuelve
     un diccionario estructurado con el resultado, tipo, ruta de plot y error.
+    Si se recibe una invocación estructurada de skill ('skill_call'), se ejecuta
+    directamente y SmartDataframe.chat solo se usa como fallback.
+    Si se reciben 'row_ids' (etiquetas de las filas recuperadas por el nodo FAISS),
+    la skill o el código generado se ejecutan solo sobre esas filas.
     """
+    if skill_call:
+        direct_output = run_skill_call(skill_call, row_ids)
+        if direct_output is not None:
+            return direct_output
+
     output: Dict[str, Any] = {
         "pandasai_result": None,
         "pandasai_result_type": None,
-        "pandasai_plot_path": None,
+        "pandasai_plot_bytes": None,
+        "pandasai_plot_mime": None,
         "pandasai_error": None
     }
 
@@ -159,8 +392,8 @@ def run_pandasai(query: Optional[str]) -> Dict[str, Any]:
     # Ejemplo: "Responde en español. {query_del_moderador_para_pandasai}"
     logger.info(f"PandasAI Agent: Ejecutando query (recibida del Moderador): '{query}'")
     
-    smart_df = _initialize_pandasai_components()
-    if smart_df is None:
+    engine_pool = get_engine_pool()
+    if engine_pool is None:
         logger.error("PandasAI Agent: SmartDataframe no está disponible (falló la inicialización).")
         output["pandasai_error"] = "Error interno: Falla al inicializar el motor de PandasAI."
         return output
@@ -168,63 +401,30 @@ def run_pandasai(query: Optional[str]) -> Dict[str, Any]:
     start_time = time.time()
     try:
         # La respuesta ya vendrá procesada por FullDataFrameResponseParser
-        response_data: Any = smart_df.chat(query)
+        pop_sandbox_failure() # Descartar fallos de consultas anteriores en este hilo
+        positions = _row_positions(get_dataframe(), row_ids)
+        with engine_pool.checkout() as smart_df, _restricted_to_rows(smart_df, positions):
+            response_data: Any = _chat_with_code_cache(smart_df, query)
         end_time = time.time()
         
-        logger.info(f"PandasAI Agent: Respuesta recibida de smart_df.chat() (post-parser) en {end_time - start_time:.2f}s. Tipo: {type(response_data)}")
-
-        # Procesamiento de la respuesta (ya formateada por el ResponseParser)
-        if isinstance(response_data, str) and (settings.PANDASAI_CHART_DIR_NAME in response_data or response_data.endswith((".png", ".jpg", ".jpeg", ".svg", ".pdf"))):
-            output["pandasai_plot_path"] = response_data
-            output["pandasai_result_type"] = "plot_path"
-            # El Contextualizador puede generar un mensaje más elaborado si lo desea.
-            output["pandasai_result"] = f"Se generó un gráfico y se guardó en: {response_data}" 
-            logger.info(f"PandasAI (post-parser) devolvió una ruta de gráfico: {response_data}")
-        
-        elif isinstance(response_data, list): # Asumimos lista de diccionarios del parser
-            output["pandasai_result"] = response_data
-            output["pandasai_result_type"] = "list_of_dicts"
-            count = len(response_data)
-            logger.info(f"PandasAI (post-parser) devolvió una lista con {count} elementos.")
-            if count > 0 and not isinstance(response_data[0], dict):
-                logger.warning("La lista devuelta no contiene diccionarios como se esperaba.")
-        
-        elif isinstance(response_data, (str, int, float, bool, dict)):
-            output["pandasai_result"] = response_data
-            output["pandasai_result_type"] = type(response_data).__name__.lower()
-            logger.info(f"PandasAI (post-parser) devolvió un tipo estándar: {output['pandasai_result_type']}, valor: {str(response_data)[:200]}...")
-
-        elif response_data is None:
-             logger.warning("PandasAI (post-parser) devolvió None como respuesta.")
-             output["pandasai_result"] = None # El Contextualizador decidirá cómo presentarlo
-             output["pandasai_result_type"] = "none"
-        
-        else: 
-             logger.warning(f"PandasAI (post-parser) devolvió un tipo inesperado: {type(response_data)}. Se intentará convertir a string.")
-             try:
-                 output["pandasai_result"] = str(response_data)
-             except Exception as str_conv_error:
-                 logger.error(f"No se pudo convertir el tipo inesperado {type(response_data)} a string: {str_conv_error}")
-                 output["pandasai_result"] = f"Respuesta de tipo no manejable: {type(response_data)}"
-             output["pandasai_result_type"] = "string_fallback"
+        logger.info(f"PandasAI Agent: Respuesta recibida de PandasAI (post-parser) en {end_time - start_time:.2f}s. Tipo: {type(response_data)}")
+
+        # PandasAI convierte las excepciones en un texto de respuesta: un timeout o la caída
+        # del proceso del sandbox se reportan como error en lugar de como resultado.
+        sandbox_failure = pop_sandbox_failure()
+        if sandbox_failure:
+            logger.error(f"PandasAI Agent: Ejecución de código cancelada en el sandbox: {sandbox_failure}")
+            output["pandasai_error"] = sandbox_failure
+        else:
+            # Procesamiento de la respuesta (ya formateada por el ResponseParser)
+            _fill_output_from_response(response_data, output)
 
     except Exception as e:
         end_time = time.time()
         logger.exception(f"PandasAI Agent: Error ({end_time - start_time:.2f}s) durante la ejecución de la consulta '{query}': {e}")
         output["pandasai_error"] = f"Error ejecutando la consulta con PandasAI: {str(e)[:300]}"
 
-    # Loguear el resultado final del nodo de forma resumida
-    log_summary: Dict[str, Any] = {}
-    for k, v in output.items():
-        if k == 'pandasai_result' and v is not None:
-            if isinstance(v, list):
-                log_summary[k] = f"list_of_dicts (len={len(v)})"
-            else:
-                log_summary[k] = f"{type(v).__name__} (value_snippet='{str(v)[:50]}...')"
-        else:
-            log_summary[k] = v
-    logger.info(f"PandasAI Agent: Salida del nodo: {log_summary}")
-    
+    _log_output_summary(output)
     return output
 
 # Función para limpiar la caché de PandasAI si es necesario (opcional)
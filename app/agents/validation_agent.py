@@ -1,10 +1,9 @@
 # app/agents/validation_agent.py
 import json
 import logging
-import base64
-import os
 import re # Si usas extract_json
 from typing import Optional, Tuple, Dict, Any
+from app.pandasai_utils.charts import to_data_uri
 from app.core.llm import get_llm # Todavía puede usarse para validar texto SI es necesario
 from langchain_core.prompts import ChatPromptTemplate
 # from .moderator_agent import extract_json # Asegúrate que esto esté definido/importado
@@ -23,14 +22,15 @@ def validate(
     original_query: str,
     summary_from_contextualizer: Optional[str], # Recibe el summary (puede ser None si hay plot/error)
     pandasai_error: Optional[str],          # Error directo de PandasAI
-    plot_path_from_pandasai: Optional[str]  # Ruta del plot directo de PandasAI
+    plot_bytes_from_pandasai: Optional[bytes], # Imagen del plot generada en memoria
+    plot_mime: str = "image/png"
 ) -> Tuple[Optional[str], Optional[str], Optional[str]]:
     """
     Valida la respuesta final. Prioriza errores, luego plots, luego texto.
-    Ahora toma 4 argumentos posicionales.
+    El gráfico llega como bytes en el estado: no hay archivos que leer ni borrar.
     """
     logger.info("Validador (PandasAI-only): Iniciando validación final...")
-    logger.debug(f"  Recibido: PlotPath={plot_path_from_pandasai}, Error={pandasai_error}, Summary={summary_from_contextualizer}")
+    logger.debug(f"  Recibido: PlotBytes={len(plot_bytes_from_pandasai) if plot_bytes_from_pandasai else None}, Error={pandasai_error}, Summary={summary_from_contextualizer}")
     final_text: Optional[str] = None
     final_image: Optional[str] = None
     error_message: Optional[str] = None
@@ -41,32 +41,17 @@ def validate(
         error_message = f"Lo siento, ocurrió un error al procesar tu consulta con el análisis de datos: {pandasai_error}"
         return None, None, error_message # Salir temprano
 
-    # 2. Manejar Gráfico Generado por PandasAI
-    if plot_path_from_pandasai:
-        logger.info(f"Validador: Procesando ruta de gráfico: {plot_path_from_pandasai}")
-        if os.path.exists(plot_path_from_pandasai):
-            try:
-                # ... (lógica de codificación Base64 como antes) ...
-                with open(plot_path_from_pandasai, "rb") as img_file:
-                    img_bytes = img_file.read()
-                base64_encoded_string = base64.b64encode(img_bytes).decode('utf-8')
-                final_image = f"data:image/png;base64,{base64_encoded_string}"
-                final_text = summary_from_contextualizer or "Aquí tienes el gráfico solicitado:"
-                logger.info("Validador: Imagen codificada exitosamente.")
-                # ... (lógica de eliminación de archivo temporal como antes) ...
-                try:
-                     os.remove(plot_path_from_pandasai)
-                     logger.info(f"Archivo de gráfico temporal eliminado: {plot_path_from_pandasai}")
-                except OSError as e:
-                     logger.warning(f"No se pudo eliminar el archivo de gráfico temporal {plot_path_from_pandasai}: {e}")
-                return final_text, final_image, None
-            except Exception as e:
-                # ... (manejo de error de codificación como antes) ...
-                error_message = "Error interno al procesar el gráfico generado."
-                return None, None, error_message
-        else:
-            # ... (manejo de error si la ruta no existe como antes) ...
-            error_message = "Se intentó generar un gráfico, pero ocurrió un problema al guardarlo o encontrarlo."
+    # 2. Manejar Gráfico Generado
+    if plot_bytes_from_pandasai:
+        logger.info(f"Validador: Procesando gráfico en memoria ({len(plot_bytes_from_pandasai)} bytes, {plot_mime}).")
+        try:
+            final_image = to_data_uri(plot_bytes_from_pandasai, plot_mime)
+            final_text = summary_from_contextualizer or "Aquí tienes el gráfico solicitado:"
+            logger.info("Validador: Imagen codificada exitosamente.")
+            return final_text, final_image, None
+        except Exception as e:
+            logger.exception(f"Validador: Error codificando el gráfico: {e}")
+            error_message = "Error interno al procesar el gráfico generado."
             return None, None, error_message
 
     # 3. Manejar Respuesta Textual (summary del contextualizador)
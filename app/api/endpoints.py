@@ -1,6 +1,23 @@
-from fastapi import APIRouter, HTTPException, Request, status
+from fastapi import APIRouter, HTTPException, Request, Response, status
 from app.api.schemas import QueryRequest, QueryResponse
 from app.orchestration.graph_state import GraphState
+from app.core.executors import get_executor_stats, run_in_cpu_executor
+from app.agents.fast_router import get_router_stats
+from app.core.llm_cache import get_llm_cache_stats, purge_llm_cache
+from app.core.code_cache import get_code_cache_stats, purge_code_cache
+from app.core import semantic_cache, chart_cache
+from app.core.dataframe_loader import get_memory_report, get_dataset_version, load_and_preprocess_dataframe
+from app.core.aggregates import get_aggregates_stats
+from app.core.chart_store import put_chart, get_chart, get_chart_store_stats
+from app.pandasai_utils.charts import from_data_uri
+from app.pandasai_utils.chart_renderer import get_chart_renderer_stats
+from app.pandasai_utils.duckdb_engine import get_duckdb_engine_stats
+from app.pandasai_utils.filter_compiler import get_filter_compiler_stats
+from app.pandasai_utils.code_sandbox import get_code_sandbox_stats
+from app.agents.pandasai_agent import get_engine_pool_stats
+from app.vector_store.faiss_store import get_retrieval_stats
+from app.vector_store.hybrid_retriever import get_hybrid_retrieval_stats
+from typing import Any, Dict
 import logging # Usar logging es mejor que prints para producción
 
 # Configurar un logger básico para este módulo
@@ -39,17 +56,11 @@ async def process_query(request_data: QueryRequest, request: Request) -> QueryRe
     # --- Invocar el grafo Langraph ---
     final_state: GraphState = None # Inicializar para evitar errores si invoke falla
     try:
-        logger.info("Invocando el grafo Langraph...")
-        # .invoke() es síncrono por defecto en muchas implementaciones de Langgraph.
-        # Si tu grafo tuviera pasos asíncronos, usarías await compiled_graph.ainvoke(initial_state)
-        # Aquí asumimos que nuestros nodos (incluyendo llamadas LLM y ejecución de código)
-        # son síncronos o manejados síncronamente por Langchain/Langgraph.
-        # Si las llamadas LLM o la ejecución son muy largas, podrían bloquear el
-        # event loop de FastAPI. Considera ejecutar invoke en un threadpool si es necesario:
-        # from fastapi.concurrency import run_in_threadpool
-        # final_state = await run_in_threadpool(compiled_graph.invoke, initial_state)
-
-        final_state = compiled_graph.invoke(initial_state)
+        logger.info("Invocando el grafo Langraph (ainvoke)...")
+        # Los nodos del grafo son asíncronos y delegan el trabajo bloqueante
+        # (PandasAI, skills, gráficos) a un executor acotado, de modo que
+        # varias consultas concurrentes solapan sus esperas de E/S.
+        final_state = await compiled_graph.ainvoke(initial_state)
 
         logger.info("Invocación del grafo completada.")
         # logger.debug(f"Estado final del grafo: {final_state}") # Log detallado (cuidado con datos sensibles)
@@ -82,10 +93,139 @@ async def process_query(request_data: QueryRequest, request: Request) -> QueryRe
         # por ejemplo 400 si la consulta no se pudo procesar por ser inválida.
         # Pero por ahora, lo incluimos en la respuesta 200 OK con el campo error.
         return QueryResponse(error=error_message)
+    elif final_image and request_data.image_delivery == "url":
+        # Entrega por URL: el gráfico se sirve como bytes en GET /api/charts/{id}
+        plot_bytes = final_state.get("pandasai_plot_bytes")
+        decoded = (plot_bytes, final_state.get("pandasai_plot_mime") or "image/png") if plot_bytes else from_data_uri(final_image)
+        if decoded:
+            chart_id = put_chart(*decoded)
+            return QueryResponse(
+                text_response=final_text,
+                image_url=str(request.url_for("get_chart_image", chart_id=chart_id))
+            )
+        logger.warning("No se pudo preparar la entrega por URL del gráfico. Se devuelve como Data URI.")
+        return QueryResponse(text_response=final_text, image_response=final_image)
     else:
         # Si no hay error, devolver el texto y/o la imagen
         return QueryResponse(
             text_response=final_text,
             image_response=final_image
             # error es None por defecto
-        )
\ No newline at end of file
+        )
+
+
+@router.get(
+    "/charts/{chart_id}",
+    summary="Obtener un gráfico generado",
+    description="Devuelve los bytes (PNG/SVG) de un gráfico entregado con image_delivery='url'. Los enlaces caducan tras CHART_STORE_TTL_SECONDS.",
+    tags=["Consulta Multiagente"],
+    response_class=Response,
+    name="get_chart_image"
+)
+async def get_chart_image(chart_id: str, request: Request) -> Response:
+    """Sirve un gráfico del almacén en memoria con ETag y Cache-Control."""
+    chart = get_chart(chart_id)
+    if chart is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Gráfico no encontrado o caducado.")
+    data, mime_type, ttl_remaining = chart
+    etag = f'"{chart_id}"'
+    headers = {
+        "ETag": etag,
+        # El contenido de un id nunca cambia (es su hash), pero el enlace caduca
+        "Cache-Control": f"private, max-age={max(int(ttl_remaining), 0)}, immutable",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=data, media_type=mime_type, headers=headers)
+
+
+@router.get(
+    "/stats",
+    summary="Métricas internas del servicio",
+    description="Devuelve métricas simples de los componentes internos (executor de tareas bloqueantes, pre-enrutador, cachés, etc.).",
+    tags=["Administración"]
+)
+async def get_stats() -> Dict[str, Any]:
+    """Endpoint de observabilidad con métricas de los componentes internos."""
+    return {
+        "executor": get_executor_stats(),
+        "fast_router": get_router_stats(),
+        "llm_cache": get_llm_cache_stats(),
+        "code_cache": get_code_cache_stats(),
+        "semantic_cache": semantic_cache.get_semantic_cache_stats(),
+        "dataframe_memory": get_memory_report(),
+        "aggregates": get_aggregates_stats(),
+        "tabular_engine": get_duckdb_engine_stats(),
+        "filter_compiler": get_filter_compiler_stats(),
+        "chart_cache": chart_cache.get_chart_cache_stats(),
+        "chart_store": get_chart_store_stats(),
+        "chart_renderer": get_chart_renderer_stats(),
+        "code_sandbox": get_code_sandbox_stats(),
+        "pandasai_engines": get_engine_pool_stats(),
+        "retrieval": get_retrieval_stats(),
+        "hybrid_retrieval": get_hybrid_retrieval_stats(),
+    }
+
+
+@router.post(
+    "/admin/dataset/reload",
+    summary="Recargar el dataset",
+    description="Vuelve a leer el CSV configurado. Si su contenido cambió, cambia la versión del dataset y se invalidan las cachés e índices derivados.",
+    tags=["Administración"]
+)
+async def reload_dataset() -> Dict[str, Any]:
+    """Recarga el DataFrame desde el CSV y devuelve la versión anterior y la nueva."""
+    previous_version = get_dataset_version()
+    df = await run_in_cpu_executor(load_and_preprocess_dataframe, True)
+    if df is None:
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="No se pudo recargar el dataset.")
+    current_version = get_dataset_version()
+    return {"previous_version": previous_version, "version": current_version, "changed": previous_version != current_version}
+
+
+@router.delete(
+    "/admin/cache/llm",
+    summary="Purgar la caché de respuestas LLM",
+    description="Elimina todas las respuestas almacenadas en la caché persistente del LLM.",
+    tags=["Administración"]
+)
+async def purge_llm_response_cache() -> Dict[str, Any]:
+    """Purga la caché persistente de respuestas del LLM."""
+    deleted = purge_llm_cache()
+    return {"deleted_entries": deleted}
+
+
+@router.delete(
+    "/admin/cache/code",
+    summary="Purgar la caché de código de PandasAI",
+    description="Elimina todo el código generado por PandasAI almacenado para reutilizarse por consulta.",
+    tags=["Administración"]
+)
+async def purge_pandasai_code_cache() -> Dict[str, Any]:
+    """Purga la caché persistente de código generado por PandasAI."""
+    deleted = purge_code_cache()
+    return {"deleted_entries": deleted}
+
+
+@router.delete(
+    "/admin/cache/semantic",
+    summary="Purgar la caché semántica de respuestas",
+    description="Elimina todas las respuestas almacenadas en la caché semántica.",
+    tags=["Administración"]
+)
+async def purge_semantic_cache() -> Dict[str, Any]:
+    """Purga la caché semántica de respuestas finales."""
+    deleted = semantic_cache.clear()
+    return {"deleted_entries": deleted}
+
+
+@router.delete(
+    "/admin/cache/charts",
+    summary="Purgar la caché de gráficos renderizados",
+    description="Elimina todos los gráficos almacenados en la caché de renderizado.",
+    tags=["Administración"]
+)
+async def purge_chart_cache() -> Dict[str, Any]:
+    """Purga la caché de gráficos renderizados."""
+    deleted = chart_cache.clear()
+    return {"deleted_entries": deleted}
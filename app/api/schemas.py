@@ -1,13 +1,17 @@
 # app/api/schemas.py
 
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Optional, Literal
 
 class QueryRequest(BaseModel):
     """
     Modelo para la solicitud de consulta del usuario.
     """
     query: str = Field(..., description="La consulta del usuario en lenguaje natural.", min_length=3)
+    image_delivery: Literal["data_uri", "url"] = Field(
+        "data_uri",
+        description="Cómo entregar los gráficos: 'data_uri' (base64 en 'image_response') o 'url' (enlace de vida corta en 'image_url' servido por GET /api/charts/{id})."
+    )
     # Podríamos añadir otros campos opcionales aquí si fueran necesarios,
     # como user_id, session_id, o parámetros específicos de búsqueda.
 
@@ -18,11 +22,14 @@ class QueryResponse(BaseModel):
     """
     text_response: Optional[str] = Field(None, description="La respuesta textual generada por el sistema.")
     image_response: Optional[str] = Field(None, description="La imagen generada codificada en Base64 con prefijo Data URI (si aplica).")
+    image_url: Optional[str] = Field(None, description="URL de vida corta de la imagen generada (solo con image_delivery='url').")
     error: Optional[str] = Field(None, description="Mensaje de error si ocurrió un problema durante el procesamiento.")
 
     # Ejemplo de cómo podría verse una respuesta exitosa con texto:
     # { "text_response": "El capitán Litlejohn comandó el Charles Edwin.", "image_response": null, "error": null }
     # Ejemplo de cómo podría verse una respuesta exitosa con imagen:
     # { "text_response": "Aquí tienes la visualización generada:", "image_response": "data:image/png;base64,...", "error": null }
+    # Ejemplo con image_delivery='url':
+    # { "text_response": "Aquí tienes la visualización generada:", "image_url": "http://.../api/charts/3f9a...", "error": null }
     # Ejemplo de cómo podría verse una respuesta con error:
     # { "text_response": null, "image_response": null, "error": "Lo siento, ocurrió un error..." }
\ No newline at end of file
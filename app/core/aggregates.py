@@ -0,0 +1,137 @@
+# app/core/aggregates.py
+import time
+import logging
+import threading
+from typing import Optional, Dict, Callable, Any
+import pandas as pd
+from app.core.config import settings
+from app.core.dataframe_loader import get_dataframe, get_dataset_version
+
+logger = logging.getLogger(__name__)
+
+# Agregados materializados: conteos por las dimensiones más consultadas (tipo de barco,
+# puertos, sección y año/mes de publicación), calculados una vez al cargar el DataFrame.
+# Los top-N y los conteos agrupados se responden leyendo k filas de estas tablas en
+# lugar de recorrer la columna completa. Se reconstruyen cuando cambia la versión del dataset.
+
+# Dimensión -> función que extrae del DataFrame la serie a agrupar
+AGGREGATE_DIMENSIONS: Dict[str, Callable[[pd.DataFrame], pd.Series]] = {
+    "ship_type": lambda df: df["ship_type"],
+    "travel_departure_port": lambda df: df["travel_departure_port"],
+    "travel_arrival_port": lambda df: df["travel_arrival_port"],
+    "news_section": lambda df: df["news_section"],
+    "publication_year": lambda df: df["publication_date"].dt.year.astype("Int32"),
+    "publication_month": lambda df: df["publication_date"].dt.strftime("%Y-%m"),
+}
+# Columnas del DataFrame de las que depende cada dimensión derivada
+_SOURCE_COLUMNS: Dict[str, str] = {
+    "publication_year": "publication_date",
+    "publication_month": "publication_date",
+}
+
+
+def compute_counts(df: pd.DataFrame, dimension: str) -> pd.Series:
+    """
+    Conteo de filas por valor de 'dimension' (sin nulos ni valores con cero filas),
+    ordenado de mayor a menor frecuencia. Lanza ValueError si la dimensión no aplica a 'df'.
+    """
+    source = _SOURCE_COLUMNS.get(dimension, dimension)
+    if source not in df.columns:
+        raise ValueError(f"Columna '{source}' no encontrada en el DataFrame.")
+    extractor = AGGREGATE_DIMENSIONS.get(dimension, lambda frame: frame[dimension])
+    counts = extractor(df).value_counts(dropna=True)
+    counts = counts[counts > 0] # Las columnas categóricas incluyen categorías sin filas
+    counts.index = counts.index.astype(object)
+    return counts.astype("int64")
+
+
+class MaterializedAggregates:
+    """Tablas de conteo por dimensión para una versión concreta del dataset."""
+
+    def __init__(self, counts: Dict[str, pd.Series], num_rows: int, dataset_version: Optional[str]):
+        self.counts = counts
+        self.num_rows = num_rows
+        self.dataset_version = dataset_version
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, dataset_version: Optional[str] = None) -> "MaterializedAggregates":
+        counts: Dict[str, pd.Series] = {}
+        for dimension in AGGREGATE_DIMENSIONS:
+            try:
+                counts[dimension] = compute_counts(df, dimension)
+            except ValueError as e:
+                logger.warning(f"Agregado '{dimension}' omitido: {e}")
+        return cls(counts, len(df), dataset_version)
+
+    def top(self, dimension: str, top_n: Optional[int] = None, ascending: bool = False) -> Optional[pd.Series]:
+        """Los 'top_n' valores más (o menos) frecuentes de la dimensión, o None si no está materializada."""
+        counts = self.counts.get(dimension)
+        if counts is None:
+            return None
+        if ascending:
+            counts = counts.iloc[::-1]
+        return counts if top_n is None else counts.iloc[:top_n]
+
+
+# --- Singleton ligado a la versión del dataset ---
+_aggregates_instance: Optional[MaterializedAggregates] = None
+_aggregates_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats: Dict[str, Any] = {"hits": 0, "fallbacks": 0, "builds": 0, "build_seconds": None}
+
+
+def get_aggregates() -> Optional[MaterializedAggregates]:
+    """
+    Devuelve los agregados del DataFrame cargado, construyéndolos (de nuevo) si aún no
+    existen o si la versión del dataset cambió. None si están deshabilitados o no hay datos.
+    """
+    global _aggregates_instance
+    if not settings.MATERIALIZED_AGGREGATES_ENABLED:
+        return None
+    version = get_dataset_version()
+    if _aggregates_instance is not None and _aggregates_instance.dataset_version == version:
+        return _aggregates_instance
+    with _aggregates_lock:
+        if _aggregates_instance is not None and _aggregates_instance.dataset_version == version:
+            return _aggregates_instance
+        df = get_dataframe()
+        if df is None:
+            return None
+        start = time.perf_counter()
+        _aggregates_instance = MaterializedAggregates.build(df, dataset_version=version)
+        elapsed = time.perf_counter() - start
+        _stats["builds"] += 1
+        _stats["build_seconds"] = round(elapsed, 4)
+        logger.info(f"Agregados materializados en {elapsed:.3f}s: { {dim: len(c) for dim, c in _aggregates_instance.counts.items()} }")
+        return _aggregates_instance
+
+
+def top_counts(df: pd.DataFrame, dimension: str, top_n: Optional[int] = None, ascending: bool = False) -> pd.Series:
+    """
+    Conteos por 'dimension' ordenados por frecuencia y limitados a 'top_n'. Sobre el
+    DataFrame cargado se leen de los agregados materializados; sobre cualquier otro
+    DataFrame (ej. un subconjunto filtrado) se calculan al vuelo.
+    """
+    aggregates = get_aggregates() if df is get_dataframe() else None
+    counts = aggregates.top(dimension, top_n, ascending) if aggregates is not None else None
+    if counts is not None:
+        with _stats_lock:
+            _stats["hits"] += 1
+        return counts
+    with _stats_lock:
+        _stats["fallbacks"] += 1
+    counts = compute_counts(df, dimension)
+    if ascending:
+        counts = counts.iloc[::-1]
+    return counts if top_n is None else counts.iloc[:top_n]
+
+
+def get_aggregates_stats() -> Dict[str, Any]:
+    """Consultas servidas desde los agregados, cálculos al vuelo y tamaño de cada tabla."""
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+    stats["enabled"] = settings.MATERIALIZED_AGGREGATES_ENABLED
+    instance = _aggregates_instance
+    stats["dataset_version"] = instance.dataset_version if instance is not None else None
+    stats["dimensions"] = {dim: len(c) for dim, c in instance.counts.items()} if instance is not None else {}
+    return stats
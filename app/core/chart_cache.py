@@ -0,0 +1,83 @@
+# app/core/chart_cache.py
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Caché de gráficos ya renderizados, indexada por (skill, argumentos normalizados,
+# versión del dataset, formato). Un gráfico repetido (ej. "Top 10 tipos de barco")
+# se sirve sin tocar pandas ni matplotlib. Desalojo LRU acotado por bytes.
+
+_lock = threading.Lock()
+_entries: "OrderedDict[str, bytes]" = OrderedDict()
+_total_bytes: int = 0
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def make_key(skill_name: str, args: Dict[str, Any], dataset_version: Optional[str], fmt: str) -> str:
+    """Clave estable: los argumentos se serializan con claves ordenadas."""
+    payload = json.dumps(
+        {"skill": skill_name, "args": args, "dataset": dataset_version, "format": fmt},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[bytes]:
+    """Devuelve el gráfico cacheado o None."""
+    if not settings.CHART_CACHE_ENABLED:
+        return None
+    with _lock:
+        data = _entries.get(key)
+        if data is None:
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return data
+
+
+def put(key: str, data: bytes) -> None:
+    """Guarda un gráfico, desalojando los menos usados si se supera CHART_CACHE_MAX_BYTES."""
+    global _total_bytes
+    if not settings.CHART_CACHE_ENABLED or len(data) > settings.CHART_CACHE_MAX_BYTES:
+        return
+    with _lock:
+        previous = _entries.pop(key, None)
+        if previous is not None:
+            _total_bytes -= len(previous)
+        _entries[key] = data
+        _total_bytes += len(data)
+        _stats["stores"] += 1
+        while _total_bytes > settings.CHART_CACHE_MAX_BYTES:
+            _, evicted = _entries.popitem(last=False)
+            _total_bytes -= len(evicted)
+            _stats["evictions"] += 1
+
+
+def clear() -> int:
+    """Vacía la caché. Devuelve el número de gráficos eliminados."""
+    global _total_bytes
+    with _lock:
+        removed = len(_entries)
+        _entries.clear()
+        _total_bytes = 0
+    logger.info(f"Caché de gráficos purgada: {removed} entradas eliminadas.")
+    return removed
+
+
+def get_chart_cache_stats() -> Dict[str, Any]:
+    """Devuelve contadores, número de gráficos y bytes ocupados."""
+    with _lock:
+        stats: Dict[str, Any] = dict(_stats)
+        stats["entries"] = len(_entries)
+        stats["bytes"] = _total_bytes
+    total = stats["hits"] + stats["misses"]
+    stats["enabled"] = settings.CHART_CACHE_ENABLED
+    stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+    return stats
@@ -0,0 +1,72 @@
+# app/core/chart_store.py
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Almacén en memoria, acotado y de vida corta, de los gráficos entregados por URL
+# (GET /api/charts/{id}) en lugar de incrustarlos como Data URI en el JSON.
+# El id es el hash del contenido: sirve también como ETag y deduplica gráficos iguales.
+
+_lock = threading.Lock()
+_charts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict() # id -> entrada (orden LRU)
+_total_bytes: int = 0
+_stats: Dict[str, int] = {"stores": 0, "hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+
+def _evict_locked(now: float) -> None:
+    """Elimina entradas caducadas y, si se superan los límites, las menos usadas (llamar con _lock)."""
+    global _total_bytes
+    for chart_id in [cid for cid, entry in _charts.items() if entry["expires_at"] <= now]:
+        _total_bytes -= len(_charts.pop(chart_id)["data"])
+        _stats["expired"] += 1
+    while _charts and (len(_charts) > settings.CHART_STORE_MAX_ENTRIES or _total_bytes > settings.CHART_STORE_MAX_BYTES):
+        _, entry = _charts.popitem(last=False)
+        _total_bytes -= len(entry["data"])
+        _stats["evictions"] += 1
+
+
+def put_chart(data: bytes, mime_type: str = "image/png") -> str:
+    """Guarda un gráfico y devuelve su id (renueva la caducidad si ya existía)."""
+    global _total_bytes
+    chart_id = hashlib.sha256(data).hexdigest()[:32]
+    now = time.time()
+    with _lock:
+        entry = _charts.pop(chart_id, None)
+        if entry is None:
+            _total_bytes += len(data)
+            entry = {"data": data, "mime_type": mime_type}
+        entry["expires_at"] = now + settings.CHART_STORE_TTL_SECONDS
+        _charts[chart_id] = entry
+        _stats["stores"] += 1
+        _evict_locked(now)
+    return chart_id
+
+
+def get_chart(chart_id: str) -> Optional[Tuple[bytes, str, float]]:
+    """Devuelve (bytes, tipo MIME, segundos de vida restantes), o None si no existe o caducó."""
+    now = time.time()
+    with _lock:
+        _evict_locked(now)
+        entry = _charts.get(chart_id)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _charts.move_to_end(chart_id)
+        _stats["hits"] += 1
+        return entry["data"], entry["mime_type"], entry["expires_at"] - now
+
+
+def get_chart_store_stats() -> Dict[str, Any]:
+    """Devuelve contadores, número de gráficos y bytes ocupados."""
+    with _lock:
+        _evict_locked(time.time())
+        stats: Dict[str, Any] = dict(_stats)
+        stats["entries"] = len(_charts)
+        stats["bytes"] = _total_bytes
+    return stats
@@ -0,0 +1,166 @@
+# app/core/code_cache.py
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import Optional, Dict, Any
+import pandas as pd
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Caché persistente (SQLite) del código pandas generado por PandasAI. Guarda, por
+# consulta normalizada, el código que se ejecutó con éxito (tras los reintentos de
+# corrección), de modo que la misma consulta se responde re-ejecutando ese código sobre
+# el DataFrame actual sin generar código con el LLM. La clave incluye una huella del
+# esquema (columnas, tipos y FIELD_DESCRIPTIONS): si cambia, las entradas anteriores
+# dejan de coincidir y se eliminan.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS code_cache (
+    key TEXT PRIMARY KEY,
+    schema_fingerprint TEXT NOT NULL,
+    query TEXT NOT NULL,
+    code TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_code_cache_last_access ON code_cache(last_access);
+CREATE INDEX IF NOT EXISTS idx_code_cache_fingerprint ON code_cache(schema_fingerprint);
+"""
+
+# --- Conexión compartida (singleton) y contadores ---
+_connection: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+_current_fingerprint: Optional[str] = None
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "writes": 0, "invalidated": 0, "stale": 0, "evictions": 0}
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Abre (una vez) la base SQLite de la caché de código."""
+    global _connection
+    if _connection is None:
+        db_path = settings.CODE_CACHE_PATH
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        _connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(_SCHEMA)
+        logger.info(f"Caché de código de PandasAI abierta en: {db_path}")
+    return _connection
+
+
+def normalize_query(query: str) -> str:
+    """Normaliza la consulta para la clave: minúsculas y espacios colapsados."""
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+def schema_fingerprint(df: pd.DataFrame, field_descriptions: Dict[str, str]) -> str:
+    """Huella del esquema visible para PandasAI: columnas, tipos y descripciones de campos."""
+    payload = {
+        "columns": [[str(col), str(dtype)] for col, dtype in df.dtypes.items()],
+        "field_descriptions": field_descriptions,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _key(query: str, fingerprint: str) -> str:
+    return hashlib.sha256(f"{fingerprint}\n{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+
+def _invalidate_other_schemas(conn: sqlite3.Connection, fingerprint: str) -> None:
+    """Elimina las entradas de otros esquemas la primera vez que se ve una huella (llamar con _db_lock)."""
+    global _current_fingerprint
+    if _current_fingerprint == fingerprint:
+        return
+    deleted = conn.execute("DELETE FROM code_cache WHERE schema_fingerprint != ?", (fingerprint,)).rowcount
+    _current_fingerprint = fingerprint
+    if deleted:
+        _stats["invalidated"] += deleted
+        logger.info(f"Caché de código: {deleted} entradas invalidadas por cambio de esquema.")
+
+
+def lookup_code(query: str, fingerprint: str) -> Optional[str]:
+    """Devuelve el código cacheado para la consulta y el esquema, o None."""
+    if not settings.CODE_CACHE_ENABLED:
+        return None
+    key = _key(query, fingerprint)
+    with _db_lock:
+        conn = _get_connection()
+        _invalidate_other_schemas(conn, fingerprint)
+        row = conn.execute("SELECT code FROM code_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            _stats["misses"] += 1
+            return None
+        conn.execute("UPDATE code_cache SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key))
+        _stats["hits"] += 1
+    return row[0]
+
+
+def store_code(query: str, fingerprint: str, code: str) -> None:
+    """Guarda el código ejecutado con éxito para la consulta y el esquema."""
+    if not settings.CODE_CACHE_ENABLED or not code or not code.strip():
+        return
+    now = time.time()
+    with _db_lock:
+        conn = _get_connection()
+        _invalidate_other_schemas(conn, fingerprint)
+        conn.execute(
+            "INSERT OR REPLACE INTO code_cache (key, schema_fingerprint, query, code, created_at, last_access, hits) VALUES (?, ?, ?, ?, ?, ?, 0)",
+            (_key(query, fingerprint), fingerprint, normalize_query(query), code, now, now),
+        )
+        _stats["writes"] += 1
+        _evict_if_needed(conn)
+
+
+def discard_code(query: str, fingerprint: str) -> None:
+    """Elimina una entrada cuyo código ya no se ejecuta correctamente."""
+    if not settings.CODE_CACHE_ENABLED:
+        return
+    with _db_lock:
+        _get_connection().execute("DELETE FROM code_cache WHERE key = ?", (_key(query, fingerprint),))
+        _stats["stale"] += 1
+
+
+def _evict_if_needed(conn: sqlite3.Connection) -> None:
+    """Desaloja las entradas menos usadas recientemente si se supera el máximo (llamar con _db_lock)."""
+    max_entries = settings.CODE_CACHE_MAX_ENTRIES
+    if max_entries <= 0:
+        return
+    (count,) = conn.execute("SELECT COUNT(*) FROM code_cache").fetchone()
+    excess = count - max_entries
+    if excess > 0:
+        conn.execute(
+            "DELETE FROM code_cache WHERE key IN (SELECT key FROM code_cache ORDER BY last_access ASC LIMIT ?)",
+            (excess,),
+        )
+        _stats["evictions"] += excess
+
+
+def purge_code_cache() -> int:
+    """Elimina todas las entradas de la caché. Devuelve el número de entradas borradas."""
+    with _db_lock:
+        deleted = _get_connection().execute("DELETE FROM code_cache").rowcount
+    logger.info(f"Caché de código de PandasAI purgada: {deleted} entradas eliminadas.")
+    return deleted
+
+
+def get_code_cache_stats() -> Dict[str, Any]:
+    """Devuelve contadores de aciertos/fallos, invalidaciones y el número de entradas."""
+    stats: Dict[str, Any] = {"enabled": settings.CODE_CACHE_ENABLED}
+    if not settings.CODE_CACHE_ENABLED:
+        return stats
+    with _db_lock:
+        (entries,) = _get_connection().execute("SELECT COUNT(*) FROM code_cache").fetchone()
+        stats.update(_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["entries"] = entries
+    stats["schema_fingerprint"] = _current_fingerprint
+    stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+    return stats
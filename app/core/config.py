@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Optional, Dict
 import os
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field, validator
@@ -43,10 +43,34 @@ class Settings(BaseSettings):
     # --- Configuración FAISS (Independiente del LLM) ---
     FAISS_INDEX_FOLDER: str = Field(default="vector_store_index", description="Carpeta que contiene los archivos del índice FAISS")
     FAISS_INDEX_NAME: str = Field(default="data_index", description="Nombre base de los archivos del índice FAISS (sin extensión)")
+    FAISS_ALLOW_PICKLE_DOCSTORE: bool = Field(default=False, description="Permitir cargar el docstore .pkl de LangChain (deserialización insegura) si no existe el docstore Arrow '<nombre>.docstore.arrow'")
+    FAISS_INDEX_VARIANT: Literal["flat", "hnsw", "ivfpq", "sq8"] = Field(default="flat", description="Variante del índice FAISS a cargar: 'flat' (exacta), 'hnsw', 'ivfpq' o 'sq8' (ver app/vector_store/index_builder.py)")
+    FAISS_HNSW_EF_SEARCH: int = Field(default=0, description="efSearch de la variante HNSW (0 = el valor elegido al construir el índice)")
+    FAISS_IVF_NPROBE: int = Field(default=0, description="nprobe de la variante IVF-PQ (0 = el valor elegido al construir el índice)")
+    RETRIEVAL_ENABLED: bool = Field(default=True, description="Acotar las búsquedas de un registro concreto (descripciones aproximadas, nombres con ruido de OCR) a las filas recuperadas por búsqueda vectorial; los conteos y gráficos usan siempre el DataFrame completo")
+    RETRIEVAL_TOP_K: int = Field(default=50, description="Número máximo de filas que recupera la búsqueda vectorial para acotar una consulta")
+    RETRIEVAL_MAX_DISTANCE: float = Field(default=1.2, description="Distancia L2 máxima (embeddings normalizados) para aceptar un resultado de la búsqueda vectorial (0 = sin umbral)")
+    FAISS_FILTER_CACHE_SIZE: int = Field(default=256, description="Número de bitmaps de filtros de metadatos (ids FAISS permitidos) que se mantienen en memoria para la búsqueda pre-filtrada")
+    RETRIEVAL_HYBRID_ENABLED: bool = Field(default=True, description="Recuperar con búsqueda híbrida (BM25 sobre parsed_text/cargo_list + FAISS, fusionadas con RRF) en lugar de solo FAISS")
+    HYBRID_CANDIDATES_PER_LEG: int = Field(default=100, description="Candidatos que aporta cada rama (BM25 y FAISS) a la fusión por rangos recíprocos")
+    HYBRID_RRF_K: int = Field(default=60, description="Constante k de la fusión por rangos recíprocos: puntuación = suma de 1 / (k + rango)")
+    HYBRID_LATENCY_BUDGET_MS: int = Field(default=300, description="Presupuesto de latencia (ms) de la búsqueda híbrida; la rama que no termina a tiempo se descarta (0 = esperar a ambas)")
+    HYBRID_MAX_IN_FLIGHT_PER_LEG: int = Field(default=4, description="Ejecuciones simultáneas de cada rama (incluidas las descartadas que aún no terminaron); con todas ocupadas la rama se omite en lugar de encolarse")
+    BM25_K1: float = Field(default=1.5, description="Parámetro k1 (saturación de la frecuencia de término) del índice BM25")
+    BM25_B: float = Field(default=0.75, description="Parámetro b (normalización por longitud del documento) del índice BM25")
+    HYBRID_MIN_BM25_SCORE: float = Field(default=1.0, description="Puntuación BM25 mínima para que una fila cuente como evidencia léxica (descarta coincidencias de solo palabras muy frecuentes)")
 
     # --- Configuración Ejecución de Código ---
     CODE_EXECUTION_TIMEOUT: int = Field(default=15, description="Timeout en segundos para ejecución de código Python")
+    CODE_EXECUTION_WORKERS: int = Field(default=2, description="Procesos aislados que ejecutan el código generado por PandasAI (0 = ejecutar en el proceso de la API, sin timeout)")
+    CODE_EXECUTION_MEMORY_LIMIT_MB: int = Field(default=2048, description="Límite de memoria (RLIMIT_AS) en MB de cada proceso de ejecución de código (0 = sin límite)")
     CSV_FILE_PATH: str = Field(default="data/DataLimpia.csv", description="Ruta al archivo CSV principal con los datos")
+    DATAFRAME_SNAPSHOT_ENABLED: bool = Field(default=True, description="Guardar/cargar un snapshot Arrow del DataFrame preprocesado para arranques rápidos")
+    DATAFRAME_SNAPSHOT_DIR: str = Field(default=".cache/dataframe_snapshots", description="Carpeta donde se guardan los snapshots del DataFrame")
+    DATAFRAME_COMPACT_DTYPES: bool = Field(default=True, description="Aplicar el plan de tipos compactos (categóricas, strings Arrow, enteros nullable) al cargar el DataFrame")
+    DATAFRAME_SECONDARY_INDEXES_ENABLED: bool = Field(default=True, description="Construir índices secundarios (valor -> filas) para filtros por igualdad en columnas de barco, capitán y puertos")
+    MATERIALIZED_AGGREGATES_ENABLED: bool = Field(default=True, description="Precalcular al cargar los datos los conteos por tipo de barco, puertos, sección y año/mes de publicación")
+    DATAFRAME_CATEGORICAL_MAX_RATIO: float = Field(default=0.5, description="Proporción máxima de valores únicos/filas para convertir una columna candidata en categórica")
     # --- Configuración del Modelo Pydantic ---
     model_config = SettingsConfigDict(
         env_file='.env',              # Nombre del archivo .env
@@ -62,6 +86,50 @@ class Settings(BaseSettings):
     PANDASAI_TEMPERATURE:float = Field(default=0.0, description="Temperatura para generación de texto en PandasAI")
     PANDASAI_SEED: int = Field(default=42, description="Seed para generación de texto en PandasAI")
     PANDASAI_LANGUAGE: str = Field(default="es", description="Idioma para generación de texto en PandasAI")
+    PANDASAI_ENGINE_POOL_SIZE: int = Field(default=4, description="Número máximo de instancias SmartDataframe del pool (una por consulta concurrente de PandasAI)")
+
+    # --- Configuración Concurrencia ---
+    CPU_EXECUTOR_MAX_WORKERS: int = Field(default=4, description="Número máximo de hilos para tareas bloqueantes (skills de pandas, PandasAI, gráficos)")
+
+    # --- Configuración Motor de Consultas Tabulares ---
+    TABULAR_ENGINE: Literal["pandas", "duckdb"] = Field(default="pandas", description="Motor de get_tabular_data: 'pandas' (df.eval) o 'duckdb' (filtro, orden y límite en SQL, multinúcleo)")
+    DUCKDB_THREADS: int = Field(default=0, description="Hilos de DuckDB para el motor tabular (0 = todos los núcleos)")
+    FILTER_COMPILER_CACHE_SIZE: int = Field(default=512, description="Número máximo de expresiones 'filter_conditions' compiladas que se mantienen en caché (desalojo LRU)")
+
+    # --- Configuración Caché de Respuestas LLM ---
+    LLM_CACHE_ENABLED: bool = Field(default=True, description="Habilitar la caché persistente (SQLite) de respuestas del LLM")
+    LLM_CACHE_PATH: str = Field(default=".cache/llm_cache.sqlite", description="Ruta del archivo SQLite de la caché de respuestas LLM")
+    LLM_CACHE_TTL_SECONDS: int = Field(default=7 * 24 * 3600, description="Tiempo de vida de las entradas de la caché LLM en segundos (0 = sin expiración)")
+    LLM_CACHE_MAX_ENTRIES: int = Field(default=10000, description="Número máximo de entradas de la caché LLM antes de desalojar por LRU (0 = sin límite)")
+
+    # --- Configuración Caché de Código de PandasAI ---
+    CODE_CACHE_ENABLED: bool = Field(default=True, description="Reutilizar el código pandas generado por PandasAI para la misma consulta y esquema (evita la generación con el LLM)")
+    CODE_CACHE_PATH: str = Field(default=".cache/pandasai_code_cache.sqlite", description="Ruta del archivo SQLite de la caché de código de PandasAI")
+    CODE_CACHE_MAX_ENTRIES: int = Field(default=2000, description="Número máximo de entradas de la caché de código antes de desalojar por LRU (0 = sin límite)")
+
+    # --- Configuración Caché Semántica de Respuestas ---
+    SEMANTIC_CACHE_ENABLED: bool = Field(default=True, description="Habilitar la caché semántica de respuestas finales (usa el modelo de embeddings)")
+    SEMANTIC_CACHE_THRESHOLD: float = Field(default=0.95, description="Similitud coseno mínima para reutilizar una respuesta cacheada")
+    SEMANTIC_CACHE_THRESHOLDS_BY_INTENT: Dict[str, float] = Field(default={"visual": 0.97}, description="Umbrales de similitud por intención (sobrescriben SEMANTIC_CACHE_THRESHOLD)")
+    SEMANTIC_CACHE_MAX_ENTRIES: int = Field(default=500, description="Número máximo de consultas en la caché semántica (desalojo LRU)")
+    SEMANTIC_CACHE_CANDIDATES: int = Field(default=5, description="Número de vecinos a examinar en cada búsqueda de la caché semántica")
+
+    # --- Configuración Renderizador de Gráficos ---
+    CHART_RENDER_PROCESSES: int = Field(default=2, description="Procesos del pool que renderiza gráficos con matplotlib (0 = renderizar en el hilo de la petición)")
+    CHART_RENDER_TIMEOUT: int = Field(default=30, description="Tiempo máximo en segundos para renderizar un gráfico en el pool")
+
+    # --- Configuración Caché de Gráficos Renderizados ---
+    CHART_CACHE_ENABLED: bool = Field(default=True, description="Reutilizar gráficos ya renderizados para la misma skill, argumentos y versión del dataset")
+    CHART_CACHE_MAX_BYTES: int = Field(default=32 * 1024 * 1024, description="Tamaño máximo total en bytes de la caché de gráficos (desalojo LRU)")
+
+    # --- Configuración Entrega de Gráficos por URL ---
+    CHART_STORE_TTL_SECONDS: int = Field(default=600, description="Tiempo de vida en segundos de los gráficos servidos en /api/charts/{id}")
+    CHART_STORE_MAX_ENTRIES: int = Field(default=200, description="Número máximo de gráficos en el almacén en memoria (desalojo LRU)")
+    CHART_STORE_MAX_BYTES: int = Field(default=64 * 1024 * 1024, description="Tamaño máximo total en bytes del almacén de gráficos")
+
+    # --- Configuración Pre-enrutador (Fast Path) ---
+    FAST_ROUTER_ENABLED: bool = Field(default=True, description="Habilitar el pre-enrutador determinista que evita el LLM moderador en consultas comunes")
+    FAST_ROUTER_MIN_CONFIDENCE: float = Field(default=0.8, description="Confianza mínima del pre-enrutador para omitir el LLM moderador")
 
     # --- Validadores (Opcional pero recomendado) ---
     @validator('GEMINI_API_KEY', 'OPENAI_API_KEY', pre=True, always=True)
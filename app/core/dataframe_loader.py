@@ -1,59 +1,390 @@
 # app/core/dataframe_loader.py
 import pandas as pd
+import numpy as np
 import os
+import json
+import hashlib
 import logging
-from typing import Optional
+import unicodedata
+from typing import Optional, Tuple, Dict, Any, List
 from app.core.config import settings # Usar la ruta configurada
 
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+    logging.getLogger(__name__).warning("Falta la librería 'pyarrow'. No se usarán snapshots del DataFrame. Ejecuta pip install pyarrow")
+
 logger = logging.getLogger(__name__)
 
+# Incrementar cuando cambie el preprocesamiento para invalidar los snapshots existentes
+SNAPSHOT_FORMAT_VERSION = 4
+
 _dataframe_instance: Optional[pd.DataFrame] = None
+_dataset_version: Optional[str] = None
+_secondary_indexes: Dict[str, Dict[Any, np.ndarray]] = {}
+_folded_index_keys: Dict[str, Dict[str, List[Any]]] = {}
+
+def compute_file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """Calcula el hash SHA-256 del contenido de un archivo."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_and_preprocess_csv(csv_path: str) -> pd.DataFrame:
+    """Lee el CSV y aplica el preprocesamiento esencial (fechas, duración numérica)."""
+    df = pd.read_csv(csv_path)
+    logger.info(f"DataFrame cargado inicialmente: {len(df)} filas.")
+
+    # --- Preprocesamiento Esencial ---
+    logger.info("Realizando preprocesamiento...")
+    date_columns = ['publication_date', 'travel_departure_date', 'travel_arrival_date']
+    for col in date_columns:
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], errors='coerce')
+
+    if 'travel_duration' in df.columns:
+         # Extraer solo dígitos, manejar no números resultando en NaN
+         df['travel_duration_days'] = pd.to_numeric(df['travel_duration'].astype(str).str.extract(r'(\d+)', expand=False), errors='coerce')
+         logger.info("  Columna 'travel_duration_days' (numérica) creada.")
+
+    # Llenar NaNs en columnas clave si es necesario (opcional)
+    # cols_to_fill = ['ship_name', 'master_name', 'travel_departure_port']
+    # for col in cols_to_fill:
+    #      if col in df.columns: df[col] = df[col].fillna('Desconocido')
+
+    if settings.DATAFRAME_COMPACT_DTYPES:
+        compact_df = apply_dtype_plan(df)
+        report = build_memory_report(df, compact_df)
+        logger.info(f"Plan de tipos aplicado: {report['total_bytes_before'] / 1e6:.2f} MB -> {report['total_bytes_after'] / 1e6:.2f} MB.")
+        _set_memory_report(report)
+        return compact_df
+    _set_memory_report(build_memory_report(df, df))
+    return df
+
+# --- Plan de tipos compactos ---
+# Columnas de baja cardinalidad candidatas a 'category'. Solo se convierten si la
+# proporción de valores únicos no supera DATAFRAME_CATEGORICAL_MAX_RATIO; si no,
+# se tratan como texto. Son categóricas ordenadas con las categorías en orden alfabético:
+# ordenar, min/max y '<'/'>' entre categorías siguen el orden de los strings. pandas solo
+# admite '<'/'>' contra valores que sean categorías: el compilador de filtros y el motor
+# DuckDB evalúan esas comparaciones sobre las categorías. El código generado por PandasAI
+# recibe estas columnas como texto (ver plain_text_view).
+CATEGORICAL_CANDIDATE_COLUMNS: List[str] = [
+    'news_section', 'ship_type', 'travel_arrival_port', 'travel_departure_port',
+    'master_role', 'ship_name',
+]
+# Texto libre: strings respaldados por Arrow (o 'string' de pandas si falta pyarrow)
+TEXT_COLUMNS: List[str] = ['parsed_text', 'cargo_list', 'master_name']
+NULLABLE_INTEGER_COLUMNS: Dict[str, str] = {'travel_duration_days': 'Int32'}
+
+_memory_report: Optional[Dict[str, Any]] = None
+
+def _text_dtype() -> str:
+    return "string[pyarrow]" if feather is not None else "string"
+
+def apply_dtype_plan(df: pd.DataFrame) -> pd.DataFrame:
+    """Devuelve el DataFrame con tipos compactos según el plan de columnas."""
+    converted: Dict[str, pd.Series] = {}
+    max_ratio = settings.DATAFRAME_CATEGORICAL_MAX_RATIO
+    for col in CATEGORICAL_CANDIDATE_COLUMNS:
+        if col not in df.columns:
+            continue
+        ratio = df[col].nunique(dropna=True) / max(len(df), 1)
+        if ratio <= max_ratio:
+            categories = sorted(df[col].dropna().unique(), key=str)
+            converted[col] = df[col].astype(pd.CategoricalDtype(categories, ordered=True))
+        else:
+            converted[col] = df[col].astype(_text_dtype())
+    for col in TEXT_COLUMNS:
+        if col in df.columns:
+            converted[col] = df[col].astype(_text_dtype())
+    for col, dtype in NULLABLE_INTEGER_COLUMNS.items():
+        if col in df.columns:
+            converted[col] = df[col].round().astype(dtype)
+    return df.assign(**converted)
+
+def plain_text_view(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Copia superficial con las columnas categóricas convertidas a texto (object), como
+    salen del CSV. Es el DataFrame que recibe el código generado por PandasAI, que asume
+    columnas de strings (fillna/asignación con valores nuevos, value_counts sin ceros).
+    """
+    view = df.copy(deep=False)
+    for col, dtype in df.dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            view[col] = df[col].astype(object)
+    return view
+
+def build_memory_report(before: pd.DataFrame, after: pd.DataFrame) -> Dict[str, Any]:
+    """Informe de memoria por columna (bytes y dtype antes/después del plan de tipos)."""
+    bytes_before = before.memory_usage(deep=True, index=False)
+    bytes_after = after.memory_usage(deep=True, index=False)
+    columns = {
+        col: {
+            "dtype_before": str(before[col].dtype),
+            "dtype_after": str(after[col].dtype),
+            "bytes_before": int(bytes_before[col]),
+            "bytes_after": int(bytes_after[col]),
+        }
+        for col in after.columns
+    }
+    return {
+        "rows": len(after),
+        "columns": columns,
+        "total_bytes_before": int(bytes_before.sum()),
+        "total_bytes_after": int(bytes_after.sum()),
+    }
+
+def _set_memory_report(report: Optional[Dict[str, Any]]) -> None:
+    global _memory_report
+    _memory_report = report
+
+# --- Índices secundarios para búsquedas por igualdad ---
+# Mapean cada valor exacto de la columna a las posiciones de fila donde aparece, para
+# resolver filtros "columna == 'valor'" sin recorrer todo el DataFrame. Solo aceleran la
+# igualdad exacta: el resultado es el mismo que el de df.query() sobre cualquier DataFrame.
+# La búsqueda sin mayúsculas ni acentos es una operación aparte (lookup_folded_index_positions)
+# que reutiliza el mismo índice a través de las variantes exactas de cada clave normalizada.
+INDEXED_COLUMNS: List[str] = [
+    'ship_name', 'master_name', 'travel_departure_port', 'travel_arrival_port', 'ship_type',
+]
+_EMPTY_POSITIONS = np.array([], dtype=np.int64)
+
+def normalize_index_key(value: Any) -> str:
+    """Clave para comparaciones aproximadas: minúsculas, sin acentos y con espacios colapsados."""
+    text = unicodedata.normalize("NFKD", str(value))
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(text.casefold().split())
+
+def build_secondary_indexes(df: pd.DataFrame) -> Dict[str, Dict[Any, np.ndarray]]:
+    """Construye los índices valor exacto -> posiciones de fila (ordenadas) de INDEXED_COLUMNS."""
+    indexes: Dict[str, Dict[Any, np.ndarray]] = {}
+    positions = pd.Series(np.arange(len(df), dtype=np.int64))
+    for col in INDEXED_COLUMNS:
+        if col not in df.columns:
+            continue
+        values = df[col].to_numpy(dtype=object)
+        indexes[col] = {value: rows.astype(np.int64) for value, rows in positions.groupby(values, sort=False, dropna=True).indices.items()}
+    logger.info(f"Índices secundarios construidos: { {col: len(index) for col, index in indexes.items()} }")
+    return indexes
+
+def _build_folded_keys(indexes: Dict[str, Dict[Any, np.ndarray]]) -> Dict[str, Dict[str, List[Any]]]:
+    """Clave normalizada -> valores exactos de cada índice (tamaño proporcional a la cardinalidad)."""
+    folded: Dict[str, Dict[str, List[Any]]] = {}
+    for col, index in indexes.items():
+        variants: Dict[str, List[Any]] = {}
+        for value in index:
+            variants.setdefault(normalize_index_key(value), []).append(value)
+        folded[col] = variants
+    return folded
+
+def _set_secondary_indexes(indexes: Dict[str, Dict[Any, np.ndarray]]) -> None:
+    global _secondary_indexes, _folded_index_keys
+    _secondary_indexes = indexes
+    _folded_index_keys = _build_folded_keys(indexes)
+
+def lookup_index_positions(df: pd.DataFrame, column: str, value: Any) -> Optional[np.ndarray]:
+    """
+    Devuelve las posiciones de fila donde 'column' es exactamente igual a 'value' (como
+    'column == value' en pandas), o None si no hay índice aplicable: la columna no está
+    indexada o 'df' no es la instancia cargada sobre la que se construyó el índice.
+    """
+    if df is not _dataframe_instance or column not in _secondary_indexes:
+        return None
+    try:
+        return _secondary_indexes[column].get(value, _EMPTY_POSITIONS)
+    except TypeError: # Valor no hashable: no hay índice aplicable
+        return None
+
+def lookup_folded_index_positions(df: pd.DataFrame, column: str, value: Any) -> Optional[np.ndarray]:
+    """
+    Como lookup_index_positions, pero sin distinguir mayúsculas ni acentos (normalize_index_key):
+    une las filas de todas las variantes exactas de la clave. None si no hay índice aplicable.
+    """
+    if df is not _dataframe_instance or column not in _secondary_indexes:
+        return None
+    variants = _folded_index_keys.get(column, {}).get(normalize_index_key(value), [])
+    if not variants:
+        return _EMPTY_POSITIONS
+    index = _secondary_indexes[column]
+    return np.sort(np.concatenate([index[variant] for variant in variants]))
+
+# --- Snapshot columnar (Arrow/Feather) del DataFrame preprocesado ---
+def _snapshot_paths(csv_path: str, snapshot_dir: str, csv_hash: Optional[str] = None) -> Tuple[str, str]:
+    """Devuelve (ruta del snapshot, ruta del manifiesto) para un CSV."""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    manifest_path = os.path.join(snapshot_dir, f"{stem}.manifest.json")
+    snapshot_path = os.path.join(snapshot_dir, f"{stem}-{(csv_hash or '')[:16]}.arrow")
+    return snapshot_path, manifest_path
 
-def load_and_preprocess_dataframe() -> Optional[pd.DataFrame]:
-    """Carga y preprocesa el DataFrame desde CSV (Singleton)."""
-    global _dataframe_instance
-    if _dataframe_instance is not None:
+def _read_manifest(manifest_path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Manifiesto de snapshot ilegible ({manifest_path}): {e}")
+        return None
+
+def resolve_csv_hash(csv_path: str, snapshot_dir: str) -> str:
+    """
+    Devuelve el hash del CSV. Si el manifiesto registra el mismo mtime y tamaño,
+    se reutiliza el hash guardado y se evita releer el archivo completo.
+    """
+    stat = os.stat(csv_path)
+    _, manifest_path = _snapshot_paths(csv_path, snapshot_dir)
+    manifest = _read_manifest(manifest_path)
+    if manifest and manifest.get("csv_mtime") == stat.st_mtime and manifest.get("csv_size") == stat.st_size:
+        return manifest["csv_sha256"]
+    return compute_file_hash(csv_path)
+
+def load_snapshot(csv_path: str, csv_hash: str, snapshot_dir: str) -> Optional[pd.DataFrame]:
+    """Carga el snapshot memory-mapped del DataFrame preprocesado si corresponde al CSV actual."""
+    if feather is None:
+        return None
+    snapshot_path, manifest_path = _snapshot_paths(csv_path, snapshot_dir, csv_hash)
+    manifest = _read_manifest(manifest_path)
+    if not manifest or manifest.get("csv_sha256") != csv_hash or manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+        return None
+    if manifest.get("compact_dtypes") != settings.DATAFRAME_COMPACT_DTYPES:
+        return None
+    if not os.path.exists(snapshot_path):
+        return None
+    try:
+        table = feather.read_table(snapshot_path, memory_map=True)
+        # Las columnas de texto vuelven como strings respaldados por Arrow (el metadato
+        # de pandas solo guarda 'string', sin el almacenamiento)
+        string_mapper = {pa.string(): pd.StringDtype("pyarrow"), pa.large_string(): pd.StringDtype("pyarrow")}
+        df = table.to_pandas(types_mapper=string_mapper.get if settings.DATAFRAME_COMPACT_DTYPES else None)
+        _set_memory_report(manifest.get("memory_report"))
+        logger.info(f"DataFrame cargado desde snapshot: {snapshot_path} ({len(df)} filas).")
+        return df
+    except Exception as e:
+        logger.warning(f"No se pudo leer el snapshot {snapshot_path}: {e}. Se releerá el CSV.")
+        return None
+
+def write_snapshot(df: pd.DataFrame, csv_path: str, csv_hash: str, snapshot_dir: str) -> Optional[str]:
+    """Escribe el snapshot (Feather sin compresión, apto para memory-map) y su manifiesto."""
+    if feather is None:
+        return None
+    snapshot_path, manifest_path = _snapshot_paths(csv_path, snapshot_dir, csv_hash)
+    try:
+        os.makedirs(snapshot_dir, exist_ok=True)
+        tmp_path = f"{snapshot_path}.tmp"
+        feather.write_feather(df, tmp_path, compression="uncompressed")
+        os.replace(tmp_path, snapshot_path)
+
+        stat = os.stat(csv_path)
+        previous = _read_manifest(manifest_path)
+        manifest = {
+            "csv_path": csv_path,
+            "csv_sha256": csv_hash,
+            "csv_mtime": stat.st_mtime,
+            "csv_size": stat.st_size,
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "compact_dtypes": settings.DATAFRAME_COMPACT_DTYPES,
+            "snapshot_file": os.path.basename(snapshot_path),
+            "memory_report": _memory_report,
+        }
+        with open(manifest_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        # Eliminar el snapshot anterior (y sus artefactos derivados) si apuntaba a otra versión del CSV
+        if previous and previous.get("snapshot_file") not in (None, manifest["snapshot_file"]):
+            old_prefix = os.path.splitext(previous["snapshot_file"])[0]
+            for name in os.listdir(snapshot_dir):
+                if name.startswith(old_prefix):
+                    os.remove(os.path.join(snapshot_dir, name))
+        logger.info(f"Snapshot del DataFrame escrito en: {snapshot_path}")
+        return snapshot_path
+    except Exception as e:
+        logger.warning(f"No se pudo escribir el snapshot del DataFrame: {e}")
+        return None
+
+def load_and_preprocess_dataframe(force_reload: bool = False) -> Optional[pd.DataFrame]:
+    """
+    Carga y preprocesa el DataFrame (Singleton). Si existe un snapshot Arrow
+    del CSV actual (mismo hash), se carga memory-mapped en lugar de re-parsear el CSV.
+    Con 'force_reload' vuelve a leer el CSV configurado (p. ej. tras actualizarlo): si su
+    contenido cambió, cambia la versión del dataset y se invalidan las cachés derivadas.
+    """
+    global _dataframe_instance, _dataset_version
+    if _dataframe_instance is not None and not force_reload:
         # logger.debug("Devolviendo instancia de DataFrame existente.")
         return _dataframe_instance
 
     csv_path = settings.CSV_FILE_PATH # Usar la ruta de la configuración
+    snapshot_dir = settings.DATAFRAME_SNAPSHOT_DIR
     logger.info(f"Cargando y preprocesando DataFrame desde: {csv_path}")
 
     if not os.path.exists(csv_path):
          logger.error(f"Error Crítico: El archivo CSV no existe en la ruta: {csv_path}")
          return None
     try:
-        df = pd.read_csv(csv_path)
-        logger.info(f"DataFrame cargado inicialmente: {len(df)} filas.")
-
-        # --- Preprocesamiento Esencial ---
-        logger.info("Realizando preprocesamiento...")
-        date_columns = ['publication_date', 'travel_departure_date', 'travel_arrival_date']
-        for col in date_columns:
-            if col in df.columns:
-                df[col] = pd.to_datetime(df[col], errors='coerce')
-
-        if 'travel_duration' in df.columns:
-             # Extraer solo dígitos, manejar no números resultando en NaN
-             df['travel_duration_days'] = pd.to_numeric(df['travel_duration'].astype(str).str.extract(r'(\d+)', expand=False), errors='coerce')
-             logger.info("  Columna 'travel_duration_days' (numérica) creada.")
-
-        # Llenar NaNs en columnas clave si es necesario (opcional)
-        # cols_to_fill = ['ship_name', 'master_name', 'travel_departure_port']
-        # for col in cols_to_fill:
-        #      if col in df.columns: df[col] = df[col].fillna('Desconocido')
+        csv_hash = resolve_csv_hash(csv_path, snapshot_dir)
+        df = None
+        if settings.DATAFRAME_SNAPSHOT_ENABLED:
+            df = load_snapshot(csv_path, csv_hash, snapshot_dir)
+
+        if df is None:
+            df = read_and_preprocess_csv(csv_path)
+            if settings.DATAFRAME_SNAPSHOT_ENABLED:
+                write_snapshot(df, csv_path, csv_hash, snapshot_dir)
 
+        indexes = build_secondary_indexes(df) if settings.DATAFRAME_SECONDARY_INDEXES_ENABLED else {}
         _dataframe_instance = df # Almacenar instancia cargada
+        _dataset_version = csv_hash[:16]
+        _set_secondary_indexes(indexes)
+        logger.info(f"Versión del dataset (hash del CSV): {_dataset_version}")
         logger.info("DataFrame cargado y preprocesado exitosamente.")
         return _dataframe_instance
 
     except Exception as e:
         logger.exception(f"Error fatal al cargar o preprocesar el DataFrame: {e}")
+        if force_reload and _dataframe_instance is not None:
+            # Se mantiene el DataFrame anterior si falla la recarga
+            return None
         _dataframe_instance = None
+        _dataset_version = None
+        _set_secondary_indexes({})
         return None
 
 def get_dataframe() -> Optional[pd.DataFrame]:
     """Obtiene la instancia cargada y preprocesada del DataFrame."""
     if _dataframe_instance is None:
         load_and_preprocess_dataframe() # Intentar cargar si no lo está
-    return _dataframe_instance
\ No newline at end of file
+    return _dataframe_instance
+
+def get_dataset_version() -> Optional[str]:
+    """
+    Devuelve la versión del dataset cargado (hash del CSV de origen).
+    Las cachés derivadas de los datos la usan para invalidarse cuando cambian.
+    """
+    if _dataframe_instance is None:
+        load_and_preprocess_dataframe()
+    return _dataset_version
+
+def get_snapshot_artifact_path(suffix: str) -> Optional[str]:
+    """
+    Ruta para un artefacto derivado del DataFrame (ej. un índice) junto al snapshot,
+    con el mismo hash del CSV en el nombre para que se invalide con él.
+    """
+    if get_dataset_version() is None:
+        return None
+    stem = os.path.splitext(os.path.basename(settings.CSV_FILE_PATH))[0]
+    return os.path.join(settings.DATAFRAME_SNAPSHOT_DIR, f"{stem}-{_dataset_version}{suffix}")
+
+def get_memory_report() -> Optional[Dict[str, Any]]:
+    """
+    Devuelve el informe de memoria por columna del DataFrame cargado
+    (dtype y bytes antes/después del plan de tipos compactos).
+    """
+    if _dataframe_instance is None:
+        load_and_preprocess_dataframe()
+    return _memory_report
@@ -0,0 +1,67 @@
+# app/core/executors.py
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Executor acotado (singleton) para el trabajo bloqueante del pipeline:
+# skills de pandas, ejecución de PandasAI y renderizado de gráficos.
+_cpu_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+_in_flight: int = 0
+_in_flight_lock = threading.Lock()
+
+def get_cpu_executor() -> ThreadPoolExecutor:
+    """Devuelve el ThreadPoolExecutor compartido, creándolo si es necesario (singleton)."""
+    global _cpu_executor
+    if _cpu_executor is None:
+        with _executor_lock:
+            if _cpu_executor is None:
+                max_workers = max(1, settings.CPU_EXECUTOR_MAX_WORKERS)
+                _cpu_executor = ThreadPoolExecutor(
+                    max_workers=max_workers,
+                    thread_name_prefix="hchat-cpu"
+                )
+                logger.info(f"Executor de tareas bloqueantes inicializado con {max_workers} hilos.")
+    return _cpu_executor
+
+def _tracked_call(func: Callable[..., Any]) -> Any:
+    """Ejecuta 'func' llevando la cuenta de tareas en curso."""
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    try:
+        return func()
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+
+async def run_in_cpu_executor(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Ejecuta una función síncrona en el executor acotado sin bloquear el event loop.
+    Las tareas que exceden el número de hilos esperan en la cola del executor.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    return await loop.run_in_executor(get_cpu_executor(), _tracked_call, call)
+
+def get_executor_stats() -> Dict[str, Any]:
+    """Devuelve métricas simples del executor (hilos configurados y tareas en curso)."""
+    return {
+        "max_workers": settings.CPU_EXECUTOR_MAX_WORKERS,
+        "in_flight": _in_flight,
+    }
+
+def shutdown_executors() -> None:
+    """Cierra el executor compartido (llamar al apagar la aplicación)."""
+    global _cpu_executor
+    with _executor_lock:
+        if _cpu_executor is not None:
+            _cpu_executor.shutdown(wait=True, cancel_futures=True)
+            _cpu_executor = None
+            logger.info("Executor de tareas bloqueantes cerrado.")
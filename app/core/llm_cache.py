@@ -0,0 +1,192 @@
+# app/core/llm_cache.py
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import warnings
+from typing import Optional, Dict, Any
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Caché persistente (SQLite) de respuestas de chat completions.
+# Se conecta a los ChatModels de LangChain mediante su parámetro 'cache', por lo
+# que la aprovechan tanto la cadena del moderador como PandasAI (que invoca el
+# mismo ChatModel a través de LangchainLLM).
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS llm_cache (
+    key TEXT PRIMARY KEY,
+    namespace TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_llm_cache_last_access ON llm_cache(last_access);
+"""
+
+# --- Conexión compartida (singleton) y contadores ---
+_connection: Optional[sqlite3.Connection] = None
+_db_lock = threading.Lock()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "writes": 0}
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Abre (una vez) la base SQLite de la caché."""
+    global _connection
+    if _connection is None:
+        db_path = settings.LLM_CACHE_PATH
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        _connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.executescript(_SCHEMA)
+        logger.info(f"Caché de respuestas LLM abierta en: {db_path}")
+    return _connection
+
+
+def _normalize_value(value: Any) -> Any:
+    """Colapsa espacios en todos los strings de una estructura JSON."""
+    if isinstance(value, str):
+        return re.sub(r"\s+", " ", value).strip()
+    if isinstance(value, list):
+        return [_normalize_value(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _normalize_value(v) for k, v in value.items()}
+    return value
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Normaliza el prompt para la clave. LangChain entrega los mensajes serializados
+    como JSON: se normalizan los espacios dentro de cada contenido.
+    """
+    try:
+        return json.dumps(_normalize_value(json.loads(prompt)), sort_keys=True, ensure_ascii=False)
+    except (ValueError, TypeError):
+        return re.sub(r"\s+", " ", prompt).strip()
+
+
+class SQLiteLLMCache(BaseCache):
+    """
+    Caché de LangChain respaldada por SQLite, con TTL y desalojo LRU por número de entradas.
+    'namespace' identifica proveedor, modelo, temperatura y seed del cliente que la usa.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+
+    def _key(self, prompt: str, llm_string: str) -> str:
+        raw = f"{self.namespace}\n{llm_string}\n{normalize_prompt(prompt)}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with _db_lock:
+            conn = _get_connection()
+            row = conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                _stats["misses"] += 1
+                return None
+            value, created_at = row
+            if settings.LLM_CACHE_TTL_SECONDS > 0 and now - created_at > settings.LLM_CACHE_TTL_SECONDS:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                _stats["expired"] += 1
+                _stats["misses"] += 1
+                return None
+
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore") # 'loads' de LangChain emite un aviso beta
+                    generations = [loads(item) for item in json.loads(value)]
+            except Exception as e:
+                # Entrada que no se puede deserializar: cuenta como fallo y se elimina
+                logger.warning(f"Caché LLM: Entrada corrupta o incompatible ({e}). Se elimina.")
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                _stats["misses"] += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+            _stats["hits"] += 1
+        return generations
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        try:
+            value = json.dumps([dumps(generation) for generation in return_val])
+        except Exception as e:
+            logger.warning(f"Caché LLM: No se pudo serializar la respuesta ({e}). No se guarda.")
+            return
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with _db_lock:
+            conn = _get_connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, namespace, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, self.namespace, value, now, now),
+            )
+            _stats["writes"] += 1
+            _evict_if_needed(conn)
+
+    def clear(self, **kwargs: Any) -> None:
+        """Elimina las entradas de este namespace."""
+        with _db_lock:
+            _get_connection().execute("DELETE FROM llm_cache WHERE namespace = ?", (self.namespace,))
+
+
+def _evict_if_needed(conn: sqlite3.Connection) -> None:
+    """Desaloja las entradas menos usadas recientemente si se supera el máximo (llamar con _db_lock)."""
+    max_entries = settings.LLM_CACHE_MAX_ENTRIES
+    if max_entries <= 0:
+        return
+    (count,) = conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+    excess = count - max_entries
+    if excess > 0:
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+            (excess,),
+        )
+        _stats["evictions"] += excess
+        logger.debug(f"Caché LLM: {excess} entradas desalojadas (LRU).")
+
+
+def get_llm_cache(namespace: str) -> Optional[SQLiteLLMCache]:
+    """Devuelve una caché para el namespace dado, o None si la caché está deshabilitada."""
+    if not settings.LLM_CACHE_ENABLED:
+        return None
+    try:
+        with _db_lock:
+            _get_connection()
+        return SQLiteLLMCache(namespace)
+    except Exception as e:
+        logger.exception(f"No se pudo inicializar la caché de respuestas LLM: {e}")
+        return None
+
+
+def purge_llm_cache() -> int:
+    """Elimina todas las entradas de la caché. Devuelve el número de entradas borradas."""
+    with _db_lock:
+        cursor = _get_connection().execute("DELETE FROM llm_cache")
+        deleted = cursor.rowcount
+    logger.info(f"Caché LLM purgada: {deleted} entradas eliminadas.")
+    return deleted
+
+
+def get_llm_cache_stats() -> Dict[str, Any]:
+    """Devuelve contadores de aciertos/fallos y el número de entradas almacenadas."""
+    stats: Dict[str, Any] = {"enabled": settings.LLM_CACHE_ENABLED}
+    if not settings.LLM_CACHE_ENABLED:
+        return stats
+    with _db_lock:
+        (entries,) = _get_connection().execute("SELECT COUNT(*) FROM llm_cache").fetchone()
+        stats.update(_stats)
+    total = stats["hits"] + stats["misses"]
+    stats["entries"] = entries
+    stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+    return stats
@@ -0,0 +1,174 @@
+# app/core/semantic_cache.py
+import re
+import logging
+import threading
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Tuple
+import numpy as np
+import faiss
+from app.core.config import settings
+from app.core.embeddings import get_embeddings_model
+from app.core.dataframe_loader import get_dataset_version
+from app.agents.fast_router import find_entities, normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Caché semántica de respuestas finales: embebe la consulta original con el
+# modelo de embeddings ya cargado y busca en un índice FAISS pequeño de
+# consultas respondidas. Si la similitud (coseno) supera el umbral de la
+# intención de la entrada encontrada y la firma de la consulta (números, valores
+# entre comillas, entidades del dataset, sentido del viaje y negaciones) es la
+# misma, se devuelve la respuesta cacheada: "Smith" y "Smyth", o "salidas de" y
+# "llegadas a", embeben casi igual pero no tienen la misma respuesta.
+
+_NUMBER_RE = re.compile(r"\d+")
+_QUOTED_RE = re.compile(r"[\"'«“‘]([^\"'«»“”‘’]+)[\"'»”’]")
+_CAPITALIZED_RE = re.compile(r"(?<!^)(?<![¿¡])\b[A-ZÁÉÍÓÚÑ][\wÁÉÍÓÚÑáéíóúñ.]+")
+_DIRECTION_RES: Dict[str, "re.Pattern[str]"] = {
+    "salida": re.compile(r"\b(?:sal(?:e|en|io|ieron|ian|ia|ida|idas|ido|idos|ir)|part\w*|zarp\w*|proced\w*|proven\w*|origen|desde)\b"),
+    "llegada": re.compile(r"\b(?:lleg\w*|arrib\w*|destino\w*)\b"),
+}
+_NEGATION_WORDS = {"no", "sin", "excepto", "salvo", "menos", "ni", "nunca", "ningun", "ninguna", "ninguno", "ningunos", "ningunas"}
+
+_lock = threading.Lock()
+_index: Optional[faiss.IndexIDMap] = None
+_entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict() # id -> entrada (orden LRU)
+_next_id: int = 0
+_cache_version: Optional[str] = None
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0}
+
+
+def _threshold_for(intent: Optional[str]) -> float:
+    """Umbral de similitud para una intención (los gráficos pueden requerir más precisión)."""
+    return settings.SEMANTIC_CACHE_THRESHOLDS_BY_INTENT.get(intent or "", settings.SEMANTIC_CACHE_THRESHOLD)
+
+
+def query_signature(text: str) -> Tuple[Tuple[str, ...], ...]:
+    """
+    Firma de la consulta que debe coincidir para reutilizar una respuesta: números (años,
+    top N...), valores entre comillas, entidades del dataset o nombres propios, sentido
+    del viaje (salida/llegada) y negaciones.
+    """
+    normalized = normalize_text(text)
+    words = set(normalized.split())
+    quoted = {normalize_text(value) for value in _QUOTED_RE.findall(text)}
+    entities = {f"{column}={value}" for column, value in find_entities(text)}
+    proper_nouns = {normalize_text(word).strip(".") for word in _CAPITALIZED_RE.findall(text.strip())}
+    return (
+        tuple(sorted(_NUMBER_RE.findall(text))),
+        tuple(sorted(quoted)),
+        tuple(sorted(entities | proper_nouns)),
+        tuple(sorted(name for name, pattern in _DIRECTION_RES.items() if pattern.search(normalized))),
+        tuple(sorted(words & _NEGATION_WORDS)),
+    )
+
+
+def _embed(query: str) -> Optional[np.ndarray]:
+    """Embebe la consulta como vector fila float32 normalizado (para producto interno = coseno)."""
+    embeddings = get_embeddings_model()
+    if embeddings is None:
+        return None
+    vector = np.asarray(embeddings.embed_query(query), dtype="float32").reshape(1, -1)
+    faiss.normalize_L2(vector)
+    return vector
+
+
+def _reset_locked(version: Optional[str]) -> None:
+    """Vacía la caché (llamar con _lock)."""
+    global _index, _cache_version
+    _index = None
+    _entries.clear()
+    _cache_version = version
+
+
+def _check_version_locked() -> None:
+    """Invalida la caché si la versión del dataset cambió (llamar con _lock)."""
+    version = get_dataset_version()
+    if version != _cache_version:
+        if _entries:
+            logger.info(f"Caché semántica: versión del dataset cambió ({_cache_version} -> {version}). Invalidando.")
+            _stats["invalidations"] += 1
+        _reset_locked(version)
+
+
+def lookup(query: str) -> Optional[Dict[str, Any]]:
+    """
+    Busca una respuesta cacheada para una consulta semánticamente equivalente.
+    Devuelve un dict con 'final_response_text', 'final_response_image' e 'intent', o None.
+    """
+    if not settings.SEMANTIC_CACHE_ENABLED or not query:
+        return None
+    vector = _embed(query)
+    if vector is None:
+        return None
+    signature = query_signature(query)
+
+    with _lock:
+        _check_version_locked()
+        if _index is None or _index.ntotal == 0:
+            _stats["misses"] += 1
+            return None
+        scores, ids = _index.search(vector, min(settings.SEMANTIC_CACHE_CANDIDATES, _index.ntotal))
+        for score, entry_id in zip(scores[0], ids[0]):
+            entry = _entries.get(int(entry_id))
+            if entry is None:
+                continue
+            if score < _threshold_for(entry["intent"]) or entry["signature"] != signature:
+                continue
+            _entries.move_to_end(int(entry_id))
+            _stats["hits"] += 1
+            logger.info(f"Caché semántica: acierto (similitud={score:.3f}) con '{entry['query']}'.")
+            return dict(entry["response"], intent=entry["intent"])
+        _stats["misses"] += 1
+        return None
+
+
+def store(query: str, intent: Optional[str], response: Dict[str, Any]) -> None:
+    """Guarda la respuesta final de una consulta, desalojando la entrada menos usada si se llena."""
+    global _index, _next_id
+    if not settings.SEMANTIC_CACHE_ENABLED or not query:
+        return
+    vector = _embed(query)
+    if vector is None:
+        return
+    signature = query_signature(query)
+
+    with _lock:
+        _check_version_locked()
+        if _index is None:
+            _index = faiss.IndexIDMap(faiss.IndexFlatIP(vector.shape[1]))
+        entry_id = _next_id
+        _next_id += 1
+        _index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+        _entries[entry_id] = {
+            "query": query,
+            "intent": intent,
+            "signature": signature,
+            "response": dict(response),
+        }
+        _stats["stores"] += 1
+
+        while len(_entries) > max(1, settings.SEMANTIC_CACHE_MAX_ENTRIES):
+            old_id, _ = _entries.popitem(last=False)
+            _index.remove_ids(np.array([old_id], dtype="int64"))
+            _stats["evictions"] += 1
+
+
+def clear() -> int:
+    """Vacía la caché semántica. Devuelve el número de entradas eliminadas."""
+    with _lock:
+        removed = len(_entries)
+        _reset_locked(_cache_version)
+    logger.info(f"Caché semántica purgada: {removed} entradas eliminadas.")
+    return removed
+
+
+def get_semantic_cache_stats() -> Dict[str, Any]:
+    """Devuelve contadores y tamaño actual de la caché semántica."""
+    with _lock:
+        stats: Dict[str, Any] = dict(_stats)
+        stats["entries"] = len(_entries)
+    total = stats["hits"] + stats["misses"]
+    stats["enabled"] = settings.SEMANTIC_CACHE_ENABLED
+    stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+    return stats
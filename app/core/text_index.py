@@ -0,0 +1,262 @@
+# app/core/text_index.py
+import os
+import re
+import json
+import logging
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Optional, Dict, List, Tuple, Iterable
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+from app.core.dataframe_loader import get_dataframe, get_dataset_version, get_snapshot_artifact_path
+
+logger = logging.getLogger(__name__)
+
+# Índice invertido a nivel de token sobre el texto OCR (parsed_text) y la carga
+# (cargo_list). Cada término apunta a las filas donde aparece, así una búsqueda
+# por palabras clave cuesta en proporción a las coincidencias y no al corpus.
+# Se persiste junto al snapshot del DataFrame (.npz con listas en formato CSR).
+
+TEXT_INDEX_COLUMNS: List[str] = ['parsed_text', 'cargo_list']
+TEXT_INDEX_FORMAT_VERSION = 1
+TEXT_INDEX_SUFFIX = ".textindex.npz"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_QUERY_TOKEN_RE = re.compile(r'"([^"]*)"|(\S+)')
+_OR_OPERATORS = {"OR", "O", "|"}
+_AND_OPERATORS = {"AND", "Y", "&"}
+
+
+# --- Normalización ---
+def fold_text(text: str) -> str:
+    """Minúsculas y sin acentos (la 'ñ' se pliega a 'n', como el resto de diacríticos)."""
+    text = unicodedata.normalize("NFKD", str(text))
+    return "".join(ch for ch in text if not unicodedata.combining(ch)).casefold()
+
+
+def stem_token(token: str) -> str:
+    """Reducción ligera de plurales en español: 'azucares' -> 'azucar', 'tormentas' -> 'tormenta'."""
+    if len(token) > 4 and token.endswith("es") and token[-3] in "rlndzj":
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s") and token[-2] in "aeiou":
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokeniza un texto con plegado de acentos y reducción de plurales."""
+    return [stem_token(token) for token in _TOKEN_RE.findall(fold_text(text))]
+
+
+def _contains_phrase(tokens: List[str], phrase: List[str]) -> bool:
+    size = len(phrase)
+    return any(tokens[i:i + size] == phrase for i in range(len(tokens) - size + 1))
+
+
+def parse_search_query(query: str) -> List[List[List[str]]]:
+    """
+    Convierte la consulta en grupos OR de cláusulas AND; cada cláusula es una lista de
+    tokens (más de uno = frase). Sintaxis: palabras separadas por espacios (AND),
+    'OR' / 'O' / '|' entre alternativas y frases entre comillas dobles.
+    Ej.: 'cacao OR "azucar blanco"' -> [[['cacao']], [['azucar', 'blanco']]].
+    """
+    groups: List[List[List[str]]] = [[]]
+    for match in _QUERY_TOKEN_RE.finditer(query or ""):
+        phrase, word = match.groups()
+        if word is not None and word.upper() in _OR_OPERATORS:
+            groups.append([])
+            continue
+        if word is not None and word.upper() in _AND_OPERATORS:
+            continue
+        tokens = tokenize(phrase if phrase is not None else word)
+        if tokens:
+            groups[-1].append(tokens)
+    return [group for group in groups if group]
+
+
+# --- Índice ---
+class InvertedIndex:
+    """Listas de filas por término y columna (posiciones 0..n-1 del DataFrame indexado)."""
+
+    def __init__(self, postings: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]], num_rows: int, dataset_version: Optional[str]):
+        # postings[columna] = (términos ordenados, offsets, filas) en formato CSR
+        self.postings = postings
+        self.num_rows = num_rows
+        self.dataset_version = dataset_version
+        self._term_ids: Dict[str, Dict[str, int]] = {
+            col: {term: i for i, term in enumerate(terms.tolist())} for col, (terms, _, _) in postings.items()
+        }
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, columns: Iterable[str] = TEXT_INDEX_COLUMNS, dataset_version: Optional[str] = None) -> "InvertedIndex":
+        postings: Dict[str, Tuple[np.ndarray, np.ndarray, np.ndarray]] = {}
+        for col in columns:
+            if col not in df.columns:
+                continue
+            term_rows: Dict[str, List[int]] = defaultdict(list)
+            for row, text in enumerate(df[col].tolist()):
+                if text is None or text is pd.NA or (isinstance(text, float) and np.isnan(text)):
+                    continue
+                for token in set(tokenize(text)):
+                    term_rows[token].append(row) # Las filas se recorren en orden: listas ya ordenadas
+            terms = sorted(term_rows)
+            lengths = np.fromiter((len(term_rows[t]) for t in terms), dtype=np.int64, count=len(terms))
+            offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+            np.cumsum(lengths, out=offsets[1:])
+            rows = np.fromiter((r for t in terms for r in term_rows[t]), dtype=np.int32, count=int(offsets[-1]))
+            postings[col] = (np.array(terms, dtype=str), offsets, rows)
+        return cls(postings, len(df), dataset_version)
+
+    def save(self, path: str) -> None:
+        arrays: Dict[str, np.ndarray] = {
+            "meta": np.array(json.dumps({
+                "format_version": TEXT_INDEX_FORMAT_VERSION,
+                "num_rows": self.num_rows,
+                "dataset_version": self.dataset_version,
+                "columns": list(self.postings.keys()),
+            })),
+        }
+        for col, (terms, offsets, rows) in self.postings.items():
+            arrays[f"{col}__terms"], arrays[f"{col}__offsets"], arrays[f"{col}__rows"] = terms, offsets, rows
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["InvertedIndex"]:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("format_version") != TEXT_INDEX_FORMAT_VERSION:
+                return None
+            postings = {
+                col: (data[f"{col}__terms"], data[f"{col}__offsets"], data[f"{col}__rows"])
+                for col in meta["columns"]
+            }
+        return cls(postings, meta["num_rows"], meta.get("dataset_version"))
+
+    def term_rows(self, column: str, term: str) -> np.ndarray:
+        """Filas de 'column' que contienen el término (ya normalizado)."""
+        term_id = self._term_ids.get(column, {}).get(term)
+        if term_id is None:
+            return np.array([], dtype=np.int32)
+        _, offsets, rows = self.postings[column]
+        return rows[offsets[term_id]:offsets[term_id + 1]]
+
+    def _clause_rows(self, df: pd.DataFrame, clause: List[str], columns: List[str]) -> np.ndarray:
+        """Filas donde aparece la cláusula (palabra o frase) en alguna de las columnas."""
+        matched: List[np.ndarray] = []
+        for col in columns:
+            candidates: Optional[np.ndarray] = None
+            for token in sorted(set(clause), key=lambda t: len(self.term_rows(col, t))):
+                rows = self.term_rows(col, token)
+                candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+                if len(candidates) == 0:
+                    break
+            if candidates is None or len(candidates) == 0:
+                continue
+            if len(clause) > 1: # Frase: verificar el orden solo en las filas candidatas
+                texts = df[col].iloc[candidates].tolist()
+                candidates = candidates[[_contains_phrase(tokenize(text), clause) for text in texts]]
+            matched.append(candidates)
+        if not matched:
+            return np.array([], dtype=np.int32)
+        return matched[0] if len(matched) == 1 else np.unique(np.concatenate(matched))
+
+    def search(self, df: pd.DataFrame, query: str, columns: Optional[List[str]] = None) -> np.ndarray:
+        """
+        Devuelve las posiciones de fila (ordenadas) que cumplen la consulta.
+        'df' debe ser el DataFrame indexado; solo se usa para verificar frases.
+        """
+        columns = [col for col in (columns or list(self.postings.keys())) if col in self.postings]
+        result: List[np.ndarray] = []
+        for group in parse_search_query(query):
+            group_rows: Optional[np.ndarray] = None
+            for clause in group:
+                rows = self._clause_rows(df, clause, columns)
+                group_rows = rows if group_rows is None else np.intersect1d(group_rows, rows, assume_unique=True)
+                if len(group_rows) == 0:
+                    break
+            if group_rows is not None and len(group_rows):
+                result.append(group_rows)
+        if not result:
+            return np.array([], dtype=np.int64)
+        return np.unique(np.concatenate(result)).astype(np.int64)
+
+
+# --- Singleton persistido junto al snapshot ---
+_index_instance: Optional[InvertedIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_text_index() -> Optional[InvertedIndex]:
+    """
+    Devuelve el índice invertido del DataFrame cargado. Lo lee del disco si existe para
+    la versión actual del dataset; si no, lo construye y lo guarda junto al snapshot.
+    """
+    global _index_instance
+    version = get_dataset_version()
+    if _index_instance is not None and _index_instance.dataset_version == version:
+        return _index_instance
+    with _index_lock:
+        if _index_instance is not None and _index_instance.dataset_version == version:
+            return _index_instance
+        df = get_dataframe()
+        if df is None:
+            return None
+        path = get_snapshot_artifact_path(TEXT_INDEX_SUFFIX)
+        index: Optional[InvertedIndex] = None
+        if path and os.path.exists(path):
+            try:
+                index = InvertedIndex.load(path)
+                if index is not None and index.num_rows != len(df):
+                    index = None
+                if index is not None:
+                    logger.info(f"Índice de texto cargado desde: {path}")
+            except Exception as e:
+                logger.warning(f"No se pudo leer el índice de texto {path}: {e}. Se reconstruirá.")
+                index = None
+        if index is None:
+            index = InvertedIndex.build(df, dataset_version=version)
+            logger.info(f"Índice de texto construido: { {col: len(p[0]) for col, p in index.postings.items()} } términos.")
+            if path and settings.DATAFRAME_SNAPSHOT_ENABLED:
+                try:
+                    index.save(path)
+                    logger.info(f"Índice de texto guardado en: {path}")
+                except Exception as e:
+                    logger.warning(f"No se pudo guardar el índice de texto: {e}")
+        _index_instance = index
+        return _index_instance
+
+
+def _positions_in_loaded(base_df: pd.DataFrame, df: pd.DataFrame) -> Optional[np.ndarray]:
+    """Posiciones en el DataFrame cargado de las filas de 'df' (un subconjunto suyo), o None si no lo es."""
+    if len(df) > len(base_df) or not base_df.index.is_unique:
+        return None
+    positions = base_df.index.get_indexer(df.index)
+    if (positions < 0).any():
+        return None
+    return positions
+
+
+def search_rows(df: pd.DataFrame, query: str, columns: Optional[List[str]] = None) -> np.ndarray:
+    """
+    Posiciones de fila de 'df' que cumplen la consulta. Usa el índice persistido si 'df' es
+    el DataFrame cargado o un subconjunto de sus filas (ej. las filas recuperadas): busca en
+    el índice global y se queda con las filas del subconjunto. Para otros DataFrames
+    construye un índice temporal.
+    """
+    base_df = get_dataframe()
+    index = get_text_index() if base_df is not None else None
+    if index is not None:
+        if df is base_df:
+            return index.search(base_df, query, columns)
+        subset_positions = _positions_in_loaded(base_df, df)
+        if subset_positions is not None:
+            matches = index.search(base_df, query, columns)
+            return np.flatnonzero(np.isin(subset_positions, matches)).astype(np.int64)
+    index = InvertedIndex.build(df, columns or TEXT_INDEX_COLUMNS)
+    return index.search(df, query, columns)
@@ -10,6 +10,12 @@ from app.vector_store.faiss_store import load_faiss_index
 from app.orchestration.graph_builder import get_compiled_graph
 from app.api.endpoints import router as api_router
 from app.core.dataframe_loader import load_and_preprocess_dataframe
+from app.core.executors import get_cpu_executor, shutdown_executors
+from app.core.text_index import get_text_index
+from app.vector_store.hybrid_retriever import get_bm25_index, shutdown_hybrid_retriever
+from app.core.aggregates import get_aggregates
+from app.pandasai_utils.chart_renderer import warm_chart_renderer, shutdown_chart_renderer
+from app.pandasai_utils.code_sandbox import warm_code_sandbox, shutdown_code_sandbox
 
 # Configurar logging básico para la aplicación
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -54,6 +60,14 @@ async def lifespan(app: FastAPI):
          # Opcional: Almacenar en app.state si otros componentes lo necesitan directamente
          # app.state.dataframe = dataframe
          logger.info("DataFrame cargado en memoria.")
+         # Índice invertido de texto (se lee del snapshot o se construye una vez)
+         if get_text_index() is None:
+             logger.warning("No se pudo preparar el índice de texto; search_keywords lo construirá bajo demanda.")
+         # Conteos materializados por las dimensiones más consultadas
+         get_aggregates()
+         # Índice BM25 de la rama léxica de la búsqueda híbrida
+         if settings.RETRIEVAL_ENABLED and settings.RETRIEVAL_HYBRID_ENABLED:
+             get_bm25_index()
 
     # 5. Compilar el Grafo Langraph y Almacenarlo
     logger.info("Compilando grafo Langraph...")
@@ -67,11 +81,30 @@ async def lifespan(app: FastAPI):
         logger.exception("Error crítico durante la compilación del grafo Langraph.")
         raise RuntimeError(f"Fallo crítico al compilar el grafo: {e}") from e
 
+    # 6. Preparar el executor acotado para tareas bloqueantes (PandasAI, skills, gráficos)
+    get_cpu_executor()
+
+    # 7. Arrancar y precalentar los procesos renderizadores de gráficos
+    try:
+        warm_chart_renderer()
+    except Exception as e:
+        logger.warning(f"No se pudo precalentar el renderizador de gráficos ({e}); se iniciará bajo demanda.")
+
+    # 8. Arrancar los procesos aislados que ejecutan el código generado por PandasAI
+    try:
+        warm_code_sandbox()
+    except Exception as e:
+        logger.warning(f"No se pudo precalentar el sandbox de ejecución de código ({e}); se iniciará bajo demanda.")
+
     logger.info("--- Aplicación lista para recibir peticiones ---")
     yield
     # Código de cierre
     logger.info("--- Cerrando aplicación FastAPI ---")
     app.state.graph = None
+    shutdown_executors()
+    shutdown_chart_renderer()
+    shutdown_code_sandbox()
+    shutdown_hybrid_retriever()
     # Podrías añadir limpieza para el cliente LLM si fuera necesario
     # global _llm_client (en llm.py)
     # _llm_client = None
@@ -8,66 +8,119 @@ from app.agents import moderator_agent
 from app.agents import contextualizer_agent
 from app.agents import pandasai_agent # Agente PandasAI
 from app.agents import validation_agent
+from app.core.executors import run_in_cpu_executor
+from app.core import semantic_cache
+from app.core.config import settings
+from app.vector_store import faiss_store, hybrid_retriever
 
 logger_nodes = logging.getLogger(__name__)
 
 # --- Funciones Nodo para Langraph---
+# Los nodos son asíncronos: el grafo se invoca con 'ainvoke' y el trabajo
+# bloqueante (PandasAI, skills de pandas, lectura de gráficos) se delega al
+# executor acotado de app.core.executors para no bloquear el event loop.
+
+# --- NODO CACHÉ SEMÁNTICA (BÚSQUEDA) ---
+async def run_semantic_cache_lookup(state: GraphState) -> Dict[str, Any]:
+    """Nodo que busca una respuesta cacheada para una consulta semánticamente equivalente."""
+    logger_nodes.info("--- Ejecutando Nodo: Caché Semántica (búsqueda) ---")
+    try:
+        cached = await run_in_cpu_executor(semantic_cache.lookup, state['original_query'])
+    except Exception as e:
+        logger_nodes.exception(f"Error consultando la caché semántica: {e}")
+        cached = None
+    if cached is None:
+        return {"semantic_cache_hit": False}
+    return {
+        "semantic_cache_hit": True,
+        "intent": cached.get("intent"),
+        "final_response_text": cached.get("final_response_text"),
+        "final_response_image": cached.get("final_response_image"),
+        "error_message": None
+    }
+
 # --- NODO EJECUTOR MODERADOR ---
-def run_moderator(state: GraphState) -> Dict[str, Any]:
+async def run_moderator(state: GraphState) -> Dict[str, Any]:
     """Nodo que ejecuta el agente moderador (versión PandasAI-only)."""
     logger_nodes.info("--- Ejecutando Nodo: Moderador ---")
     query = state['original_query']
-    analysis_result = moderator_agent.analyze_query(query)
+    analysis_result = await moderator_agent.aanalyze_query(query)
     logger_nodes.info(f"Resultado Moderador (PandasAI-only): {analysis_result}")
     return {
         "intent": analysis_result.get("intent"),
-        "pandasai_query": analysis_result.get("pandasai_query")
+        "pandasai_query": analysis_result.get("pandasai_query"),
+        "skill_call": analysis_result.get("skill_call"),
+        "search_query": analysis_result.get("search_query")
     }
 
+# --- NODO RECUPERADOR (FAISS) ---
+async def run_retriever(state: GraphState) -> Dict[str, Any]:
+    """Nodo que acota la consulta a las filas recuperadas (búsqueda híbrida BM25 + FAISS, o solo FAISS)."""
+    logger_nodes.info("--- Ejecutando Nodo: Recuperador (FAISS) ---")
+    search_query = state.get('search_query')
+    search = hybrid_retriever.search_row_ids if settings.RETRIEVAL_HYBRID_ENABLED else faiss_store.search_row_ids
+    try:
+        row_ids = await run_in_cpu_executor(search, search_query)
+    except Exception as e:
+        logger_nodes.exception(f"Error en la recuperación vectorial: {e}")
+        row_ids = []
+    if not row_ids:
+        # Sin resultados se ejecuta sobre el DataFrame completo, como sin recuperador
+        logger_nodes.warning(f"La búsqueda vectorial no devolvió filas para '{search_query}'. Se usa el DataFrame completo.")
+        return {"retrieved_row_ids": None}
+    logger_nodes.info(f"Recuperador: {len(row_ids)} filas candidatas para '{search_query}'.")
+    return {"retrieved_row_ids": row_ids}
+
 # --- NODO EJECUTOR PANDASAI ---
-def run_pandasai_executor(state: GraphState) -> Dict[str, Any]:
+async def run_pandasai_executor(state: GraphState) -> Dict[str, Any]:
     """Nodo que ejecuta la consulta usando PandasAI y devuelve el diccionario de resultados."""
     logger_nodes.info("--- Ejecutando Nodo: Ejecutor PandasAI ---")
     query_to_run = state.get('pandasai_query')
+    skill_call = state.get('skill_call')
 
-    if not query_to_run:
+    if not query_to_run and not skill_call:
          logger_nodes.error("No se encontró consulta PandasAI para ejecutar.")
          # Devolver diccionario de error consistente con la salida de run_pandasai
-         return {"pandasai_result": None, "pandasai_result_type": None, "pandasai_plot_path": None, "pandasai_error": "Consulta PandasAI vacía."}
+         return {"pandasai_result": None, "pandasai_result_type": None, "pandasai_plot_bytes": None, "pandasai_plot_mime": None, "pandasai_error": "Consulta PandasAI vacía."}
 
     # Llama a la lógica del agente PandasAI, que devuelve un diccionario
-    pandasai_output_dict = pandasai_agent.run_pandasai(query_to_run)
-    logger_nodes.info(f"Resultado PandasAI Ejecutor: { {k: (type(v) if k=='pandasai_result' else v) for k, v in pandasai_output_dict.items()} }")
+    # Si el moderador emitió una invocación estructurada, la skill se ejecuta
+    # directamente; PandasAI (SmartDataframe.chat) queda como fallback.
+    pandasai_output_dict = await run_in_cpu_executor(pandasai_agent.run_pandasai, query_to_run, skill_call, state.get('retrieved_row_ids'))
+    logger_nodes.info(f"Resultado PandasAI Ejecutor: { {k: (type(v) if k in ('pandasai_result', 'pandasai_plot_bytes') else v) for k, v in pandasai_output_dict.items()} }")
 
     # Devuelve el diccionario COMPLETO para actualizar el estado
     return pandasai_output_dict
 
 # --- NODO EJECUTOR cONTEXTUALIZADOR ---
-def run_contextualizer(state: GraphState) -> Dict[str, Any]:
+async def run_contextualizer(state: GraphState) -> Dict[str, Any]:
     """Nodo que ejecuta el agente contextualizador (simplificado)."""
     logger_nodes.info("--- Ejecutando Nodo: Contextualizador ---")
-    # Pasa el estado completo
-    context_result = contextualizer_agent.contextualize(state)
+    # Pasa el estado completo; el formateo (json.dumps de resultados grandes) va al executor
+    context_result = await run_in_cpu_executor(contextualizer_agent.contextualize, state)
     logger_nodes.info(f"Resultado Contextualizador: summary='{context_result.get('summary', '')[:50]}...'")
     # Devuelve solo los campos que modifica
     return {"summary": context_result.get("summary")}
 
 # --- NODO EJECUTOR VALIDADOR ---
-def run_validator(state: GraphState) -> Dict[str, Any]:
+async def run_validator(state: GraphState) -> Dict[str, Any]:
     logger_nodes.info("--- Ejecutando Nodo: Validador ---")
     original_query = state['original_query']
     summary = state.get('summary')
-    plot_path = state.get('pandasai_plot_path') # Nombre correcto del estado
+    plot_bytes = state.get('pandasai_plot_bytes')
+    plot_mime = state.get('pandasai_plot_mime') or "image/png"
     pandasai_error = state.get('pandasai_error')
 
     # content_to_validate ya no es necesario pasarlo explícitamente aquí,
     # la lógica de validation_agent.validate usará 'summary' si no hay plot/error.
 
-    final_text, final_image, error_msg = validation_agent.validate(
+    final_text, final_image, error_msg = await run_in_cpu_executor(
+        validation_agent.validate,
         original_query=original_query,
         summary_from_contextualizer=summary, # Pasa el summary
         pandasai_error=pandasai_error,         # Pasa el error de PandasAI
-        plot_path_from_pandasai=plot_path    # Pasa la ruta del plot
+        plot_bytes_from_pandasai=plot_bytes, # Pasa la imagen del plot (bytes)
+        plot_mime=plot_mime
     )
 
     logger_nodes.info(f"Resultado Validador: Texto={final_text is not None}, Imagen={final_image is not None}, Error={error_msg is not None}")
@@ -75,4 +128,19 @@ def run_validator(state: GraphState) -> Dict[str, Any]:
         "final_response_text": final_text,
         "final_response_image": final_image,
         "error_message": error_msg
-    }
\ No newline at end of file
+    }
+
+# --- NODO CACHÉ SEMÁNTICA (ALMACENAMIENTO) ---
+async def run_semantic_cache_store(state: GraphState) -> Dict[str, Any]:
+    """Nodo que guarda en la caché semántica las respuestas finales exitosas."""
+    if state.get('error_message'):
+        return {}
+    response = {
+        "final_response_text": state.get('final_response_text'),
+        "final_response_image": state.get('final_response_image'),
+    }
+    try:
+        await run_in_cpu_executor(semantic_cache.store, state['original_query'], state.get('intent'), response)
+    except Exception as e:
+        logger_nodes.exception(f"Error guardando en la caché semántica: {e}")
+    return {}
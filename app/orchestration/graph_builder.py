@@ -5,6 +5,7 @@ from app.orchestration.graph_state import GraphState
 # Importar SOLO los nodos necesarios
 from app.orchestration import agent_nodes # Contiene run_pandasai_executor ahora
 import logging
+from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
@@ -12,6 +13,29 @@ _compiled_graph = None
 
 
 
+# --- Funciones de Enrutamiento Condicional ---
+def route_after_semantic_cache(state: GraphState) -> str:
+    """Decide si la consulta se respondió desde la caché semántica."""
+    return "hit" if state.get("semantic_cache_hit") else "miss"
+
+
+# Skills de consulta de registros: las únicas que se acotan a las filas recuperadas.
+# Los conteos y gráficos se calculan siempre sobre el DataFrame completo (recortarlos
+# a los k resultados de la búsqueda daría agregados incompletos).
+RETRIEVAL_LOOKUP_SKILLS = {"get_tabular_data", "search_keywords"}
+
+
+def route_after_moderator(state: GraphState) -> str:
+    """Las búsquedas de un registro concreto pasan por el recuperador antes de ejecutarse."""
+    if not settings.RETRIEVAL_ENABLED or not state.get("search_query") or state.get("intent") == "visual":
+        return "execute"
+    skill_call = state.get("skill_call")
+    if skill_call and skill_call.get("name") not in RETRIEVAL_LOOKUP_SKILLS:
+        logger.info(f"Se omite el recuperador para la skill de agregación '{skill_call.get('name')}'.")
+        return "execute"
+    return "retrieve"
+
+
 # --- Función para Construir y Compilar el Grafo---
 def build_graph() -> StateGraph:
     """
@@ -22,7 +46,9 @@ def build_graph() -> StateGraph:
 
     # --- 1. Añadir Nodos ---
     logger.info("Añadiendo nodos al grafo...")
+    workflow.add_node("semantic_cache_lookup", agent_nodes.run_semantic_cache_lookup)
     workflow.add_node("moderator", agent_nodes.run_moderator)
+    workflow.add_node("retriever", agent_nodes.run_retriever)
     # --- CORRECCIÓN AQUÍ ---
     # Usar el nombre de la función que existe en agent_nodes.py
     workflow.add_node("pandasai_executor", agent_nodes.run_pandasai_executor)
@@ -30,17 +56,31 @@ def build_graph() -> StateGraph:
     # ----------------------
     workflow.add_node("contextualizer", agent_nodes.run_contextualizer)
     workflow.add_node("validator", agent_nodes.run_validator)
+    workflow.add_node("semantic_cache_store", agent_nodes.run_semantic_cache_store)
 
     # --- 2. Punto de Entrada ---
-    logger.info("Estableciendo punto de entrada: 'moderator'")
-    workflow.set_entry_point("moderator")
+    logger.info("Estableciendo punto de entrada: 'semantic_cache_lookup'")
+    workflow.set_entry_point("semantic_cache_lookup")
 
     # --- 3. Añadir Bordes Secuenciales ---
     logger.info("Añadiendo bordes secuenciales...")
-    workflow.add_edge("moderator", "pandasai_executor") # El moderador va al único ejecutor
+    # Si la caché semántica tiene una respuesta equivalente, se termina sin ejecutar el resto
+    workflow.add_conditional_edges(
+        "semantic_cache_lookup",
+        route_after_semantic_cache,
+        {"hit": END, "miss": "moderator"}
+    )
+    # Búsquedas difusas: el recuperador acota las filas antes del ejecutor
+    workflow.add_conditional_edges(
+        "moderator",
+        route_after_moderator,
+        {"retrieve": "retriever", "execute": "pandasai_executor"}
+    )
+    workflow.add_edge("retriever", "pandasai_executor")
     workflow.add_edge("pandasai_executor", "contextualizer") # El ejecutor va al contextualizador
     workflow.add_edge("contextualizer", "validator")
-    workflow.add_edge("validator", END)
+    workflow.add_edge("validator", "semantic_cache_store")
+    workflow.add_edge("semantic_cache_store", END)
 
     # --- 4. Compilar ---
     logger.info("Compilando el grafo (PandasAI-only)...")
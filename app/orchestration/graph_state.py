@@ -9,17 +9,32 @@ class GraphState(TypedDict):
     # --- Entrada Inicial ---
     original_query: str
 
+    # --- Salida de la Caché Semántica ---
+    semantic_cache_hit: Optional[bool] = None
+
     # --- Salida del Moderador ---
     intent: Optional[str]             # 'text', 'visual', 'code'
     pandasai_query: Optional[str]     # La consulta directa para PandasAI
+    # Invocación estructurada de skill: {"name": str, "args": dict}. Si existe,
+    # se ejecuta directamente y 'pandasai_query' queda solo como fallback.
+    skill_call: Optional[Dict[str, Any]] = None
+    # Consulta para la búsqueda vectorial (nombres con ruido de OCR, descripciones aproximadas)
+    search_query: Optional[str] = None
+
+    # --- Salida del Recuperador (FAISS) ---
+    # Etiquetas de las filas del DataFrame recuperadas; si existen, la skill / PandasAI
+    # se ejecutan solo sobre ese subconjunto
+    retrieved_row_ids: Optional[List[int]] = None
 
     # --- Salida del Ejecutor PandasAI ---
     # Resultado principal si NO es un gráfico guardado en archivo
     pandasai_result: Optional[Any] = None
     # Tipo del resultado principal ('string', 'dataframe_list', 'number', etc.)
     pandasai_result_type: Optional[str] = None
-    # Ruta al archivo PNG si PandasAI guardó un gráfico en disco
-    pandasai_plot_path: Optional[str] = None
+    # Imagen del gráfico generado (renderizada en memoria, sin archivos temporales)
+    pandasai_plot_bytes: Optional[bytes] = None
+    # Tipo MIME de la imagen ('image/png' o 'image/svg+xml')
+    pandasai_plot_mime: Optional[str] = None
     # Error específico de la ejecución de PandasAI
     pandasai_error: Optional[str] = None
 
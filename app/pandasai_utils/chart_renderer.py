@@ -0,0 +1,135 @@
+# app/pandasai_utils/chart_renderer.py
+import time
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional
+from app.core.config import settings
+from app.pandasai_utils.charts import render_from_spec, warm_up_renderer
+
+logger = logging.getLogger(__name__)
+
+# Renderizador de gráficos en un pool de procesos precalentado: matplotlib retiene
+# el GIL durante todo el dibujado, así que se saca de los hilos de las peticiones.
+# Las skills envían (plantilla, datos, especificación) y reciben los bytes de la imagen.
+# Con CHART_RENDER_PROCESSES = 0 se renderiza en el propio hilo (sin pool).
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_pending: int = 0
+_stats: Dict[str, int] = {"submitted": 0, "completed": 0, "failed": 0, "in_process": 0, "pool_restarts": 0}
+_latencies = deque(maxlen=500)        # Tiempo total por gráfico (cola + IPC + render), en segundos
+_render_times = deque(maxlen=500)     # Tiempo de renderizado dentro del proceso, en segundos
+
+
+def get_chart_render_pool() -> Optional[ProcessPoolExecutor]:
+    """Devuelve el pool de procesos renderizadores (singleton), o None si está deshabilitado."""
+    global _pool
+    if settings.CHART_RENDER_PROCESSES <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # 'spawn' evita heredar hilos y locks del proceso principal al hacer fork
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.CHART_RENDER_PROCESSES,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=warm_up_renderer,
+                )
+                logger.info(f"Renderizador de gráficos inicializado con {settings.CHART_RENDER_PROCESSES} procesos.")
+    return _pool
+
+
+def warm_chart_renderer() -> None:
+    """Arranca todos los procesos del pool para que la primera petición no pague el arranque."""
+    pool = get_chart_render_pool()
+    if pool is None:
+        return
+    futures = [pool.submit(render_from_spec, "bar", {"labels": ["a"], "values": [1]}, {"title": "", "xlabel": ""})
+               for _ in range(settings.CHART_RENDER_PROCESSES)]
+    for future in futures:
+        future.result(timeout=settings.CHART_RENDER_TIMEOUT)
+    logger.info("Procesos del renderizador de gráficos precalentados.")
+
+
+def _reset_pool(broken: ProcessPoolExecutor) -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+            _stats["pool_restarts"] += 1
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def render_chart(kind: str, data: Dict[str, Any], spec: Dict[str, Any]) -> bytes:
+    """
+    Renderiza un gráfico con la plantilla 'kind' en el pool de procesos y devuelve los bytes.
+    Si el pool está deshabilitado o se rompe, se renderiza en el hilo actual.
+    """
+    global _pending
+    start = time.perf_counter()
+    pool = get_chart_render_pool()
+    image: Optional[bytes] = None
+    render_seconds = 0.0
+    if pool is not None:
+        with _stats_lock:
+            _pending += 1
+            _stats["submitted"] += 1
+        try:
+            image, render_seconds = pool.submit(render_from_spec, kind, data, spec).result(timeout=settings.CHART_RENDER_TIMEOUT)
+        except BrokenProcessPool:
+            logger.error("El pool del renderizador de gráficos se rompió. Se recreará; este gráfico se dibuja en el hilo actual.")
+            _reset_pool(pool)
+        except Exception:
+            with _stats_lock:
+                _stats["failed"] += 1
+            raise
+        finally:
+            with _stats_lock:
+                _pending -= 1
+
+    if image is None:
+        image, render_seconds = render_from_spec(kind, data, spec)
+        with _stats_lock:
+            _stats["in_process"] += 1
+
+    with _stats_lock:
+        _stats["completed"] += 1
+        _latencies.append(time.perf_counter() - start)
+        _render_times.append(render_seconds)
+    return image
+
+
+def _percentile_ms(values, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(pct * len(ordered)))] * 1000, 2)
+
+
+def get_chart_renderer_stats() -> Dict[str, Any]:
+    """Métricas del renderizador: cola (gráficos pendientes) y latencias (ms) total y de render."""
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+        stats["queue_depth"] = _pending
+        latencies, render_times = list(_latencies), list(_render_times)
+    stats["processes"] = settings.CHART_RENDER_PROCESSES
+    stats["latency_p50_ms"] = _percentile_ms(latencies, 0.5)
+    stats["latency_p95_ms"] = _percentile_ms(latencies, 0.95)
+    stats["render_p50_ms"] = _percentile_ms(render_times, 0.5)
+    stats["render_p95_ms"] = _percentile_ms(render_times, 0.95)
+    return stats
+
+
+def shutdown_chart_renderer() -> None:
+    """Cierra el pool de procesos (llamar al apagar la aplicación)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+            logger.info("Renderizador de gráficos cerrado.")
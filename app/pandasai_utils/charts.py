@@ -0,0 +1,102 @@
+# app/pandasai_utils/charts.py
+import io
+import time
+import base64
+import logging
+from typing import List, Sequence, Optional, Tuple, Dict, Any, Callable
+import matplotlib
+from matplotlib.figure import Figure
+
+logger = logging.getLogger(__name__)
+
+# Renderizado de gráficos directamente a memoria (sin pyplot ni archivos temporales).
+# Se usa la API orientada a objetos de Matplotlib (Figure), que no comparte estado
+# global entre hilos. Este módulo solo depende de matplotlib para que los procesos
+# del renderizador (ver chart_renderer.py) lo importen rápido y sin cargar la app.
+
+CHART_MIME_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+DEFAULT_CHART_FORMAT = "png"
+
+
+def render_bar_chart(
+    labels: Sequence[str],
+    values: Sequence[float],
+    title: str,
+    xlabel: str,
+    ylabel: str = "Frecuencia",
+    fmt: str = DEFAULT_CHART_FORMAT,
+    dpi: int = 100,
+) -> bytes:
+    """Dibuja un gráfico de barras con los valores anotados y devuelve la imagen codificada."""
+    if fmt not in CHART_MIME_TYPES:
+        raise ValueError(f"Formato de gráfico no soportado: '{fmt}'. Disponibles: {list(CHART_MIME_TYPES.keys())}")
+    labels: List[str] = [str(label) for label in labels]
+    fig = Figure(figsize=(max(10, int(len(labels) * 0.5)), 6)) # Ancho dinámico, mínimo 10
+    ax = fig.subplots()
+    bars = ax.bar(range(len(values)), values, color='skyblue', width=0.85)
+    ax.set_title(title, fontsize=15, pad=20)
+    ax.set_ylabel(ylabel, fontsize=11)
+    ax.set_xlabel(xlabel, fontsize=11)
+    ax.set_xticks(range(len(labels)))
+    ax.set_xticklabels(labels, rotation=45, ha="right", fontsize=9)
+    ax.tick_params(axis='y', labelsize=9)
+    ax.grid(axis='y', linestyle=':', alpha=0.6)
+
+    # Añadir valores encima de las barras
+    for bar in bars:
+        ax.annotate(format(bar.get_height(), '.0f'),
+                    (bar.get_x() + bar.get_width() / 2, bar.get_height()),
+                    ha='center', va='center', size=8, xytext=(0, 8),
+                    textcoords='offset points')
+
+    fig.tight_layout(pad=1.5)
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt, dpi=dpi)
+    return buffer.getvalue()
+
+
+# --- Plantillas de gráfico: kind -> función(data, **spec) -> bytes ---
+def _render_bar_template(data: Dict[str, Any], **spec: Any) -> bytes:
+    return render_bar_chart(data["labels"], data["values"], **spec)
+
+CHART_TEMPLATES: Dict[str, Callable[..., bytes]] = {
+    "bar": _render_bar_template,
+}
+
+
+def render_from_spec(kind: str, data: Dict[str, Any], spec: Dict[str, Any]) -> Tuple[bytes, float]:
+    """
+    Punto de entrada de los procesos renderizadores: dibuja la plantilla 'kind' con los
+    datos y la especificación dados. Devuelve (imagen, segundos de renderizado).
+    """
+    template = CHART_TEMPLATES.get(kind)
+    if template is None:
+        raise ValueError(f"Plantilla de gráfico desconocida: '{kind}'. Disponibles: {list(CHART_TEMPLATES.keys())}")
+    start = time.perf_counter()
+    image = template(data, **spec)
+    return image, time.perf_counter() - start
+
+
+def warm_up_renderer() -> None:
+    """
+    Inicializador de los procesos renderizadores: fija el backend Agg y dibuja cada
+    plantilla una vez para dejar cargadas las fuentes y el resto de cachés de matplotlib.
+    """
+    matplotlib.use("Agg")
+    render_from_spec("bar", {"labels": ["a", "b"], "values": [1, 2]}, {"title": "warm-up", "xlabel": "x"})
+
+
+def to_data_uri(image_bytes: bytes, mime_type: str = "image/png") -> str:
+    """Codifica la imagen como Data URI base64 (formato de 'image_response' en la API)."""
+    return f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+
+
+def from_data_uri(data_uri: str) -> Optional[Tuple[bytes, str]]:
+    """Decodifica un Data URI base64 a (bytes, tipo MIME), o None si no tiene ese formato."""
+    if not data_uri or not data_uri.startswith("data:") or ";base64," not in data_uri:
+        return None
+    header, encoded = data_uri.split(",", 1)
+    try:
+        return base64.b64decode(encoded), header[len("data:"):].split(";", 1)[0]
+    except ValueError:
+        return None
@@ -0,0 +1,441 @@
+# app/pandasai_utils/code_sandbox.py
+import os
+import time
+import queue
+import logging
+import threading
+import traceback
+import multiprocessing
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from pandasai.helpers.code_manager import CodeExecutionContext, CodeManager
+from pandasai.helpers.output_validator import OutputValidator
+from pandasai.exceptions import InvalidLLMOutputType, InvalidOutputValueMismatch
+from pandasai.pipelines.chat.code_execution import CodeExecution
+from pandasai.pipelines.logic_unit_output import LogicUnitOutput
+from pandasai.responses.response_serializer import ResponseSerializer
+from app.core.config import settings
+
+try:
+    import resource # Solo en Unix: límites de memoria por proceso
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Ejecución aislada del código Python que genera PandasAI. En lugar de hacer exec() en
+# el proceso de la API, el paso de ejecución de código de PandasAI envía el código ya
+# limpiado a un pool de procesos arrancados de antemano, cada uno con el DataFrame
+# cargado (desde el snapshot Arrow), un límite de memoria (RLIMIT_AS) y un tiempo máximo
+# de pared (CODE_EXECUTION_TIMEOUT). Un proceso que se pasa de tiempo se mata y se
+# sustituye por otro; las demás peticiones siguen usando el resto de procesos.
+# Con CODE_EXECUTION_WORKERS = 0 PandasAI ejecuta el código en el propio proceso.
+
+_WORKER_STARTUP_TIMEOUT = 120 # Segundos para que un proceso nuevo cargue el DataFrame
+
+
+class CodeExecutionTimeout(RuntimeError):
+    """El código generado superó CODE_EXECUTION_TIMEOUT y su proceso fue terminado."""
+
+
+class CodeExecutionCrashed(RuntimeError):
+    """El proceso que ejecutaba el código terminó inesperadamente (ej. límite de memoria)."""
+
+
+class SandboxedCodeError(RuntimeError):
+    """Excepción lanzada por el código generado dentro del proceso aislado."""
+
+
+# --- Lado del proceso trabajador ---
+def _apply_memory_limit(limit_mb: int) -> None:
+    if resource is None or limit_mb <= 0:
+        return
+    limit = limit_mb * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        logger.warning(f"No se pudo aplicar el límite de memoria de {limit_mb} MB al proceso de ejecución: {e}")
+
+
+def _build_environment(df: Any, additional_dependencies: List[Dict[str, str]], used_skills: List[str]) -> Dict[str, Any]:
+    """Mismo entorno que CodeManager._get_environment() de PandasAI, con 'dfs' y las skills usadas."""
+    import pandasai.pandas as pd
+    from pandasai.constants import WHITELISTED_BUILTINS
+    from pandasai.helpers.optional import import_dependency
+    from app.pandasai_utils.skills import SKILL_REGISTRY
+    import builtins
+
+    environment: Dict[str, Any] = {"pd": pd}
+    for lib in additional_dependencies:
+        module = import_dependency(lib["module"])
+        environment[lib["alias"]] = getattr(module, lib["name"]) if hasattr(module, lib["name"]) else module
+    environment["__builtins__"] = {
+        **{name: getattr(builtins, name) for name in WHITELISTED_BUILTINS if hasattr(builtins, name)},
+        "__build_class__": builtins.__build_class__,
+        "__name__": "__main__",
+    }
+    # Copia superficial: el código generado no puede reasignar columnas del DataFrame del proceso
+    environment["dfs"] = [df.copy(deep=False)]
+    for name in used_skills:
+        if name in SKILL_REGISTRY:
+            environment[name] = SKILL_REGISTRY[name]
+    return environment
+
+
+def _worker_main(conn: Any, memory_limit_mb: int) -> None:
+    """Bucle del proceso trabajador: recibe (código, dependencias, skills) y devuelve el resultado."""
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    _apply_memory_limit(memory_limit_mb)
+    settings.CHART_RENDER_PROCESSES = 0 # Los gráficos de las skills se dibujan en este mismo proceso
+    from app.core.dataframe_loader import get_dataframe, plain_text_view
+    df = get_dataframe()
+    if df is not None:
+        df = plain_text_view(df) # Mismos tipos que el DataFrame del conector de PandasAI
+    conn.send(("ready", os.getpid()) if df is not None else ("error", "RuntimeError", "DataFrame no disponible en el proceso de ejecución.", ""))
+    if df is None:
+        return
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        code, additional_dependencies, used_skills, row_positions = task
+        try:
+            # Consultas acotadas por el recuperador: solo las filas indicadas (posiciones)
+            task_df = df.iloc[row_positions] if row_positions is not None else df
+            environment = _build_environment(task_df, additional_dependencies, used_skills)
+            exec(code, environment)
+            if "result" not in environment:
+                from pandasai.exceptions import NoResultFoundError
+                raise NoResultFoundError("No result returned")
+            message = ("ok", environment["result"])
+        except BaseException as e: # También MemoryError / RecursionError del código generado
+            message = ("error", type(e).__name__, str(e)[:2000], traceback.format_exc()[-4000:])
+        try:
+            conn.send(message)
+        except Exception as e: # Resultado no serializable
+            conn.send(("error", type(e).__name__, f"El resultado no se pudo devolver: {e}"[:2000], ""))
+
+
+# --- Lado del proceso principal ---
+class _Worker:
+    """Proceso trabajador con su extremo de la tubería; atiende una ejecución a la vez."""
+
+    def __init__(self, context: Any):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, settings.CODE_EXECUTION_MEMORY_LIMIT_MB),
+            name="hchat-code-sandbox",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def wait_ready(self) -> None:
+        if self.ready:
+            return
+        if not self.conn.poll(_WORKER_STARTUP_TIMEOUT):
+            raise CodeExecutionCrashed("El proceso de ejecución de código no arrancó a tiempo.")
+        status, *details = self.conn.recv()
+        if status != "ready":
+            raise CodeExecutionCrashed(f"El proceso de ejecución de código no pudo iniciarse: {details[1] if len(details) > 1 else details}")
+        self.ready = True
+
+    def kill(self) -> None:
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        finally:
+            self.conn.close()
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+            self.process.join(timeout=5)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class CodeSandboxPool:
+    """Pool de procesos trabajadores; cada ejecución toma un proceso libre de la cola."""
+
+    def __init__(self, size: int):
+        # 'spawn' evita heredar hilos y locks del proceso principal al hacer fork
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._closed = False
+        self.size = size
+        for _ in range(size):
+            self._idle.put(_Worker(self._context))
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.kill()
+        with _stats_lock:
+            _stats["workers_replaced"] += 1
+        if not self._closed:
+            self._idle.put(_Worker(self._context))
+
+    def execute(self, code: str, additional_dependencies: List[Dict[str, str]], used_skills: List[str], timeout: float,
+                row_positions: Optional[List[int]] = None) -> Any:
+        """Ejecuta 'code' en un proceso libre (sobre 'row_positions' si se indican) y devuelve su variable 'result'."""
+        try:
+            worker = self._idle.get(timeout=_WORKER_STARTUP_TIMEOUT)
+        except queue.Empty:
+            raise CodeExecutionCrashed("No hay procesos libres para ejecutar el código.")
+        try:
+            worker.wait_ready()
+            worker.conn.send((code, additional_dependencies, used_skills, row_positions))
+            finished = worker.conn.poll(timeout)
+            message = worker.conn.recv() if finished else None
+        except CodeExecutionCrashed:
+            self._replace(worker)
+            raise
+        except (EOFError, OSError) as e:
+            self._replace(worker)
+            raise CodeExecutionCrashed(f"El proceso de ejecución de código terminó inesperadamente ({type(e).__name__}); posible exceso del límite de memoria.") from e
+        if message is None:
+            logger.error(f"Código generado superó el tiempo máximo ({timeout}s); se termina el proceso {worker.process.pid}.")
+            self._replace(worker)
+            raise CodeExecutionTimeout(f"La ejecución del código superó el tiempo máximo de {timeout:g} segundos y fue cancelada.")
+
+        self._idle.put(worker)
+        if message[0] == "ok":
+            return message[1]
+        _, error_type, error_message, error_traceback = message
+        if error_type == "MemoryError":
+            raise CodeExecutionCrashed(f"La ejecución del código superó el límite de memoria de {settings.CODE_EXECUTION_MEMORY_LIMIT_MB} MB.")
+        raise SandboxedCodeError(f"{error_type}: {error_message}\n{error_traceback}".strip())
+
+    def warm_up(self) -> None:
+        """Espera a que todos los procesos hayan cargado el DataFrame."""
+        workers = [self._idle.get() for _ in range(self.size)]
+        try:
+            for worker in workers:
+                worker.wait_ready()
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+    def shutdown(self) -> None:
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+_pool: Optional[CodeSandboxPool] = None
+_pool_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"executions": 0, "completed": 0, "errors": 0, "timeouts": 0, "crashes": 0, "workers_replaced": 0}
+_durations = deque(maxlen=500)
+_local = threading.local() # Último fallo del sandbox y filas restringidas en el hilo actual
+
+
+def get_code_sandbox() -> Optional[CodeSandboxPool]:
+    """Devuelve el pool de ejecución aislada (singleton), o None si está deshabilitado."""
+    global _pool
+    if settings.CODE_EXECUTION_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = CodeSandboxPool(settings.CODE_EXECUTION_WORKERS)
+                logger.info(f"Sandbox de ejecución de código inicializado con {settings.CODE_EXECUTION_WORKERS} procesos "
+                            f"(timeout {settings.CODE_EXECUTION_TIMEOUT}s, memoria {settings.CODE_EXECUTION_MEMORY_LIMIT_MB or 'sin límite'} MB).")
+    return _pool
+
+
+def warm_code_sandbox() -> None:
+    """Arranca los procesos del sandbox y espera a que tengan el DataFrame cargado."""
+    pool = get_code_sandbox()
+    if pool is not None:
+        pool.warm_up()
+        logger.info("Procesos del sandbox de ejecución de código precalentados.")
+
+
+def run_sandboxed(code: str, additional_dependencies: List[Dict[str, str]], used_skills: List[str]) -> Any:
+    """Ejecuta el código en el sandbox registrando métricas y el último fallo del hilo."""
+    pool = get_code_sandbox()
+    if pool is None:
+        raise RuntimeError("El sandbox de ejecución de código está deshabilitado (CODE_EXECUTION_WORKERS = 0).")
+    with _stats_lock:
+        _stats["executions"] += 1
+    start = time.perf_counter()
+    try:
+        result = pool.execute(code, additional_dependencies, used_skills, settings.CODE_EXECUTION_TIMEOUT,
+                              getattr(_local, "row_positions", None))
+    except (CodeExecutionTimeout, CodeExecutionCrashed) as e:
+        _local.last_failure = str(e)
+        with _stats_lock:
+            _stats["timeouts" if isinstance(e, CodeExecutionTimeout) else "crashes"] += 1
+        raise
+    except SandboxedCodeError:
+        with _stats_lock:
+            _stats["errors"] += 1
+        raise
+    with _stats_lock:
+        _stats["completed"] += 1
+        _durations.append(time.perf_counter() - start)
+    return result
+
+
+@contextmanager
+def restrict_rows(row_positions: Optional[List[int]]) -> Iterator[None]:
+    """Limita las ejecuciones de este hilo a las filas indicadas (posiciones en el DataFrame)."""
+    previous = getattr(_local, "row_positions", None)
+    _local.row_positions = list(row_positions) if row_positions is not None else None
+    try:
+        yield
+    finally:
+        _local.row_positions = previous
+
+
+def pop_sandbox_failure() -> Optional[str]:
+    """Devuelve (y borra) el último timeout o caída del sandbox ocurrido en este hilo."""
+    failure = getattr(_local, "last_failure", None)
+    _local.last_failure = None
+    return failure
+
+
+# --- Integración con el pipeline de PandasAI ---
+class SandboxedCodeManager(CodeManager):
+    """CodeManager de PandasAI que ejecuta el código limpio en el sandbox en lugar de exec()."""
+
+    def execute_code(self, code: str, context: CodeExecutionContext) -> Any:
+        # Misma preparación que CodeManager.execute_code (gráficos, limpieza e imports permitidos)
+        from pandasai.helpers.save_chart import add_save_chart
+        from pandasai.helpers.path import find_project_root
+        code = self._replace_plot_png(code)
+        self._current_code_executed = code
+        if self._config.save_charts:
+            code = add_save_chart(code, logger=self._logger, file_name=str(context.prompt_id),
+                                  save_charts_path_str=self._config.save_charts_path)
+        else:
+            code = add_save_chart(code, logger=self._logger, file_name="temp_chart",
+                                  save_charts_path_str=f"{find_project_root()}/exports/charts")
+        context.skills_manager.used_skills = []
+        code_to_run = self._clean_code(code, context)
+        self.last_code_executed = code_to_run
+        self._logger.log(f"\nCode running (sandbox):\n```\n{code_to_run}\n```")
+        return run_sandboxed(code_to_run, list(self._additional_dependencies), list(context.skills_manager.used_skills))
+
+    def _extract_fix_dataframe_redeclarations(self, node: Any, code_lines: List[str]) -> Any:
+        # PandasAI ejecuta aquí el código generado hasta la línea actual para detectar
+        # DataFrames redeclarados; en modo sandbox no se ejecuta nada en el proceso de la API.
+        return None
+
+
+class SandboxedCodeExecution(CodeExecution):
+    """
+    Paso CodeExecution de PandasAI que usa SandboxedCodeManager (o el CodeManager original
+    si el sandbox está deshabilitado). Un timeout o la caída del proceso no se reintentan
+    con el framework de corrección de errores. Deja en el contexto el código (antes de la
+    limpieza) que se ejecutó con éxito, en 'last_successful_code', para la caché de código.
+    """
+
+    def execute(self, input: Any, **kwargs) -> Any:
+        self.context = kwargs.get("context")
+        self.logger = kwargs.get("logger")
+        code_context = CodeExecutionContext(self.context.get("last_prompt_id"), self.context.skills_manager)
+        manager_class = SandboxedCodeManager if get_code_sandbox() is not None else CodeManager
+        code_manager = manager_class(dfs=self.context.dfs, config=self.context.config, logger=self.logger)
+
+        retry_count = 0
+        code_to_run = input
+        result = None
+        while retry_count <= self.context.config.max_retries:
+            try:
+                result = code_manager.execute_code(code_to_run, code_context)
+                output_type = self.context.get("output_type")
+                if output_type:
+                    validation_ok, validation_errors = OutputValidator.validate(output_type, result)
+                    if not validation_ok:
+                        raise InvalidLLMOutputType(validation_errors)
+                if not OutputValidator.validate_result(result):
+                    raise InvalidOutputValueMismatch(f'Value must match with type {result["type"]}')
+                break
+            except (CodeExecutionTimeout, CodeExecutionCrashed):
+                raise
+            except Exception as e:
+                traceback_errors = traceback.format_exc()
+                self.logger.log(f"Failed with error: {traceback_errors}", logging.ERROR)
+                if self.on_failure:
+                    self.on_failure(code_to_run, traceback_errors)
+                if not self.context.config.use_error_correction_framework or retry_count >= self.context.config.max_retries:
+                    raise e
+                retry_count += 1
+                self.logger.log(f"Failed to execute code retrying with a correction framework [retry number: {retry_count}]", level=logging.WARNING)
+                code_to_run = self._retry_run_code(code_to_run, self.context, self.logger, e)
+
+        self.context.add("last_code_executed", code_manager.last_code_executed)
+        self.context.add("last_successful_code", code_to_run)
+        return LogicUnitOutput(
+            result,
+            True,
+            "Code Executed Successfully",
+            {"content_type": "response", "value": ResponseSerializer.serialize(result)},
+            final_track_output=True,
+        )
+
+
+def install_code_sandbox(smart_df: Any) -> bool:
+    """
+    Sustituye el paso CodeExecution del SmartDataframe por SandboxedCodeExecution
+    (conservando sus callbacks). Devuelve False si el sandbox está deshabilitado (el
+    paso se instala igualmente y ejecuta el código en el proceso de la API).
+    """
+    steps = smart_df._agent.pipeline.code_execution_pipeline._steps
+    for index, step in enumerate(steps):
+        if type(step) is CodeExecution:
+            steps[index] = SandboxedCodeExecution(
+                on_execution=step.on_execution,
+                on_failure=step.on_failure,
+                on_retry=step.on_retry,
+                before_execution=step.before_execution,
+                skip_if=step.skip_if,
+            )
+    return get_code_sandbox() is not None
+
+
+def _percentile_ms(values, pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(pct * len(ordered)))] * 1000, 2)
+
+
+def get_code_sandbox_stats() -> Dict[str, Any]:
+    """Ejecuciones, errores, timeouts, procesos sustituidos y latencias (ms) del sandbox."""
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+        durations = list(_durations)
+    stats["workers"] = settings.CODE_EXECUTION_WORKERS
+    stats["timeout_seconds"] = settings.CODE_EXECUTION_TIMEOUT
+    stats["memory_limit_mb"] = settings.CODE_EXECUTION_MEMORY_LIMIT_MB
+    stats["idle_workers"] = _pool._idle.qsize() if _pool is not None else 0
+    stats["latency_p50_ms"] = _percentile_ms(durations, 0.5)
+    stats["latency_p95_ms"] = _percentile_ms(durations, 0.95)
+    return stats
+
+
+def shutdown_code_sandbox() -> None:
+    """Detiene los procesos del sandbox (llamar al apagar la aplicación)."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
+            logger.info("Sandbox de ejecución de código cerrado.")
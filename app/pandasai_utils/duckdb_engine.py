@@ -0,0 +1,476 @@
+# app/pandasai_utils/duckdb_engine.py
+import re
+import ast
+import logging
+import threading
+from typing import Optional, List, Dict, Any
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+from app.core.dataframe_loader import get_dataframe, get_dataset_version
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+    logging.getLogger(__name__).warning("Falta la librería 'duckdb'. El motor DuckDB de get_tabular_data no estará disponible. Ejecuta pip install duckdb")
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+# Motor alternativo para get_tabular_data: traduce filtro, orden y límite a SQL y los
+# ejecuta en DuckDB en proceso (escaneo multinúcleo, predicados empujados al escaneo).
+# DuckDB solo devuelve las posiciones de las filas resultantes; las filas y columnas se
+# materializan después desde el DataFrame original (materialización tardía), así el
+# resultado conserva índice y tipos exactamente como en la ruta pandas.
+# Las columnas categóricas se exponen como sus códigos enteros: los predicados sobre
+# ellas se evalúan en Python contra las k categorías y se traducen a 'codigo IN (...)'.
+# Si una expresión no se puede traducir con la misma semántica, se devuelve None y
+# la skill usa la ruta pandas.
+# El DataFrame cargado se convierte a tabla Arrow (con la columna de posición) una sola
+# vez por versión del dataset; cada consulta solo la registra en su cursor, sin copiar.
+# Los subconjuntos del DataFrame cargado (filas recuperadas) consultan esa misma tabla
+# unida a sus posiciones; los DataFrames ajenos se convierten en cada llamada.
+
+ROW_POSITION_COLUMN = "__row"
+SUBSET_POSITION_COLUMN = "__subset_row"
+
+_connection = None
+_connection_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"queries": 0, "untranslatable": 0, "errors": 0, "table_builds": 0}
+_table_lock = threading.Lock()
+_table = None # Tabla Arrow del DataFrame cargado
+_table_version: Optional[str] = None
+
+_COMPARISON_OPERATORS = {
+    ast.Eq: "=", ast.NotEq: "<>", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=",
+}
+# Comparaciones evaluadas en Python sobre las categorías (orden de los strings)
+_CATEGORY_COMPARISONS = {
+    "=": lambda a, b: a == b, "<": lambda a, b: a < b, "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b, ">=": lambda a, b: a >= b,
+}
+_FLIPPED_OPERATORS = {"=": "=", "<": ">", "<=": ">=", ">": "<", ">=": "<="}
+_DATETIME_PARTS = {"year": "year", "month": "month", "day": "day", "hour": "hour"}
+_NULL_CHECKS = {"isna": True, "isnull": True, "notna": False, "notnull": False}
+_STRING_METHODS = ("contains", "startswith", "endswith")
+
+
+class UnsupportedExpression(Exception):
+    """La expresión de filtro usa una construcción sin traducción equivalente a SQL."""
+
+
+def is_available() -> bool:
+    return duckdb is not None
+
+
+def get_connection():
+    """Conexión DuckDB en memoria (singleton). Cada consulta usa su propio cursor."""
+    global _connection
+    if _connection is None:
+        with _connection_lock:
+            if _connection is None:
+                config = {"threads": settings.DUCKDB_THREADS} if settings.DUCKDB_THREADS > 0 else {}
+                _connection = duckdb.connect(database=":memory:", config=config)
+                logger.info(f"Motor DuckDB inicializado (hilos: {settings.DUCKDB_THREADS or 'todos'}).")
+    return _connection
+
+
+def _quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _is_text_dtype(dtype: Any) -> bool:
+    return isinstance(dtype, pd.StringDtype) or dtype == object
+
+
+def _sql_literal(value: Any) -> str:
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    raise UnsupportedExpression(f"literal no soportado: {value!r}")
+
+
+def _definite(condition: str, default: bool) -> str:
+    """Comparación sin NA, como en columnas NumPy de pandas: un nulo da 'default'."""
+    return f"COALESCE({condition}, {'TRUE' if default else 'FALSE'})"
+
+
+class _FilterTranslator:
+    """
+    Traduce una expresión de df.query()/df.eval() a una condición SQL con la misma
+    semántica de nulos que pandas: en columnas con tipos NumPy, categóricas o de fecha
+    una comparación con un nulo es False (y '!=' es True); en columnas con tipos
+    nullable (string, Int32) el resultado es NA y se propaga con lógica de Kleene.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.columns: set = set()
+
+    def translate(self, expression: str) -> str:
+        try:
+            tree = ast.parse(expression, mode="eval")
+        except SyntaxError as e:
+            raise UnsupportedExpression(f"sintaxis: {e}") from e
+        return self._predicate(tree.body)
+
+    # --- Predicados (devuelven una condición booleana SQL) ---
+    def _predicate(self, node: ast.AST) -> str:
+        if isinstance(node, ast.BoolOp):
+            joiner = " AND " if isinstance(node.op, ast.And) else " OR "
+            return "(" + joiner.join(self._predicate(value) for value in node.values) + ")"
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+            joiner = " AND " if isinstance(node.op, ast.BitAnd) else " OR "
+            return f"({self._predicate(node.left)}{joiner}{self._predicate(node.right)})"
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+            return f"(NOT {self._predicate(node.operand)})"
+        if isinstance(node, ast.Compare):
+            terms = []
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                terms.append(self._comparison(left, op, right))
+                left = right
+            return terms[0] if len(terms) == 1 else "(" + " AND ".join(terms) + ")"
+        if isinstance(node, ast.Call):
+            return self._method_predicate(node)
+        raise UnsupportedExpression(f"nodo no soportado: {type(node).__name__}")
+
+    def _comparison(self, left: ast.AST, op: ast.cmpop, right: ast.AST) -> str:
+        if isinstance(op, (ast.In, ast.NotIn)):
+            # isin nunca devuelve NA en pandas: un nulo simplemente no pertenece a la lista
+            values = self._literal_list(right)
+            if self._is_categorical(left):
+                condition = self._category_membership(left.id, pd.Series(self._categories(left.id)).isin(values).to_numpy())
+            else:
+                condition = _definite(f"({self._operand(left)} IN ({', '.join(_sql_literal(v) for v in values)}))", False) if values else "FALSE"
+            return f"(NOT {condition})" if isinstance(op, ast.NotIn) else condition
+
+        sql_op = _COMPARISON_OPERATORS.get(type(op))
+        if sql_op is None:
+            raise UnsupportedExpression(f"operador no soportado: {type(op).__name__}")
+        if self._is_categorical(left) or self._is_categorical(right):
+            column_node, other = (left, right) if self._is_categorical(left) else (right, left)
+            if not isinstance(other, ast.Constant) or not isinstance(other.value, str):
+                raise UnsupportedExpression("en columnas categóricas solo se admite comparar con un literal de texto")
+            if sql_op == "<>":
+                return f"(NOT {self._category_membership(column_node.id, self._categories(column_node.id) == other.value)})"
+            # El literal a la izquierda invierte el sentido: 'x' < col equivale a col > 'x'
+            compare = _CATEGORY_COMPARISONS[sql_op if column_node is left else _FLIPPED_OPERATORS[sql_op]]
+            return self._category_membership(column_node.id, compare(pd.Series(self._categories(column_node.id)), other.value).to_numpy(dtype=bool))
+        self._check_types(left, right)
+        self._check_types(right, left)
+
+        year_range = self._year_range(left, sql_op, right)
+        if year_range:
+            return year_range
+        condition = f"({self._operand(left)} {sql_op} {self._operand(right)})"
+        if self._is_nullable(left) or self._is_nullable(right):
+            return condition
+        return _definite(condition, sql_op == "<>")
+
+    def _year_range(self, left: ast.AST, sql_op: str, right: ast.AST) -> Optional[str]:
+        """'fecha.dt.year == N' como rango de fechas, que se empuja al escaneo sin calcular el año."""
+        if sql_op != "=" or not isinstance(right, ast.Constant) or type(right.value) is not int or not 1 <= right.value < 9999:
+            return None
+        if not (isinstance(left, ast.Attribute) and left.attr == "year" and self._is_dt_accessor(left.value)):
+            return None
+        column = self._column_name(left.value.value)
+        if not pd.api.types.is_datetime64_any_dtype(self.df[column].dtype) or isinstance(self.df[column].dtype, pd.DatetimeTZDtype):
+            return None
+        identifier = _quote_identifier(column)
+        year = right.value
+        return _definite(f"({identifier} >= TIMESTAMP '{year:04d}-01-01' AND {identifier} < TIMESTAMP '{year + 1:04d}-01-01')", False)
+
+    def _check_types(self, column_node: ast.AST, other: ast.AST) -> None:
+        """Rechaza comparaciones columna/literal de tipos distintos (pandas y SQL difieren ahí)."""
+        column = self._base_column(column_node)
+        if column is None or isinstance(column_node, ast.Attribute) or not isinstance(other, ast.Constant):
+            return
+        dtype = self.df[column].dtype
+        value = other.value
+        if _is_text_dtype(dtype) or pd.api.types.is_datetime64_any_dtype(dtype):
+            compatible = isinstance(value, str)
+        elif pd.api.types.is_bool_dtype(dtype):
+            compatible = isinstance(value, bool)
+        elif pd.api.types.is_numeric_dtype(dtype):
+            compatible = isinstance(value, (int, float)) and not isinstance(value, bool)
+        else:
+            compatible = False
+        if not compatible:
+            raise UnsupportedExpression(f"tipos incompatibles: columna '{column}' ({dtype}) y {value!r}")
+
+    def _method_predicate(self, node: ast.Call) -> str:
+        func = node.func
+        if not isinstance(func, ast.Attribute):
+            raise UnsupportedExpression("llamada no soportada")
+        if func.attr in _NULL_CHECKS and not node.args and not node.keywords:
+            column = self._column_name(func.value)
+            return f"({_quote_identifier(column)} IS {'' if _NULL_CHECKS[func.attr] else 'NOT '}NULL)"
+        if func.attr in _STRING_METHODS and self._is_str_accessor(func.value):
+            return self._string_predicate(func.attr, func.value.value, node)
+        raise UnsupportedExpression(f"método no soportado: {func.attr}")
+
+    def _string_predicate(self, method: str, column_node: ast.AST, node: ast.Call) -> str:
+        column = self._column_name(column_node)
+        dtype = self.df[column].dtype
+        if not node.args or not isinstance(node.args[0], ast.Constant) or not isinstance(node.args[0].value, str):
+            raise UnsupportedExpression("el patrón debe ser un literal de texto")
+        pattern = node.args[0].value
+        options = {"case": True, "na": None, "regex": True}
+        for keyword in node.keywords:
+            if keyword.arg not in options or not isinstance(keyword.value, ast.Constant):
+                raise UnsupportedExpression(f"argumento no soportado: {keyword.arg}")
+            options[keyword.arg] = keyword.value.value
+        if method != "contains" and (not options["case"] or not options["regex"]):
+            raise UnsupportedExpression("'case'/'regex' solo se admiten en str.contains")
+        # Sin 'na' explícito, pandas solo devuelve una máscara booleana en columnas string
+        if options["na"] is None and not isinstance(dtype, pd.StringDtype):
+            raise UnsupportedExpression("str.* sin 'na' en una columna que no es string")
+        if options["na"] not in (None, True, False):
+            raise UnsupportedExpression("'na' debe ser booleano")
+
+        if isinstance(dtype, pd.CategoricalDtype):
+            # Se aplica el mismo método de pandas a las categorías y se filtra por código
+            categories = pd.Series(self._categories(column), dtype=object)
+            if method == "contains":
+                matches = categories.str.contains(pattern, case=options["case"], regex=options["regex"], na=False)
+            else:
+                matches = getattr(categories.str, method)(pattern, na=False)
+            condition = self._category_membership(column, matches.to_numpy(dtype=bool))
+            return f"({condition} OR {_quote_identifier(column)} IS NULL)" if options["na"] else condition
+        if not _is_text_dtype(dtype):
+            raise UnsupportedExpression(f"'.str' sobre una columna que no es de texto: {column}")
+
+        operand = _quote_identifier(column)
+        literal = _sql_literal(pattern)
+        if method == "startswith":
+            condition = f"starts_with({operand}, {literal})"
+        elif method == "endswith":
+            condition = f"ends_with({operand}, {literal})"
+        elif options["regex"]:
+            re.compile(pattern) # Un patrón inválido también falla en pandas: se deja a la ruta pandas
+            flags = "" if options["case"] else ", 'i'"
+            condition = f"regexp_matches({operand}, {literal}{flags})"
+        elif options["case"]:
+            condition = f"contains({operand}, {literal})"
+        else:
+            condition = f"contains(lower({operand}), {_sql_literal(pattern.lower())})"
+        if options["na"] is None:
+            return condition
+        return _definite(condition, options["na"])
+
+    def _category_membership(self, column: str, category_mask: np.ndarray) -> str:
+        """Condición 'el código de la fila está entre las categorías marcadas' (un nulo no pertenece)."""
+        codes = np.flatnonzero(category_mask)
+        if len(codes) == 0:
+            return "FALSE"
+        identifier = _quote_identifier(column)
+        if len(codes) == 1:
+            return _definite(f"({identifier} = {int(codes[0])})", False)
+        return _definite(f"({identifier} IN ({', '.join(str(int(code)) for code in codes)}))", False)
+
+    # --- Operandos (valores escalares) ---
+    def _operand(self, node: ast.AST) -> str:
+        if isinstance(node, ast.Constant):
+            if node.value is None:
+                raise UnsupportedExpression("comparación con None")
+            return _sql_literal(node.value)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+            return _sql_literal(-node.operand.value)
+        if isinstance(node, ast.Name):
+            return _quote_identifier(self._column_name(node))
+        if isinstance(node, ast.Attribute) and node.attr in _DATETIME_PARTS and self._is_dt_accessor(node.value):
+            column = self._column_name(node.value.value)
+            if not pd.api.types.is_datetime64_any_dtype(self.df[column].dtype):
+                raise UnsupportedExpression(f"'.dt' sobre una columna que no es fecha: {column}")
+            return f"{_DATETIME_PARTS[node.attr]}({_quote_identifier(column)})"
+        raise UnsupportedExpression(f"operando no soportado: {type(node).__name__}")
+
+    def _literal_list(self, node: ast.AST) -> List[Any]:
+        if not isinstance(node, (ast.List, ast.Tuple, ast.Set)):
+            raise UnsupportedExpression("'in' requiere una lista de literales")
+        values = []
+        for element in node.elts:
+            if not isinstance(element, ast.Constant) or element.value is None:
+                raise UnsupportedExpression("'in' requiere una lista de literales")
+            values.append(element.value)
+        return values
+
+    def _column_name(self, node: ast.AST) -> str:
+        if not isinstance(node, ast.Name) or node.id not in self.df.columns:
+            raise UnsupportedExpression("referencia a columna no válida")
+        self.columns.add(node.id)
+        return node.id
+
+    def _categories(self, column: str) -> np.ndarray:
+        self.columns.add(column)
+        return self.df[column].cat.categories.to_numpy(dtype=object)
+
+    @staticmethod
+    def _is_str_accessor(node: ast.AST) -> bool:
+        return isinstance(node, ast.Attribute) and node.attr == "str"
+
+    @staticmethod
+    def _is_dt_accessor(node: ast.AST) -> bool:
+        return isinstance(node, ast.Attribute) and node.attr == "dt"
+
+    def _base_column(self, node: ast.AST) -> Optional[str]:
+        if isinstance(node, ast.Attribute) and self._is_dt_accessor(node.value):
+            node = node.value.value
+        return node.id if isinstance(node, ast.Name) and node.id in self.df.columns else None
+
+    def _is_categorical(self, node: ast.AST) -> bool:
+        return isinstance(node, ast.Name) and node.id in self.df.columns and isinstance(self.df[node.id].dtype, pd.CategoricalDtype)
+
+    def _is_nullable(self, node: ast.AST) -> bool:
+        """True si la comparación en pandas devuelve NA (tipos extensión nullable, no categóricas ni fechas)."""
+        column = self._base_column(node)
+        if column is None or isinstance(node, ast.Attribute):
+            return False
+        dtype = self.df[column].dtype
+        return isinstance(dtype, pd.api.extensions.ExtensionDtype) and not isinstance(dtype, (pd.CategoricalDtype, pd.DatetimeTZDtype))
+
+
+def translate_filter(df: pd.DataFrame, expression: str) -> Optional[str]:
+    """Condición SQL equivalente a 'expression' sobre 'df', o None si no es traducible."""
+    try:
+        return _FilterTranslator(df).translate(expression)
+    except (UnsupportedExpression, re.error) as e:
+        logger.debug(f"  Filtro no traducible a SQL ({e}): {expression}")
+        return None
+
+
+def _scan_column(series: pd.Series) -> Any:
+    """Columna tal como la ve DuckDB: las categóricas como códigos (nulo = sin categoría)."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = series.cat.codes.to_numpy()
+        return pd.arrays.IntegerArray(codes, codes < 0)
+    return series
+
+
+def _build_table(df: pd.DataFrame, columns: List[str]) -> Any:
+    """Tabla Arrow con las columnas indicadas tal como las ve DuckDB, más la posición de fila."""
+    frame = pd.DataFrame({col: _scan_column(df[col]) for col in columns}, copy=False)
+    frame[ROW_POSITION_COLUMN] = np.arange(len(df), dtype=np.int64)
+    # Como tabla Arrow, los strings respaldados por Arrow se escanean sin conversión
+    return pa.Table.from_pandas(frame, preserve_index=False) if pa is not None else frame
+
+
+def _get_loaded_table(base_df: pd.DataFrame) -> Any:
+    """Tabla del DataFrame cargado, construida una vez por versión del dataset."""
+    global _table, _table_version
+    version = get_dataset_version()
+    with _table_lock:
+        if _table is None or _table_version != version:
+            _table = _build_table(base_df, list(base_df.columns))
+            _table_version = version
+            with _stats_lock:
+                _stats["table_builds"] += 1
+            logger.info(f"Motor DuckDB: tabla del dataset registrada (versión {version}, {len(base_df)} filas).")
+        return _table
+
+
+def _positions_in_loaded(base_df: pd.DataFrame, df: pd.DataFrame, columns: List[str]) -> Optional[np.ndarray]:
+    """Posiciones en el DataFrame cargado de las filas de 'df' si es un subconjunto suyo con los mismos tipos."""
+    if len(df) > len(base_df) or not base_df.index.is_unique:
+        return None
+    if any(col not in base_df.columns or df[col].dtype != base_df[col].dtype for col in columns):
+        return None # Otras categorías cambiarían el significado de los códigos
+    positions = base_df.index.get_indexer(df.index)
+    if (positions < 0).any():
+        return None
+    return positions.astype(np.int64)
+
+
+def select_positions(
+    df: pd.DataFrame,
+    filter_conditions: Optional[str],
+    sort_columns: List[str],
+    ascending: List[bool],
+    limit: Optional[int],
+) -> Optional[np.ndarray]:
+    """
+    Ejecuta filtro, orden y límite en DuckDB y devuelve las posiciones de fila del
+    resultado, en el mismo orden que la ruta pandas (orden estable, nulos al final).
+    Devuelve None si DuckDB no está disponible o el filtro no es traducible.
+    """
+    if duckdb is None:
+        return None
+    translator = _FilterTranslator(df)
+    try:
+        where = translator.translate(filter_conditions) if filter_conditions else None
+    except (UnsupportedExpression, re.error) as e:
+        logger.info(f"  Filtro no traducible a SQL ({e}); se usa la ruta pandas.")
+        with _stats_lock:
+            _stats["untranslatable"] += 1
+        return None
+
+    needed = [col for col in df.columns if col in translator.columns or col in sort_columns]
+    base_df = get_dataframe()
+    subset = None
+    if base_df is not None and df is base_df:
+        records = _get_loaded_table(base_df)
+        position_column = ROW_POSITION_COLUMN
+    elif base_df is not None and (subset_positions := _positions_in_loaded(base_df, df, needed)) is not None:
+        # Subconjunto del DataFrame cargado: la tabla compartida unida a sus posiciones
+        records = _get_loaded_table(base_df)
+        subset = pd.DataFrame({
+            ROW_POSITION_COLUMN: subset_positions,
+            SUBSET_POSITION_COLUMN: np.arange(len(df), dtype=np.int64),
+        })
+        position_column = SUBSET_POSITION_COLUMN
+    else:
+        # DataFrame ajeno: solo se exponen las columnas que intervienen
+        records = _build_table(df, needed)
+        position_column = ROW_POSITION_COLUMN
+
+    sql = f"SELECT {_quote_identifier(position_column)} FROM records"
+    if subset is not None:
+        sql += f" JOIN subset USING ({_quote_identifier(ROW_POSITION_COLUMN)})"
+    if where:
+        sql += f" WHERE {where}"
+    has_limit = limit is not None and limit > 0
+    if sort_columns or has_limit:
+        # Orden de pandas: nulos al final y, en empates, el orden original de las filas
+        order_terms = [f"{_quote_identifier(col)} {'ASC' if asc else 'DESC'} NULLS LAST" for col, asc in zip(sort_columns, ascending)]
+        sql += " ORDER BY " + ", ".join(order_terms + [_quote_identifier(position_column)])
+    if has_limit:
+        sql += f" LIMIT {int(limit)}"
+
+    cursor = get_connection().cursor()
+    try:
+        # Registrar una tabla Arrow ya construida no copia los datos
+        cursor.register("records", records)
+        if subset is not None:
+            cursor.register("subset", subset)
+        positions = cursor.execute(sql).fetchnumpy()[position_column]
+    except duckdb.Error as e:
+        logger.warning(f"  Error ejecutando la consulta en DuckDB ({e}); se usa la ruta pandas.")
+        with _stats_lock:
+            _stats["errors"] += 1
+        return None
+    finally:
+        cursor.close()
+    with _stats_lock:
+        _stats["queries"] += 1
+    positions = np.asarray(positions, dtype=np.int64)
+    # Sin ORDER BY el escaneo paralelo no garantiza el orden: se restaura el original
+    return positions if sort_columns or has_limit else np.sort(positions)
+
+
+def get_duckdb_engine_stats() -> Dict[str, Any]:
+    """Consultas resueltas en DuckDB, filtros no traducibles y errores (que caen a pandas)."""
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+    stats["available"] = duckdb is not None
+    stats["engine"] = settings.TABULAR_ENGINE
+    return stats
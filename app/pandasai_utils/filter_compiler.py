@@ -0,0 +1,430 @@
+# app/pandasai_utils/filter_compiler.py
+import re
+import ast
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+import pandas as pd
+from app.core.config import settings
+from app.core.dataframe_loader import lookup_index_positions
+
+logger = logging.getLogger(__name__)
+
+# Compilador restringido para las expresiones 'filter_conditions' que genera el LLM.
+# En lugar de pasar el texto a df.query()/df.eval() (que lo re-parsea en cada llamada y
+# acepta expresiones arbitrarias), la expresión se parsea una vez a AST, se valida contra
+# una lista blanca de nodos, operadores y accesores, y se compila a una función que
+# calcula la máscara de forma vectorizada. Las funciones compiladas se cachean por texto.
+# Predicados comunes usan atajos: igualdad/isin sobre columnas con índice secundario se
+# resuelven con el índice (igualdad exacta, el mismo resultado que sin él, de modo que
+# '==' y '!=' son complementarios), 'fecha.dt.year == N' como rango sobre los datetime64 y los
+# '.str' sobre categóricas se evalúan solo sobre las categorías.
+
+MaskFunction = Callable[[pd.DataFrame], pd.Series]
+
+_COMPARISONS: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Eq: lambda a, b: a == b,
+    ast.NotEq: lambda a, b: a != b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+}
+_ARITHMETIC: Dict[type, Callable[[Any, Any], Any]] = {
+    ast.Add: lambda a, b: a + b,
+    ast.Sub: lambda a, b: a - b,
+    ast.Mult: lambda a, b: a * b,
+    ast.Div: lambda a, b: a / b,
+}
+# Accesores permitidos: atributos de '.dt' y métodos de '.str' / de la serie
+DT_ATTRIBUTES = {"year", "month", "day", "hour", "minute", "dayofweek", "dayofyear", "quarter"}
+STR_METHODS = {"contains", "startswith", "endswith"}
+SERIES_METHODS = {"isna", "isnull", "notna", "notnull", "isin", "between"}
+_STR_KEYWORDS = {"case", "na", "regex"}
+_IDENTIFIER_RE = re.compile(r"^[A-Za-z][A-Za-z0-9_]*$")
+
+
+class FilterCompileError(ValueError):
+    """La expresión de filtro no es válida o usa construcciones no permitidas."""
+
+
+class _Column:
+    """Marcador de un operando que es una columna (o '.dt.<parte>' de una columna)."""
+
+    def __init__(self, name: str, dt_part: Optional[str] = None):
+        self.name = name
+        self.dt_part = dt_part
+
+
+# --- Compilación (AST -> funciones) ---
+class _Compiler:
+    def __init__(self, expression: str):
+        self.expression = expression
+
+    def compile(self) -> MaskFunction:
+        try:
+            tree = ast.parse(self.expression, mode="eval")
+        except SyntaxError as e:
+            raise FilterCompileError(f"sintaxis inválida: {e.msg}") from e
+        predicate = self._predicate(tree.body)
+
+        def mask_function(df: pd.DataFrame) -> pd.Series:
+            result = predicate(df)
+            if not isinstance(result, pd.Series) or not pd.api.types.is_bool_dtype(result.dtype):
+                raise FilterCompileError("la expresión de filtro no produce una máscara booleana")
+            return result
+        return mask_function
+
+    # Predicados: funciones df -> Serie booleana
+    def _predicate(self, node: ast.AST) -> MaskFunction:
+        if isinstance(node, ast.BoolOp):
+            parts = [self._predicate(value) for value in node.values]
+            if isinstance(node.op, ast.And):
+                return lambda df: _reduce(parts, df, lambda a, b: a & b)
+            return lambda df: _reduce(parts, df, lambda a, b: a | b)
+        if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr)):
+            left, right = self._predicate(node.left), self._predicate(node.right)
+            if isinstance(node.op, ast.BitAnd):
+                return lambda df: left(df) & right(df)
+            return lambda df: left(df) | right(df)
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.Invert)):
+            operand = self._predicate(node.operand)
+            return lambda df: ~operand(df)
+        if isinstance(node, ast.Compare):
+            if any(_is_logical_binop(operand) for operand in (node.left, *node.comparators)):
+                return self._predicate(_with_query_precedence(node))
+            terms = []
+            left = node.left
+            for op, right in zip(node.ops, node.comparators):
+                terms.append(self._comparison(left, op, right))
+                left = right
+            return terms[0] if len(terms) == 1 else (lambda df: _reduce(terms, df, lambda a, b: a & b))
+        if isinstance(node, ast.Call):
+            return self._method(node)
+        raise FilterCompileError(f"construcción no permitida en el filtro: {type(node).__name__}")
+
+    def _comparison(self, left: ast.AST, op: ast.cmpop, right: ast.AST) -> MaskFunction:
+        # Como en df.query(), 'col == [..]' y 'col != [..]' equivalen a 'in' / 'not in'
+        if isinstance(op, (ast.Eq, ast.NotEq)) and isinstance(left, (ast.List, ast.Tuple)):
+            left, right = right, left
+        if isinstance(op, (ast.In, ast.NotIn)) or (isinstance(op, (ast.Eq, ast.NotEq)) and isinstance(right, (ast.List, ast.Tuple))):
+            column = self._column_ref(left)
+            values = self._literal_list(right)
+            membership = lambda df: _isin(df, column, values)
+            return membership if isinstance(op, (ast.In, ast.Eq)) else (lambda df: ~membership(df))
+        compare = _COMPARISONS.get(type(op))
+        if compare is None:
+            raise FilterCompileError(f"operador no permitido: {type(op).__name__}")
+        left_value, right_value = self._operand(left), self._operand(right)
+
+        if isinstance(op, ast.Eq):
+            shortcut = _equality_shortcut(left_value, right_value) or _equality_shortcut(right_value, left_value)
+            if shortcut is not None:
+                return shortcut
+        na_value = isinstance(op, ast.NotEq)
+        return lambda df: _compare(compare, left_value(df), right_value(df), na_value)
+
+    def _method(self, node: ast.Call) -> MaskFunction:
+        func = node.func
+        if not isinstance(func, ast.Attribute):
+            raise FilterCompileError("solo se permiten métodos de columna en el filtro")
+        args = [self._literal(arg) for arg in node.args]
+        keywords = {kw.arg: self._literal(kw.value) for kw in node.keywords}
+
+        # col.str.<método>(...)
+        if isinstance(func.value, ast.Attribute) and func.value.attr == "str":
+            if func.attr not in STR_METHODS:
+                raise FilterCompileError(f"método '.str.{func.attr}' no permitido")
+            if len(args) != 1 or not isinstance(args[0], str) or set(keywords) - _STR_KEYWORDS:
+                raise FilterCompileError(f"argumentos no válidos para '.str.{func.attr}'")
+            if func.attr != "contains" and set(keywords) - {"na"}:
+                raise FilterCompileError(f"argumentos no válidos para '.str.{func.attr}'")
+            column = self._column_ref(func.value.value)
+            return lambda df: _string_predicate(df, column, func.attr, args[0], keywords)
+
+        # col.<método>(...)
+        if func.attr not in SERIES_METHODS:
+            raise FilterCompileError(f"método '{func.attr}' no permitido")
+        column = self._column_ref(func.value)
+        if func.attr in ("isna", "isnull", "notna", "notnull"):
+            if args or keywords:
+                raise FilterCompileError(f"'{func.attr}' no admite argumentos")
+            negate = func.attr in ("notna", "notnull")
+            return lambda df: _column_values(df, column).notna() if negate else _column_values(df, column).isna()
+        if func.attr == "isin":
+            if len(args) != 1 or not isinstance(args[0], list) or keywords:
+                raise FilterCompileError("'isin' requiere una lista de literales")
+            return lambda df: _isin(df, column, args[0])
+        # between(a, b[, inclusive])
+        if len(args) != 2 or set(keywords) - {"inclusive"}:
+            raise FilterCompileError("'between' requiere dos límites literales")
+        def between(df: pd.DataFrame) -> pd.Series:
+            series = _column_values(df, column)
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                return _categorical_predicate(series, lambda categories: categories.between(args[0], args[1], **keywords), False)
+            return series.between(args[0], args[1], **keywords)
+        return between
+
+    # Operandos: funciones df -> Serie o escalar (con la columna de origen si la hay)
+    def _operand(self, node: ast.AST) -> Callable[[pd.DataFrame], Any]:
+        if isinstance(node, (ast.Constant, ast.List, ast.Tuple)) or (isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub)):
+            value = self._literal(node)
+            return _ConstantOperand(value)
+        if isinstance(node, ast.BinOp) and type(node.op) in _ARITHMETIC:
+            left, right, operation = self._operand(node.left), self._operand(node.right), _ARITHMETIC[type(node.op)]
+            return lambda df: operation(left(df), right(df))
+        column = self._column_ref(node)
+        return _ColumnOperand(column)
+
+    def _column_ref(self, node: ast.AST) -> _Column:
+        if isinstance(node, ast.Name):
+            if not _IDENTIFIER_RE.match(node.id):
+                raise FilterCompileError(f"nombre de columna no permitido: '{node.id}'")
+            return _Column(node.id)
+        if isinstance(node, ast.Attribute) and isinstance(node.value, ast.Attribute) and node.value.attr == "dt":
+            if node.attr not in DT_ATTRIBUTES:
+                raise FilterCompileError(f"atributo '.dt.{node.attr}' no permitido")
+            base = self._column_ref(node.value.value)
+            if base.dt_part is not None:
+                raise FilterCompileError("accesor '.dt' anidado no permitido")
+            return _Column(base.name, node.attr)
+        raise FilterCompileError(f"operando no permitido en el filtro: {ast.dump(node)[:60]}")
+
+    def _literal(self, node: ast.AST) -> Any:
+        try:
+            value = ast.literal_eval(node)
+        except (ValueError, SyntaxError, TypeError) as e:
+            raise FilterCompileError("solo se permiten literales como argumentos") from e
+        if isinstance(value, tuple):
+            value = list(value)
+        if isinstance(value, list) and not all(isinstance(v, (str, int, float, bool)) for v in value):
+            raise FilterCompileError("las listas solo pueden contener texto o números")
+        if not isinstance(value, (str, int, float, bool, list)) and value is not None:
+            raise FilterCompileError(f"literal no permitido: {type(value).__name__}")
+        return value
+
+    def _literal_list(self, node: ast.AST) -> List[Any]:
+        value = self._literal(node)
+        if not isinstance(value, list):
+            raise FilterCompileError("'in' requiere una lista de literales")
+        return value
+
+
+# --- Precedencia de df.query() ---
+def _is_logical_binop(node: ast.AST) -> bool:
+    return isinstance(node, ast.BinOp) and isinstance(node.op, (ast.BitAnd, ast.BitOr))
+
+
+def _flatten_logical(node: ast.AST, tokens: List[Any]) -> None:
+    if _is_logical_binop(node):
+        _flatten_logical(node.left, tokens)
+        tokens.append(node.op)
+        _flatten_logical(node.right, tokens)
+    else:
+        tokens.append(node)
+
+
+def _with_query_precedence(node: ast.Compare) -> ast.AST:
+    """
+    En df.query() '&' y '|' tienen menor precedencia que las comparaciones, al revés que en
+    Python: 'a == x & b == y' es '(a == x) & (b == y)', pero Python lo parsea como
+    'a == (x & b) == y'. Reagrupa la comparación encadenada con la precedencia de pandas.
+    """
+    tokens: List[Any] = []
+    _flatten_logical(node.left, tokens)
+    for op, comparator in zip(node.ops, node.comparators):
+        tokens.append(op)
+        _flatten_logical(comparator, tokens)
+
+    or_groups: List[List[List[Any]]] = [[[]]] # '|' separa grupos; '&' separa comparaciones de un grupo
+    for token in tokens:
+        if isinstance(token, ast.BitOr):
+            or_groups.append([[]])
+        elif isinstance(token, ast.BitAnd):
+            or_groups[-1].append([])
+        else:
+            or_groups[-1][-1].append(token)
+
+    def segment_node(segment: List[Any]) -> ast.AST:
+        if len(segment) % 2 == 0:
+            raise FilterCompileError("comparación incompleta alrededor de '&'/'|'")
+        if len(segment) == 1:
+            return segment[0]
+        return ast.Compare(left=segment[0], ops=segment[1::2], comparators=segment[2::2])
+
+    def chain(nodes: List[ast.AST], op: ast.operator) -> ast.AST:
+        result = nodes[0]
+        for other in nodes[1:]:
+            result = ast.BinOp(left=result, op=op, right=other)
+        return result
+
+    return chain([chain([segment_node(segment) for segment in group], ast.BitAnd()) for group in or_groups], ast.BitOr())
+
+
+class _ConstantOperand:
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __call__(self, df: pd.DataFrame) -> Any:
+        return self.value
+
+
+class _ColumnOperand:
+    def __init__(self, column: _Column):
+        self.column = column
+
+    def __call__(self, df: pd.DataFrame) -> pd.Series:
+        return _column_values(df, self.column)
+
+
+# --- Evaluación ---
+def _reduce(parts: List[MaskFunction], df: pd.DataFrame, combine: Callable[[Any, Any], Any]) -> pd.Series:
+    result = parts[0](df)
+    for part in parts[1:]:
+        result = combine(result, part(df))
+    return result
+
+
+def _series(df: pd.DataFrame, name: str) -> pd.Series:
+    """Columna de la lista blanca (las columnas del DataFrame)."""
+    if name not in df.columns:
+        raise FilterCompileError(f"columna desconocida en el filtro: '{name}'")
+    return df[name]
+
+
+def _column_values(df: pd.DataFrame, column: _Column) -> pd.Series:
+    series = _series(df, column.name)
+    if column.dt_part is None:
+        return series
+    if not pd.api.types.is_datetime64_any_dtype(series.dtype):
+        raise FilterCompileError(f"'.dt' sobre una columna que no es fecha: '{column.name}'")
+    return getattr(series.dt, column.dt_part)
+
+
+def _positions_to_mask(df: pd.DataFrame, positions: np.ndarray) -> pd.Series:
+    mask = np.zeros(len(df), dtype=bool)
+    mask[positions] = True
+    return pd.Series(mask, index=df.index)
+
+
+def _isin(df: pd.DataFrame, column: _Column, values: List[Any]) -> pd.Series:
+    """isin; sobre columnas con índice secundario, unión de las filas de cada valor (igualdad exacta)."""
+    if column.dt_part is None and values and all(isinstance(v, str) for v in values):
+        lookups = [lookup_index_positions(df, column.name, value) for value in values]
+        if all(rows is not None for rows in lookups):
+            return _positions_to_mask(df, np.concatenate(lookups) if lookups else np.array([], dtype=np.int64))
+    return _column_values(df, column).isin(values)
+
+
+def _categorical_predicate(series: pd.Series, predicate: Callable[[pd.Series], Any], na_value: bool) -> pd.Series:
+    """Evalúa 'predicate' sobre las k categorías y lo expande por código; los nulos dan 'na_value'."""
+    categories = pd.Series(series.cat.categories.to_numpy(dtype=object), dtype=object)
+    matches = np.asarray(predicate(categories), dtype=bool)
+    codes = series.cat.codes.to_numpy()
+    return pd.Series(np.append(matches, na_value)[codes], index=series.index)
+
+
+def _compare(compare: Callable[[Any, Any], Any], left: Any, right: Any, na_value: bool) -> Any:
+    """
+    Comparación de operandos. Contra una columna categórica se compara sobre sus categorías:
+    pandas solo admite '<'/'>' con valores que sean categorías y sin ellas falla o no ordena.
+    """
+    if isinstance(left, pd.Series) and isinstance(left.dtype, pd.CategoricalDtype) and not isinstance(right, pd.Series):
+        return _categorical_predicate(left, lambda categories: compare(categories, right), na_value)
+    if isinstance(right, pd.Series) and isinstance(right.dtype, pd.CategoricalDtype) and not isinstance(left, pd.Series):
+        return _categorical_predicate(right, lambda categories: compare(left, categories), na_value)
+    return compare(left, right)
+
+
+def _equality_shortcut(column_operand: Any, other: Any) -> Optional[MaskFunction]:
+    """Atajos para 'columna == literal': índice secundario (igualdad exacta) o rango de fechas por año."""
+    if not isinstance(column_operand, _ColumnOperand) or not isinstance(other, _ConstantOperand):
+        return None
+    column, value = column_operand.column, other.value
+    if column.dt_part is None and isinstance(value, str):
+        def indexed_equality(df: pd.DataFrame) -> pd.Series:
+            rows = lookup_index_positions(df, column.name, value)
+            if rows is None:
+                return _column_values(df, column) == value
+            return _positions_to_mask(df, rows)
+        return indexed_equality
+    if column.dt_part == "year" and type(value) is int and 1 <= value < 9999:
+        def year_equality(df: pd.DataFrame) -> pd.Series:
+            series = _series(df, column.name)
+            if series.dtype != np.dtype("datetime64[ns]"):
+                return _column_values(df, column) == value
+            # Comparar el rango [1-ene-N, 1-ene-N+1) sobre los int64 evita calcular el año fila a fila
+            values = series.to_numpy().view("i8")
+            start = np.datetime64(f"{value:04d}-01-01", "ns").view("i8")
+            end = np.datetime64(f"{value + 1:04d}-01-01", "ns").view("i8")
+            return pd.Series((values >= start) & (values < end), index=df.index) # NaT es el mínimo int64: queda fuera
+        return year_equality
+    return None
+
+
+def _string_predicate(df: pd.DataFrame, column: _Column, method: str, pattern: str, keywords: Dict[str, Any]) -> pd.Series:
+    if column.dt_part is not None:
+        raise FilterCompileError("'.str' no se puede aplicar sobre '.dt'")
+    series = _series(df, column.name)
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Se evalúa sobre las k categorías y se expande por código; los nulos quedan como NA
+        categories = pd.Series(series.cat.categories.to_numpy(dtype=object), dtype=object)
+        matches = getattr(categories.str, method)(pattern, **{**keywords, "na": False}).to_numpy(dtype=bool)
+        codes = series.cat.codes.to_numpy()
+        result = pd.array(np.append(matches, False)[codes], dtype="boolean")
+        na = keywords.get("na")
+        result[codes < 0] = pd.NA if na is None else bool(na)
+        return pd.Series(result, index=series.index)
+    return getattr(series.str, method)(pattern, **keywords)
+
+
+# --- Caché de expresiones compiladas (LRU por texto) ---
+_cache_lock = threading.Lock()
+_compiled: "OrderedDict[str, MaskFunction]" = OrderedDict()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "rejected": 0}
+
+
+def compile_filter(expression: str) -> MaskFunction:
+    """
+    Devuelve la función compilada (df -> máscara booleana) para 'expression', desde la
+    caché si ya se compiló. Lanza FilterCompileError si la expresión no está permitida.
+    """
+    key = expression.strip()
+    with _cache_lock:
+        compiled = _compiled.get(key)
+        if compiled is not None:
+            _compiled.move_to_end(key)
+            _stats["hits"] += 1
+            return compiled
+    try:
+        compiled = _Compiler(key).compile()
+    except FilterCompileError:
+        with _cache_lock:
+            _stats["rejected"] += 1
+        raise
+    with _cache_lock:
+        _stats["misses"] += 1
+        _compiled[key] = compiled
+        while len(_compiled) > max(1, settings.FILTER_COMPILER_CACHE_SIZE):
+            _compiled.popitem(last=False)
+    return compiled
+
+
+def evaluate_filter(df: pd.DataFrame, expression: str) -> np.ndarray:
+    """Máscara booleana NumPy de 'expression' sobre 'df' (los NA cuentan como False)."""
+    mask = compile_filter(expression)(df)
+    if isinstance(mask.dtype, pd.api.extensions.ExtensionDtype):
+        return mask.fillna(False).to_numpy(dtype=bool)
+    return mask.to_numpy(dtype=bool)
+
+
+def get_filter_compiler_stats() -> Dict[str, Any]:
+    """Aciertos/fallos de la caché de expresiones compiladas y expresiones rechazadas."""
+    with _cache_lock:
+        stats: Dict[str, Any] = dict(_stats)
+        stats["entries"] = len(_compiled)
+    total = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / total, 4) if total else 0.0
+    return stats
@@ -5,6 +5,14 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+def dataframe_to_records(df: pd.DataFrame) -> list[dict]:
+    """
+    Convierte un DataFrame en lista de diccionarios con tipos Python nativos.
+    Los nulos de columnas categóricas, strings Arrow o enteros nullable (pd.NA),
+    así como NaN/NaT, se devuelven como None para que el resultado sea serializable.
+    """
+    return df.astype(object).where(df.notna(), None).to_dict(orient='records')
+
 class FullDataFrameResponseParser(ResponseParser):
     def __init__(self, context) -> None:
         super().__init__(context)
@@ -19,11 +27,11 @@ class FullDataFrameResponseParser(ResponseParser):
             df_value = result.get("value")
             if isinstance(df_value, pd.DataFrame):
                 logger.info(f"FullDataFrameResponseParser: Formateando DataFrame de {len(df_value)} filas a lista de diccionarios.")
-                return df_value.to_dict(orient='records')
+                return dataframe_to_records(df_value)
             elif isinstance(df_value, pd.Series):
                 logger.info(f"FullDataFrameResponseParser: Formateando Series de {len(df_value)} elementos a lista de diccionarios.")
                 # Convertir Series a DataFrame antes para un formato consistente
-                return df_value.to_frame(name=df_value.name or 'value').to_dict(orient='records')
+                return dataframe_to_records(df_value.to_frame(name=df_value.name or 'value'))
             else:
                 logger.warning(f"FullDataFrameResponseParser: Se esperaba pd.DataFrame o pd.Series en 'value', se obtuvo {type(df_value)}. Devolviendo como está.")
                 return df_value # Devolver el valor original si no es DataFrame/Series
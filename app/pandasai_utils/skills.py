@@ -1,11 +1,21 @@
 # app/pandasai_utils/skills.py
 import os
+import re
+import inspect
 import pandas as pd
-import matplotlib.pyplot as plt
 import logging
-from typing import List, Optional, Dict, Any # Asegúrate de importar List, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Union # Asegúrate de importar List, Dict, Any
+import numpy as np
 from pandasai.skills import skill
 from app.core.config import settings # Para PANDASAI_CHART_DIR_NAME
+from app.core.dataframe_loader import lookup_index_positions, get_dataframe, get_dataset_version
+from app.core import chart_cache
+from app.core.text_index import search_rows, TEXT_INDEX_COLUMNS
+from app.core.aggregates import top_counts, AGGREGATE_DIMENSIONS
+from app.pandasai_utils.charts import DEFAULT_CHART_FORMAT
+from app.pandasai_utils.chart_renderer import render_chart
+from app.pandasai_utils import duckdb_engine
+from app.pandasai_utils.filter_compiler import evaluate_filter
 
 logger = logging.getLogger(__name__)
 
@@ -48,92 +58,247 @@ def get_tabular_data(
         - sort_by: Lista de dicts para ordenar.
         - limit: Número de filas.
         - query_description: Descripción.
-        Devuelve: Un DataFrame de Pandas con los resultados.
+        Devuelve: Un DataFrame de Pandas con los resultados. Lanza RuntimeError si el filtro no es válido.
     """
-    df_result = df.copy()
     logger.info(f"[Skill:get_tabular_data] Iniciando: {query_description}")
+    # No se copia el DataFrame completo: se filtra primero y se proyectan columnas en el
+    # mismo paso, de modo que solo se materializan las filas/columnas del resultado.
+    df_result = df
+    derived = False # True cuando df_result ya es un objeto nuevo (no comparte datos con df)
 
-    # 1. Aplicar Filtros
+    # 1. Columnas a devolver (la proyección se aplica junto con el filtro)
+    selected_columns: Optional[List[str]] = None
+    if columns_to_select:
+        valid_columns = [col for col in columns_to_select if col in df.columns]
+        if not valid_columns:
+            logger.warning(f"  Ninguna de las columnas solicitadas para seleccionar ({columns_to_select}) existe en el DataFrame. Se devolverán todas las columnas disponibles del filtro o un DF vacío.")
+        elif len(valid_columns) < len(columns_to_select):
+            missing = set(columns_to_select) - set(valid_columns)
+            logger.warning(f"  Algunas columnas solicitadas no se encontraron/fueron inválidas: {missing}. Seleccionando: {valid_columns}")
+            selected_columns = valid_columns
+        else:
+            logger.debug(f"  Seleccionando columnas: {valid_columns}")
+            selected_columns = valid_columns
+
+    # 2'. Motor DuckDB (opcional): filtro, orden y límite en SQL. Los filtros que
+    # resuelven los índices secundarios siguen por la ruta pandas (ya son O(1)).
+    if settings.TABULAR_ENGINE == "duckdb" and duckdb_engine.is_available():
+        df_sql = _get_tabular_data_duckdb(df, selected_columns, columns_to_select, filter_conditions, sort_by, limit)
+        if df_sql is not None:
+            logger.info(f"[Skill:get_tabular_data] Finalizado (DuckDB). Devolviendo DataFrame con {len(df_sql)} filas y {len(df_sql.columns)} columnas.")
+            return df_sql
+
+    # 2. Aplicar Filtros (+ proyección)
     if filter_conditions and filter_conditions.strip():
+        filter_conditions = normalize_filter_expression(filter_conditions)
         try:
             logger.debug(f"  Aplicando filtro: {filter_conditions}")
-            df_result = df_result.query(filter_conditions)
+            positions = _indexed_filter_positions(df, filter_conditions)
+            if positions is not None:
+                logger.debug("  Filtro resuelto con índices secundarios.")
+                column_positions = [df.columns.get_loc(col) for col in selected_columns] if selected_columns else slice(None)
+                df_result = df.iloc[positions, column_positions]
+            else:
+                # Expresión validada y compilada una sola vez (caché por texto), sin df.eval()
+                mask = evaluate_filter(df, filter_conditions)
+                column_positions = [df.columns.get_loc(col) for col in selected_columns] if selected_columns else slice(None)
+                df_result = df.iloc[np.flatnonzero(mask), column_positions]
+            derived = True
             logger.info(f"  Filas después del filtro: {len(df_result)}")
             if df_result.empty:
                 logger.warning("  DataFrame vacío después del filtro. No se realizarán más operaciones.")
                 return pd.DataFrame(columns=df.columns if columns_to_select is None else columns_to_select) # Devuelve con columnas esperadas
         except Exception as e:
-            logger.error(f"  Error aplicando filtro '{filter_conditions}': {e}. Devolviendo DataFrame vacío.")
-            return pd.DataFrame(columns=df.columns if columns_to_select is None else columns_to_select)
+            # Un filtro inválido no es "sin resultados": se propaga para que se informe el error
+            logger.error(f"  Error aplicando filtro '{filter_conditions}': {e}")
+            raise RuntimeError(f"No se pudo aplicar el filtro '{filter_conditions}': {e}") from e
+    elif selected_columns:
+        df_result = df[selected_columns]
+        derived = True
 
-    # 2. Seleccionar Columnas (después de filtrar, sobre el resultado)
-    if columns_to_select:
-        valid_columns = [col for col in columns_to_select if col in df_result.columns]
-        if not valid_columns:
-            logger.warning(f"  Ninguna de las columnas solicitadas para seleccionar ({columns_to_select}) existe en el DataFrame filtrado. Se devolverán todas las columnas disponibles del filtro o un DF vacío.")
-            # Si no hay columnas válidas, pero el DF filtrado tiene columnas, devolver esas.
-            # Si el DF filtrado está vacío, df_result.columns estará vacío.
-        elif len(valid_columns) < len(columns_to_select):
-            missing = set(columns_to_select) - set(valid_columns)
-            logger.warning(f"  Algunas columnas solicitadas no se encontraron/fueron inválidas: {missing}. Seleccionando: {valid_columns}")
-            df_result = df_result[valid_columns]
-        else:
-            logger.debug(f"  Seleccionando columnas: {valid_columns}")
-            df_result = df_result[valid_columns]
-    
-    # 3. Ordenar Datos
+    # 3. Ordenar Datos (con 'limit', selección top-k en lugar de ordenar todo)
+    sorted_with_limit = False
     if sort_by and not df_result.empty:
-        sort_columns = []
-        sort_orders_bool = []
-        for Sorter in sort_by:
-            col = Sorter.get("column")
-            order = Sorter.get("order", "asc").lower()
-            if col in df_result.columns:
-                sort_columns.append(col)
-                sort_orders_bool.append(order == "asc")
-            else:
-                logger.warning(f"  Columna para ordenar '{col}' no encontrada. Se ignora.")
-        
+        sort_columns, sort_orders_bool = _resolve_sort(sort_by, df_result.columns)
         if sort_columns:
             try:
-                logger.debug(f"  Ordenando por: {sort_columns}, Órdenes: {sort_orders_bool}")
-                df_result = df_result.sort_values(by=sort_columns, ascending=sort_orders_bool)
+                top_k = _top_k_rows(df_result, sort_columns, sort_orders_bool, limit)
+                if top_k is not None:
+                    logger.debug(f"  Selección top-{limit} por: {sort_columns}, Órdenes: {sort_orders_bool}")
+                    df_result = top_k
+                    sorted_with_limit = True
+                else:
+                    logger.debug(f"  Ordenando por: {sort_columns}, Órdenes: {sort_orders_bool}")
+                    df_result = df_result.sort_values(by=sort_columns, ascending=sort_orders_bool, kind="stable")
+                derived = True
             except Exception as e:
                 logger.error(f"  Error al ordenar: {e}. Se continúa sin ordenar.")
 
     # 4. Limitar Resultados
-    if limit is not None and limit > 0 and not df_result.empty:
+    if limit is not None and limit > 0 and not df_result.empty and not sorted_with_limit:
         logger.debug(f"  Limitando a {limit} filas.")
         df_result = df_result.head(limit)
 
+    # Solo se copia si el resultado aún es una vista del DataFrame de entrada
+    if not derived:
+        df_result = df_result.copy()
+
     logger.info(f"[Skill:get_tabular_data] Finalizado. Devolviendo DataFrame con {len(df_result)} filas y {len(df_result.columns)} columnas.")
     return df_result
 
 
-# --- Skill para Generar Gráficos de Frecuencia (Top N) ---
+def _resolve_sort(sort_by: List[Dict[str, str]], available_columns: Any) -> Tuple[List[str], List[bool]]:
+    """Columnas y órdenes (True = ascendente) de 'sort_by', ignorando columnas no disponibles."""
+    sort_columns: List[str] = []
+    sort_orders_bool: List[bool] = []
+    for Sorter in sort_by:
+        col = Sorter.get("column")
+        order = Sorter.get("order", "asc").lower()
+        if col in available_columns:
+            sort_columns.append(col)
+            sort_orders_bool.append(order == "asc")
+        else:
+            logger.warning(f"  Columna para ordenar '{col}' no encontrada. Se ignora.")
+    return sort_columns, sort_orders_bool
+
+
+def _get_tabular_data_duckdb(
+    df: pd.DataFrame,
+    selected_columns: Optional[List[str]],
+    columns_to_select: Optional[List[str]],
+    filter_conditions: Optional[str],
+    sort_by: Optional[List[Dict[str, str]]],
+    limit: Optional[int],
+) -> Optional[pd.DataFrame]:
+    """
+    get_tabular_data sobre DuckDB, con el mismo resultado que la ruta pandas. Devuelve
+    None (para usar la ruta pandas) si el filtro lo resuelven los índices secundarios o
+    no tiene traducción a SQL.
+    """
+    expression = normalize_filter_expression(filter_conditions) if filter_conditions and filter_conditions.strip() else None
+    if not expression and not sort_by:
+        return None # Solo proyección/límite: la ruta pandas ya es O(limit)
+    if expression and _filter_uses_indexes(df, expression):
+        return None
+    output_columns = selected_columns or list(df.columns)
+    sort_columns, ascending = _resolve_sort(sort_by, output_columns) if sort_by else ([], [])
+    positions = duckdb_engine.select_positions(df, expression, sort_columns, ascending, limit)
+    if positions is None:
+        return None
+    if expression and len(positions) == 0:
+        logger.warning("  DataFrame vacío después del filtro. No se realizarán más operaciones.")
+        return pd.DataFrame(columns=df.columns if columns_to_select is None else columns_to_select)
+    column_positions = [df.columns.get_loc(col) for col in selected_columns] if selected_columns else slice(None)
+    return df.iloc[positions, column_positions]
+
+
+def _top_k_rows(df: pd.DataFrame, sort_columns: List[str], ascending: List[bool], limit: Optional[int]) -> Optional[pd.DataFrame]:
+    """
+    Devuelve las 'limit' primeras filas según el orden pedido usando nlargest/nsmallest,
+    o None si no aplica (sin límite, órdenes mezclados, columnas no numéricas/fecha, o
+    menos filas no nulas que el límite, donde sort_values+head colocaría nulos al final).
+    """
+    if limit is None or limit <= 0 or limit >= len(df) or len(set(ascending)) != 1:
+        return None
+    if not all(pd.api.types.is_numeric_dtype(df[col]) or pd.api.types.is_datetime64_any_dtype(df[col]) for col in sort_columns):
+        return None
+    if any(pd.api.types.is_bool_dtype(df[col]) for col in sort_columns):
+        return None
+    selector = df.nsmallest if ascending[0] else df.nlargest
+    result = selector(limit, sort_columns)
+    if len(result) < limit or result[sort_columns].isna().any().any():
+        return None
+    return result
+
+
+# --- Skill de Búsqueda por Palabras Clave (índice invertido) ---
 @skill
-def plot_top_n_frequencies(
+def search_keywords(
+    df: pd.DataFrame,
+    keywords: str,
+    columns_to_search: Optional[List[str]] = None,
+    columns_to_select: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    query_description: Optional[str] = "Búsqueda por palabras clave"
+) -> pd.DataFrame:
+    """
+        HABILIDAD PERSONALIZADA: Busca palabras clave en el texto de los registros ('parsed_text'
+        y 'cargo_list') usando un índice invertido, sin distinguir mayúsculas, acentos ni plurales.
+        Preferible a str.contains para buscar términos como 'tormenta', 'cacao' o 'azúcar'.
+        Parámetros:
+        - df: El DataFrame de entrada (PandasAI lo pasará automáticamente).
+        - keywords: Palabras separadas por espacios (todas deben aparecer), 'OR' entre
+          alternativas y frases exactas entre comillas dobles. Ej: 'cacao OR "azucar blanco"'.
+        - columns_to_search: Columnas de texto donde buscar (por defecto ambas).
+        - columns_to_select: Columnas a devolver además de 'row_id'. Omitir para todas.
+        - limit: Número de filas.
+        - query_description: Descripción.
+        Devuelve: Un DataFrame con 'row_id' (etiqueta de la fila en el dataset, la misma aunque
+        'df' sea un subconjunto) y las columnas pedidas.
+    """
+    logger.info(f"[Skill:search_keywords] Iniciando: {query_description} (keywords={keywords!r})")
+    search_columns = [col for col in (columns_to_search or TEXT_INDEX_COLUMNS) if col in TEXT_INDEX_COLUMNS]
+    if not search_columns:
+        logger.warning(f"  Columnas de búsqueda no indexadas: {columns_to_search}. Se usan {TEXT_INDEX_COLUMNS}.")
+        search_columns = list(TEXT_INDEX_COLUMNS)
+
+    rows = search_rows(df, keywords, search_columns)
+    if limit is not None and limit > 0:
+        rows = rows[:limit]
+
+    selected = [col for col in (columns_to_select or list(df.columns)) if col in df.columns] or list(df.columns)
+    df_result = df.iloc[rows, [df.columns.get_loc(col) for col in selected]]
+    df_result.insert(0, "row_id", df.index[rows])
+    logger.info(f"[Skill:search_keywords] Finalizado. {len(df_result)} filas coinciden.")
+    return df_result
+
+
+# --- Skill de Conteos Agrupados (agregados materializados) ---
+@skill
+def count_by_group(
+    df: pd.DataFrame,
+    group_by: str,
+    top_n: Optional[int] = None,
+    ascending: bool = False,
+    query_description: Optional[str] = "Conteo de registros por grupo"
+) -> pd.DataFrame:
+    """
+        HABILIDAD PERSONALIZADA: Cuenta los registros por cada valor de una dimensión y
+        devuelve los grupos ordenados por frecuencia. Para 'ship_type', 'travel_departure_port',
+        'travel_arrival_port', 'news_section', 'publication_year' y 'publication_month' usa
+        conteos precalculados al cargar los datos.
+        Parámetros:
+        - df: El DataFrame de entrada (PandasAI lo pasará automáticamente).
+        - group_by: Dimensión por la que agrupar. Además de las columnas admite
+          'publication_year' (año) y 'publication_month' ('AAAA-MM') de 'publication_date'.
+        - top_n: Número de grupos a devolver. Omitir para todos.
+        - ascending: True para los grupos menos frecuentes primero.
+        - query_description: Descripción.
+        Devuelve: Un DataFrame con las columnas [group_by, 'count'].
+    """
+    logger.info(f"[Skill:count_by_group] Iniciando: {query_description} (group_by={group_by!r}, top_n={top_n})")
+    if group_by not in df.columns and group_by not in AGGREGATE_DIMENSIONS:
+        logger.error(f"  Dimensión '{group_by}' no encontrada (ni columna ni una de {list(AGGREGATE_DIMENSIONS.keys())}). Devolviendo DataFrame vacío.")
+        return pd.DataFrame(columns=[group_by, "count"])
+    counts = top_counts(df, group_by, top_n if top_n is not None and top_n > 0 else None, ascending)
+    df_result = pd.DataFrame({group_by: counts.index, "count": counts.to_numpy()})
+    logger.info(f"[Skill:count_by_group] Finalizado. {len(df_result)} grupos.")
+    return df_result
+
+
+# --- Gráficos de Frecuencia (Top N) ---
+def render_top_n_frequencies(
     df: pd.DataFrame,
     column_name: str,
     top_n: int = 15,
     chart_title: Optional[str] = None,
     normalize_ship_types: bool = False, # Específico para ship_type
     query_description: Optional[str] = "Graficar frecuencias Top N"
-) -> Optional[str]: # Devuelve la ruta al archivo del gráfico o un mensaje de error/None
+) -> Union[bytes, str]:
     """
-    Genera un gráfico de barras de las 'top_n' frecuencias más comunes para 'column_name'.
-    Guarda el gráfico y devuelve la ruta.
-
-    Args:
-        df (pd.DataFrame): DataFrame de entrada.
-        column_name (str): Nombre de la columna para calcular frecuencias.
-        top_n (int): Número de los elementos más frecuentes a mostrar.
-        chart_title (Optional[str]): Título personalizado para el gráfico.
-        normalize_ship_types (bool): Si es True y column_name es 'ship_type', normaliza los nombres.
-        query_description (Optional[str]): Descripción para logging.
-
-    Returns:
-        Optional[str]: Ruta al archivo del gráfico guardado, o un string de error/None.
+    Genera en memoria un gráfico de barras de las 'top_n' frecuencias más comunes para
+    'column_name'. Devuelve los bytes PNG, o un string con el mensaje de error.
+    Es la implementación que usa el despachador directo de skills (sin archivos).
     """
     logger.info(f"[Skill:plot_top_n_frequencies] Iniciando: {query_description} para columna '{column_name}' (Top {top_n})")
     try:
@@ -142,13 +307,14 @@ def plot_top_n_frequencies(
             logger.error(f"  {msg}")
             return msg # Devolver mensaje de error
 
-        if df[column_name].isnull().all():
+        # Sobre el DataFrame cargado se leen los agregados materializados (O(top_n))
+        counts = top_counts(df, column_name, top_n)
+
+        if counts.empty and df[column_name].isnull().all():
             msg = f"La columna '{column_name}' solo contiene valores nulos. No se puede generar el gráfico."
             logger.warning(f"  {msg}")
             return msg
 
-        counts = df[column_name].value_counts(dropna=True).nlargest(top_n)
-
         if counts.empty:
             msg = f"No hay datos para graficar para la columna '{column_name}' después de contar (Top {top_n})."
             logger.warning(f"  {msg}")
@@ -156,46 +322,253 @@ def plot_top_n_frequencies(
         
         logger.debug(f"  Frecuencias calculadas (Top {top_n}):\n{counts.head()}")
 
+        labels = [str(x).strip() for x in counts.index]
         # Normalizar nombres si es ship_type y se solicita
         if normalize_ship_types and column_name == 'ship_type':
             logger.info("  Normalizando nombres de ship_type para el gráfico.")
-            original_indices = counts.index.tolist()
-            counts.index = counts.index.map(lambda x: MAPEO_TIPOS_BARCO.get(str(x).strip(), str(x).strip()))
-            logger.debug(f"    Índices originales: {original_indices}, Índices normalizados: {counts.index.tolist()}")
-
+            normalized = [MAPEO_TIPOS_BARCO.get(label, label) for label in labels]
+            logger.debug(f"    Índices originales: {labels}, Índices normalizados: {normalized}")
+            labels = normalized
 
         final_chart_title = chart_title or f'Top {top_n} Frecuencias de {column_name.replace("_", " ").title()}'
-        
-        # Mejoras visuales para el gráfico
-        plt.figure(figsize=(max(10, int(len(counts)*0.5) ), 6)) # Ancho dinámico, mínimo 10
-        bars = counts.plot(kind='bar', color='skyblue', width=0.85)
-        plt.title(final_chart_title, fontsize=15, pad=20)
-        plt.ylabel('Frecuencia', fontsize=11)
-        plt.xlabel(column_name.replace("_", " ").title(), fontsize=11)
-        plt.xticks(rotation=45, ha="right", fontsize=9)
-        plt.yticks(fontsize=9)
-        plt.grid(axis='y', linestyle=':', alpha=0.6)
-        
-        # Añadir valores encima de las barras
-        for bar in bars.patches:
-            bars.annotate(format(bar.get_height(), '.0f'),
-                           (bar.get_x() + bar.get_width() / 2,
-                            bar.get_height()), ha='center', va='center',
-                           size=8, xytext=(0, 8),
-                           textcoords='offset points')
-            
-        plt.tight_layout(pad=1.5)
-
-        chart_filename = f"plot_top_n_{column_name.replace(' ', '_').replace('.', '')}_{pd.Timestamp.now().strftime('%Y%m%d%H%M%S%f')}.png"
-        chart_save_path = os.path.join(settings.PANDASAI_CHART_DIR_NAME, chart_filename)
-        
-        os.makedirs(settings.PANDASAI_CHART_DIR_NAME, exist_ok=True)
-        plt.savefig(chart_save_path, dpi=100) # Guardar con buena resolución
-        plt.close()
-        logger.info(f"  Gráfico guardado en: {chart_save_path}")
-        
-        return chart_save_path
+        # El dibujado se hace en el pool de procesos renderizadores (fuera de este hilo)
+        image_bytes = render_chart(
+            "bar",
+            {"labels": labels, "values": counts.tolist()},
+            {"title": final_chart_title, "xlabel": column_name.replace("_", " ").title()},
+        )
+        logger.info(f"  Gráfico generado en memoria ({len(image_bytes)} bytes).")
+        return image_bytes
 
     except Exception as e:
         logger.exception(f"[Skill:plot_top_n_frequencies] Error crítico generando gráfico para '{column_name}': {e}")
-        return f"Error al generar el gráfico para '{column_name}': {str(e)[:100]}" # Devolver mensaje de error
\ No newline at end of file
+        return f"Error al generar el gráfico para '{column_name}': {str(e)[:100]}" # Devolver mensaje de error
+
+
+@skill
+def plot_top_n_frequencies(
+    df: pd.DataFrame,
+    column_name: str,
+    top_n: int = 15,
+    chart_title: Optional[str] = None,
+    normalize_ship_types: bool = False, # Específico para ship_type
+    query_description: Optional[str] = "Graficar frecuencias Top N"
+) -> Optional[str]: # Devuelve la ruta al archivo del gráfico o un mensaje de error/None
+    """
+    Genera un gráfico de barras de las 'top_n' frecuencias más comunes para 'column_name'.
+    Guarda el gráfico y devuelve la ruta.
+
+    Args:
+        df (pd.DataFrame): DataFrame de entrada.
+        column_name (str): Nombre de la columna para calcular frecuencias.
+        top_n (int): Número de los elementos más frecuentes a mostrar.
+        chart_title (Optional[str]): Título personalizado para el gráfico.
+        normalize_ship_types (bool): Si es True y column_name es 'ship_type', normaliza los nombres.
+        query_description (Optional[str]): Descripción para logging.
+
+    Returns:
+        Optional[str]: Ruta al archivo del gráfico guardado, o un string de error/None.
+    """
+    # PandasAI solo acepta resultados de tipo 'plot' como rutas de archivo, así que
+    # esta variante (la que ve PandasAI) guarda la imagen; el despachador directo
+    # usa render_top_n_frequencies y nunca toca el disco.
+    chart = render_top_n_frequencies(df, column_name, top_n, chart_title, normalize_ship_types, query_description)
+    if not isinstance(chart, bytes):
+        return chart
+    chart_filename = f"plot_top_n_{column_name.replace(' ', '_').replace('.', '')}_{pd.Timestamp.now().strftime('%Y%m%d%H%M%S%f')}.png"
+    chart_save_path = os.path.join(settings.PANDASAI_CHART_DIR_NAME, chart_filename)
+    os.makedirs(settings.PANDASAI_CHART_DIR_NAME, exist_ok=True)
+    with open(chart_save_path, "wb") as f:
+        f.write(chart)
+    logger.info(f"  Gráfico guardado en: {chart_save_path}")
+    return chart_save_path
+
+
+# --- Normalización de expresiones de filtro ---
+# El moderador a veces genera "df['columna'] == 'x'", que df.query() no entiende.
+_DF_COLUMN_REF_RE = re.compile(r"""df\[\s*['"]([A-Za-z_][A-Za-z0-9_]*)['"]\s*\]|df\.([A-Za-z_][A-Za-z0-9_]*)\b""")
+
+def normalize_filter_expression(expression: str) -> str:
+    """Convierte referencias df['col'] / df.col en nombres de columna válidos para df.query()."""
+    return _DF_COLUMN_REF_RE.sub(lambda m: m.group(1) or m.group(2), expression).strip()
+
+
+# --- Filtros por igualdad resueltos con índices secundarios ---
+# "col == 'valor'" o una conjunción de ellas con 'and' / '&' (cada término puede ir entre paréntesis).
+_EQUALITY_TERM_RE = re.compile(r"""\s*(\()?\s*([A-Za-z_][A-Za-z0-9_]*)\s*==\s*(['"])(.*?)\3\s*(?(1)\))\s*""")
+_CONJUNCTION_RE = re.compile(r"and\b|&")
+
+def parse_equality_conjunction(expression: str) -> Optional[List[Tuple[str, str]]]:
+    """Devuelve [(columna, valor), ...] si la expresión es una conjunción de igualdades con literales de texto."""
+    terms: List[Tuple[str, str]] = []
+    pos = 0
+    while True:
+        match = _EQUALITY_TERM_RE.match(expression, pos)
+        if not match or "\\" in match.group(4):
+            return None
+        terms.append((match.group(2), match.group(4)))
+        pos = match.end()
+        if pos == len(expression):
+            return terms
+        conjunction = _CONJUNCTION_RE.match(expression, pos)
+        if not conjunction:
+            return None
+        pos = conjunction.end()
+
+def _filter_uses_indexes(df: pd.DataFrame, expression: str) -> bool:
+    """True si algún término de la conjunción de igualdades tiene índice secundario sobre 'df'."""
+    terms = parse_equality_conjunction(expression)
+    return bool(terms) and all(col in df.columns for col, _ in terms) and any(
+        lookup_index_positions(df, col, value) is not None for col, value in terms
+    )
+
+def _indexed_filter_positions(df: pd.DataFrame, expression: str) -> Optional[np.ndarray]:
+    """
+    Resuelve el filtro con los índices secundarios del DataFrame cargado (O(1) por término,
+    igualdad exacta como en df.query()). Los términos sobre columnas no indexadas se
+    comprueban solo en las filas candidatas. Devuelve None si el filtro no es aplicable.
+    """
+    terms = parse_equality_conjunction(expression)
+    if not terms or any(col not in df.columns for col, _ in terms):
+        return None
+    positions: Optional[np.ndarray] = None
+    remaining: List[Tuple[str, str]] = []
+    for col, value in terms:
+        rows = lookup_index_positions(df, col, value)
+        if rows is None:
+            remaining.append((col, value))
+        else:
+            positions = rows if positions is None else np.intersect1d(positions, rows, assume_unique=True)
+    if positions is None:
+        return None
+    for col, value in remaining:
+        if len(positions) == 0:
+            break
+        matches = (df[col].iloc[positions] == value).fillna(False).to_numpy(dtype=bool)
+        positions = positions[matches]
+    return positions
+
+
+# --- Registro y Despachador de Skills (ejecución directa sin PandasAI) ---
+SKILL_REGISTRY: Dict[str, Any] = {
+    "get_tabular_data": get_tabular_data,
+    "plot_top_n_frequencies": plot_top_n_frequencies,
+    "search_keywords": search_keywords,
+    "count_by_group": count_by_group,
+}
+
+# Implementaciones directas que sustituyen a la función de la skill (misma firma)
+# cuando no se ejecuta a través de PandasAI, ej. gráficos en memoria en lugar de en disco.
+DIRECT_SKILL_IMPLEMENTATIONS: Dict[str, Any] = {
+    "plot_top_n_frequencies": render_top_n_frequencies,
+}
+
+# Skills de gráficos cuyo resultado se cachea, con los argumentos que no afectan a la imagen
+CACHEABLE_CHART_SKILLS: Dict[str, set] = {
+    "plot_top_n_frequencies": {"query_description"},
+}
+
+def _skill_function(skill_obj: Any):
+    """Devuelve la función Python subyacente de una skill decorada con @skill."""
+    return getattr(skill_obj, "func", skill_obj)
+
+def _coerce_argument(skill_name: str, name: str, value: Any, annotation: Any) -> Any:
+    """Valida y convierte un argumento según la anotación de la skill."""
+    if value is None:
+        return None
+    target = annotation
+    origin = getattr(annotation, "__origin__", None)
+    if origin is not None and type(None) in getattr(annotation, "__args__", ()):  # Optional[X]
+        target = next(a for a in annotation.__args__ if a is not type(None))
+    target_origin = getattr(target, "__origin__", target)
+
+    try:
+        if target_origin is bool:
+            if isinstance(value, str):
+                return value.strip().lower() in ("true", "1", "si", "sí", "yes")
+            return bool(value)
+        if target_origin is int:
+            if isinstance(value, bool):
+                raise ValueError("booleano no es un entero válido")
+            return int(value)
+        if target_origin is str:
+            return str(value)
+        if target_origin is list:
+            if isinstance(value, (str, dict)):
+                value = [value]
+            if not isinstance(value, (list, tuple)):
+                raise ValueError(f"se esperaba una lista, se recibió {type(value).__name__}")
+            return list(value)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Argumento inválido '{name}' para la skill '{skill_name}': {e}") from e
+    return value
+
+def validate_skill_call(skill_call: Any) -> Dict[str, Any]:
+    """
+    Valida una invocación estructurada {"name": str, "args": dict} y devuelve
+    una copia con los argumentos convertidos. Lanza ValueError si no es válida.
+    """
+    if not isinstance(skill_call, dict):
+        raise ValueError("La invocación de skill debe ser un objeto con 'name' y 'args'.")
+    name = skill_call.get("name")
+    if name not in SKILL_REGISTRY:
+        raise ValueError(f"Skill desconocida: '{name}'. Disponibles: {list(SKILL_REGISTRY.keys())}")
+    args = skill_call.get("args") or {}
+    if not isinstance(args, dict):
+        raise ValueError(f"Los argumentos de la skill '{name}' deben ser un objeto.")
+
+    parameters = inspect.signature(_skill_function(SKILL_REGISTRY[name])).parameters
+    coerced: Dict[str, Any] = {}
+    for arg_name, value in args.items():
+        if arg_name == "df":
+            continue # El DataFrame siempre lo aporta el despachador
+        if arg_name not in parameters:
+            raise ValueError(f"Argumento desconocido '{arg_name}' para la skill '{name}'.")
+        coerced[arg_name] = _coerce_argument(name, arg_name, value, parameters[arg_name].annotation)
+
+    missing = [
+        p.name for p in parameters.values()
+        if p.name != "df" and p.default is inspect.Parameter.empty and p.name not in coerced
+    ]
+    if missing:
+        raise ValueError(f"Faltan argumentos obligatorios para la skill '{name}': {missing}")
+    return {"name": name, "args": coerced}
+
+def _chart_cache_key(name: str, args: Dict[str, Any], df: pd.DataFrame) -> Optional[str]:
+    """
+    Clave de la caché de gráficos: argumentos completados con sus valores por defecto
+    (sin los que no afectan a la imagen), versión del dataset y formato. Solo aplica
+    sobre el DataFrame cargado, que es el que identifica la versión del dataset.
+    """
+    if name not in CACHEABLE_CHART_SKILLS or df is not get_dataframe():
+        return None
+    ignored = CACHEABLE_CHART_SKILLS[name]
+    parameters = inspect.signature(_skill_function(SKILL_REGISTRY[name])).parameters
+    normalized = {
+        p.name: args.get(p.name, p.default)
+        for p in parameters.values()
+        if p.name != "df" and p.name not in ignored
+    }
+    return chart_cache.make_key(name, normalized, get_dataset_version(), DEFAULT_CHART_FORMAT)
+
+def execute_skill_call(df: pd.DataFrame, skill_call: Dict[str, Any]) -> Any:
+    """
+    Ejecuta directamente una skill registrada sobre el DataFrame dado, sin pasar
+    por la generación de código de PandasAI. Lanza ValueError si la invocación no es válida.
+    Los gráficos repetidos se sirven desde la caché de gráficos renderizados.
+    """
+    validated = validate_skill_call(skill_call)
+    name, args = validated["name"], validated["args"]
+    cache_key = _chart_cache_key(name, args, df)
+    if cache_key is not None:
+        cached = chart_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"[SkillDispatcher] '{name}' servido desde la caché de gráficos ({len(cached)} bytes).")
+            return cached
+
+    skill_fn = DIRECT_SKILL_IMPLEMENTATIONS.get(name) or _skill_function(SKILL_REGISTRY[name])
+    logger.info(f"[SkillDispatcher] Ejecutando '{name}' con args: {args}")
+    result = skill_fn(df, **args)
+    if cache_key is not None and isinstance(result, bytes):
+        chart_cache.put(cache_key, result)
+    return result
@@ -0,0 +1,199 @@
+# app/vector_store/docstore.py
+import os
+import json
+import hashlib
+import logging
+import pickle
+import threading
+from collections.abc import Mapping
+from typing import Optional, Dict, List, Iterator, Iterable, Any, Sequence, Tuple, Union
+import pyarrow as pa
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+# Almacén de documentos del índice FAISS en un fichero Arrow IPC sin compresión que se
+# abre con memory-map: la fila i es el documento con id FAISS i (columnas 'docstore_id',
+# 'page_content' y una columna por clave de metadatos). Abrirlo no deserializa el corpus
+# (los procesos comparten las páginas a través de la caché del sistema operativo) y, a
+# diferencia del .pkl de LangChain, leerlo no ejecuta código arbitrario. Todas las
+# variantes del índice comparten el docstore; su hash de contenido ('content_sha256' en
+# los metadatos del esquema) permite detectar un índice construido con otros documentos.
+
+DOCSTORE_SUFFIX = ".docstore.arrow"
+DOCSTORE_FORMAT_VERSION = 1
+_ID_COLUMN = "docstore_id"
+_TEXT_COLUMN = "page_content"
+_RESERVED_COLUMNS = (_ID_COLUMN, _TEXT_COLUMN)
+
+
+def docstore_path(index_folder: str, index_name: str) -> str:
+    """Ruta del almacén Arrow junto a los ficheros del índice FAISS."""
+    return os.path.join(index_folder, f"{index_name}{DOCSTORE_SUFFIX}")
+
+
+def documents_content_hash(documents: Iterable[Document]) -> str:
+    """SHA-256 del texto y los metadatos de los documentos, en orden de id FAISS."""
+    digest = hashlib.sha256()
+    for doc in documents:
+        digest.update(json.dumps([doc.page_content, doc.metadata], sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+def write_arrow_docstore(path: str, docstore_ids: Sequence[str], documents: Sequence[Document]) -> None:
+    """
+    Escribe los documentos (en el orden de los ids FAISS) en un fichero Arrow IPC sin
+    compresión. Los metadatos con tipos mixtos se guardan como JSON.
+    """
+    metadata_keys: List[str] = []
+    for doc in documents:
+        for key in doc.metadata:
+            if key not in metadata_keys and key not in _RESERVED_COLUMNS:
+                metadata_keys.append(key)
+
+    columns: Dict[str, pa.Array] = {
+        _ID_COLUMN: pa.array(list(docstore_ids), type=pa.string()),
+        _TEXT_COLUMN: pa.array([doc.page_content for doc in documents], type=pa.string()),
+    }
+    json_columns: List[str] = []
+    for key in metadata_keys:
+        values = [doc.metadata.get(key) for doc in documents]
+        try:
+            columns[key] = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            columns[key] = pa.array([None if v is None else json.dumps(v, ensure_ascii=False, default=str) for v in values], type=pa.string())
+            json_columns.append(key)
+
+    table = pa.table(columns).replace_schema_metadata({
+        "format_version": str(DOCSTORE_FORMAT_VERSION),
+        "metadata_keys": json.dumps(metadata_keys),
+        "json_columns": json.dumps(json_columns),
+        "content_sha256": documents_content_hash(documents),
+    })
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=len(documents) or None) # Un solo lote: acceso por fila O(1)
+    os.replace(tmp_path, path)
+
+
+class _FaissIdMapping(Mapping):
+    """Vista id FAISS -> id del docstore sobre la columna Arrow (sin copiarla a un dict)."""
+
+    def __init__(self, ids: pa.Array):
+        self._ids = ids
+
+    def __getitem__(self, faiss_id: int) -> str:
+        if not 0 <= faiss_id < len(self._ids):
+            raise KeyError(faiss_id)
+        return self._ids[faiss_id].as_py()
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self._ids)))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class ArrowDocstore(Docstore):
+    """Docstore de solo lectura sobre un fichero Arrow abierto con memory-map."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._source = pa.memory_map(path, "r")
+        table = pa.ipc.open_file(self._source).read_all() # Sin copia: los buffers apuntan al mapa
+        schema_metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+        if schema_metadata.get("format_version") != str(DOCSTORE_FORMAT_VERSION):
+            raise ValueError(f"Versión de formato del docstore no soportada en {path}: {schema_metadata.get('format_version')}")
+        self._schema_metadata = schema_metadata
+        self._table = table.combine_chunks()
+        self._ids = self._table.column(_ID_COLUMN).chunk(0) if self._table.num_rows else pa.array([], type=pa.string())
+        self._metadata_keys: List[str] = json.loads(schema_metadata.get("metadata_keys", "[]"))
+        self._json_columns = set(json.loads(schema_metadata.get("json_columns", "[]")))
+        self._row_by_id: Optional[Dict[str, int]] = None
+        self._row_by_id_lock = threading.Lock()
+        self.index_to_docstore_id = _FaissIdMapping(self._ids)
+
+    def __len__(self) -> int:
+        return self._table.num_rows
+
+    def _row_for_id(self, docstore_id: str) -> Optional[int]:
+        if self._row_by_id is None:
+            with self._row_by_id_lock:
+                if self._row_by_id is None:
+                    self._row_by_id = {doc_id: row for row, doc_id in enumerate(self._ids.to_pylist())}
+        return self._row_by_id.get(docstore_id)
+
+    def get_by_faiss_id(self, faiss_id: int) -> Document:
+        """Materializa el documento de la fila 'faiss_id'."""
+        row = self._table.slice(faiss_id, 1).to_pylist()[0]
+        metadata: Dict[str, Any] = {}
+        for key in self._metadata_keys:
+            value = row.get(key)
+            if value is None:
+                continue
+            metadata[key] = json.loads(value) if key in self._json_columns else value
+        return Document(page_content=row[_TEXT_COLUMN], metadata=metadata, id=row[_ID_COLUMN])
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Busca por id del docstore (interfaz de LangChain)."""
+        row = self._row_for_id(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.get_by_faiss_id(row)
+
+    def content_hash(self) -> str:
+        """Hash de contenido del docstore (se calcula si el fichero es anterior a guardarlo)."""
+        stored = self._schema_metadata.get("content_sha256")
+        if stored:
+            return stored
+        return documents_content_hash(self.get_by_faiss_id(i) for i in range(len(self)))
+
+    def metadata_column(self, key: str) -> Optional[pa.Array]:
+        """Columna de metadatos completa en orden de id FAISS (sin copia), o None si no existe."""
+        if key not in self._metadata_keys or not self._table.num_rows:
+            return None
+        return self._table.column(key).chunk(0)
+
+
+def load_arrow_docstore(index_folder: str, index_name: str) -> Optional[ArrowDocstore]:
+    """Abre el docstore Arrow del índice si existe."""
+    path = docstore_path(index_folder, index_name)
+    if not os.path.exists(path):
+        return None
+    return ArrowDocstore(path)
+
+
+def convert_pickle_docstore(index_folder: str, index_name: str) -> Tuple[str, int]:
+    """
+    Migra el docstore .pkl de LangChain (InMemoryDocstore + index_to_docstore_id) al
+    formato Arrow. Deserializa el pickle: ejecutar solo sobre índices de confianza.
+    Devuelve (ruta del docstore Arrow, nº de documentos).
+    """
+    pkl_path = os.path.join(index_folder, f"{index_name}.pkl")
+    with open(pkl_path, "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    faiss_ids = sorted(index_to_docstore_id)
+    if faiss_ids != list(range(len(faiss_ids))):
+        raise ValueError("Los ids FAISS del índice no son consecutivos desde 0; no se puede direccionar por fila.")
+    docstore_ids = [index_to_docstore_id[i] for i in faiss_ids]
+    documents = [docstore.search(doc_id) for doc_id in docstore_ids]
+    missing = [doc_id for doc_id, doc in zip(docstore_ids, documents) if not isinstance(doc, Document)]
+    if missing:
+        raise ValueError(f"{len(missing)} ids del índice no existen en el docstore (ej. {missing[0]}).")
+    path = docstore_path(index_folder, index_name)
+    write_arrow_docstore(path, docstore_ids, documents)
+    return path, len(documents)
+
+
+if __name__ == "__main__":
+    # Uso: python -m app.vector_store.docstore [carpeta_indice] [nombre_indice]
+    import sys
+    from app.core.config import settings
+    logging.basicConfig(level=logging.INFO)
+    folder = sys.argv[1] if len(sys.argv) > 1 else settings.FAISS_INDEX_FOLDER
+    name = sys.argv[2] if len(sys.argv) > 2 else settings.FAISS_INDEX_NAME
+    out_path, count = convert_pickle_docstore(folder, name)
+    print(f"Docstore Arrow escrito en {out_path} ({count} documentos).")
@@ -1,15 +1,78 @@
 # app/vector_store/faiss_store.py
 import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+import faiss
+import numpy as np
+import pandas as pd
 from langchain_community.vectorstores import FAISS
 from app.core.config import settings
 from app.core.embeddings import get_embeddings_model # Importa desde tu módulo
-from typing import Optional, List, Tuple, Any
+from app.core.dataframe_loader import get_dataframe, get_dataset_version, lookup_folded_index_positions, normalize_index_key
+from app.vector_store.docstore import ArrowDocstore, docstore_path
+from typing import Optional, List, Tuple, Any, Dict
 from langchain_core.documents import Document # Para type hinting
 
+logger = logging.getLogger(__name__)
+
 _vector_store: Optional[FAISS] = None
 
+# Variantes del índice (ver app/vector_store/index_builder.py). 'flat' es la búsqueda
+# exacta; el resto son aproximadas o cuantizadas y comparten el docstore del índice.
+INDEX_VARIANTS = ("flat", "hnsw", "ivfpq", "sq8")
+
+
+def index_file_path(index_folder: str, index_name: str, variant: str = "flat") -> str:
+    """Ruta del fichero .faiss de una variante: '<nombre>.faiss' (flat) o '<nombre>.<variante>.faiss'."""
+    suffix = "" if variant == "flat" else f".{variant}"
+    return os.path.join(index_folder, f"{index_name}{suffix}.faiss")
+
+
+def build_report_path(index_folder: str, index_name: str, variant: str) -> str:
+    """Ruta del informe de construcción de una variante ('<nombre>.<variante>.build.json')."""
+    return os.path.join(index_folder, f"{index_name}.{variant}.build.json")
+
+
+def _check_docstore_hash(index_folder: str, index_name: str, variant: str, docstore: ArrowDocstore) -> None:
+    """Comprueba que la variante se construyó con los documentos del docstore (si tiene informe)."""
+    report_path = build_report_path(index_folder, index_name, variant)
+    if not os.path.exists(report_path):
+        return
+    with open(report_path, "r", encoding="utf-8") as f:
+        expected = json.load(f).get("docstore_sha256")
+    if expected and expected != docstore.content_hash():
+        raise ValueError(f"La variante '{variant}' se construyó con otros documentos que el docstore {docstore.path}; "
+                         f"reconstrúyela con: python -m app.vector_store.index_builder --variant {variant}")
+
+
+def _apply_search_settings(index: Any) -> None:
+    """Aplica los parámetros de búsqueda configurados (0 = usar los guardados al construir el índice)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None and settings.FAISS_IVF_NPROBE > 0:
+        ivf.nprobe = settings.FAISS_IVF_NPROBE
+    if hasattr(index, "hnsw") and settings.FAISS_HNSW_EF_SEARCH > 0:
+        index.hnsw.efSearch = settings.FAISS_HNSW_EF_SEARCH
+
+
+def _search_parameters(index: Any, selector: Any) -> Any:
+    """Parámetros de búsqueda con 'selector' del tipo que exige cada variante (IVF, HNSW o plano)."""
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    if hasattr(index, "hnsw"):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
+
 def load_faiss_index() -> Optional[FAISS]:
-    """Carga el índice FAISS desde la carpeta configurada (singleton)."""
+    """
+    Carga el índice FAISS desde la carpeta configurada (singleton), en la variante
+    FAISS_INDEX_VARIANT. Los documentos se leen del docstore Arrow con memory-map; el .pkl
+    de LangChain solo se usa (con el índice plano) si no existe y FAISS_ALLOW_PICKLE_DOCSTORE
+    lo permite.
+    """
     global _vector_store
     if _vector_store is not None:
         # print("Índice FAISS ya está cargado.") # Opcional: Evitar logs repetidos
@@ -17,14 +80,27 @@ def load_faiss_index() -> Optional[FAISS]:
 
     index_folder = settings.FAISS_INDEX_FOLDER
     index_name = settings.FAISS_INDEX_NAME
-    faiss_file_path = os.path.join(index_folder, f"{index_name}.faiss")
+    variant = settings.FAISS_INDEX_VARIANT
+    faiss_file_path = index_file_path(index_folder, index_name, variant)
     pkl_file_path = os.path.join(index_folder, f"{index_name}.pkl")
+    arrow_docstore_path = docstore_path(index_folder, index_name)
 
-    print(f"Intentando cargar índice FAISS desde: {index_folder}/{index_name}")
+    print(f"Intentando cargar índice FAISS ({variant}) desde: {index_folder}/{index_name}")
 
-    if not os.path.exists(faiss_file_path) or not os.path.exists(pkl_file_path):
+    has_arrow_docstore = os.path.exists(arrow_docstore_path)
+    if variant != "flat" and not (os.path.exists(faiss_file_path) and has_arrow_docstore):
+        logger.warning(f"No existe la variante '{variant}' del índice ({faiss_file_path}) o su docstore Arrow; se usa el índice plano. "
+                       f"Constrúyela con: python -m app.vector_store.index_builder --variant {variant}")
+        variant = "flat"
+        faiss_file_path = index_file_path(index_folder, index_name, variant)
+    if not os.path.exists(faiss_file_path) or not (has_arrow_docstore or os.path.exists(pkl_file_path)):
         print(f"--- ERROR ---")
-        print(f"No se encontraron los archivos del índice FAISS: {faiss_file_path}, {pkl_file_path}")
+        print(f"No se encontraron los archivos del índice FAISS: {faiss_file_path}, {arrow_docstore_path} / {pkl_file_path}")
+        return None
+    if not has_arrow_docstore and not settings.FAISS_ALLOW_PICKLE_DOCSTORE:
+        print(f"--- ERROR ---")
+        print(f"No existe el docstore Arrow {arrow_docstore_path} y la carga del .pkl está deshabilitada "
+              f"(FAISS_ALLOW_PICKLE_DOCSTORE). Conviértelo con: python -m app.vector_store.docstore {index_folder} {index_name}")
         return None
 
     try:
@@ -32,13 +108,28 @@ def load_faiss_index() -> Optional[FAISS]:
         if not embeddings:
             raise ValueError("Modelo de embeddings no disponible para cargar FAISS.")
 
-        print("Cargando índice local FAISS...")
-        loaded_db = FAISS.load_local(
-            folder_path=index_folder,
-            embeddings=embeddings,
-            index_name=index_name,
-            allow_dangerous_deserialization=True # ¡Necesario para PKL!
-        )
+        if has_arrow_docstore:
+            print("Cargando índice local FAISS (docstore Arrow con memory-map)...")
+            docstore = ArrowDocstore(arrow_docstore_path)
+            index = faiss.read_index(faiss_file_path)
+            if index.ntotal != len(docstore):
+                raise ValueError(f"El índice tiene {index.ntotal} vectores pero el docstore {len(docstore)} documentos.")
+            _check_docstore_hash(index_folder, index_name, variant, docstore)
+            _apply_search_settings(index)
+            loaded_db = FAISS(
+                embedding_function=embeddings,
+                index=index,
+                docstore=docstore,
+                index_to_docstore_id=docstore.index_to_docstore_id,
+            )
+        else:
+            print("Cargando índice local FAISS (docstore .pkl)...")
+            loaded_db = FAISS.load_local(
+                folder_path=index_folder,
+                embeddings=embeddings,
+                index_name=index_name,
+                allow_dangerous_deserialization=True # ¡Necesario para PKL!
+            )
         print("¡Índice FAISS cargado exitosamente!")
         _vector_store = loaded_db
         return _vector_store
@@ -57,8 +148,9 @@ def get_faiss_db() -> Optional[FAISS]:
 # Función de búsqueda mejorada que usará el retriever agent
 def search_documents(query: str, k: int = 20, filter_criteria: Optional[dict] = None) -> List[Document]:
     """
-    Realiza búsqueda por similitud y aplica filtrado post-recuperación.
-    Devuelve solo los documentos.
+    Realiza búsqueda por similitud. Con 'filter_criteria' el filtro se aplica dentro
+    del recorrido del índice (pre-filtrado), de modo que se devuelven los 'k' documentos
+    más cercanos que lo cumplen. Devuelve solo los documentos.
     """
     vector_store = get_faiss_db()
     if not vector_store:
@@ -67,28 +159,261 @@ def search_documents(query: str, k: int = 20, filter_criteria: Optional[dict] =
 
     try:
         print(f"Buscando k={k} documentos para query: '{query[:50]}...'") # Log corto
-        results_with_scores: List[Tuple[Document, float]] = vector_store.similarity_search_with_score(query, k=k)
-
         if not filter_criteria:
+            results_with_scores: List[Tuple[Document, float]] = vector_store.similarity_search_with_score(query, k=k)
             print(f"Devolviendo {len(results_with_scores)} resultados sin filtro.")
             return [doc for doc, score in results_with_scores]
 
-        # Filtrado Post-recuperación
-        print(f"Aplicando filtro: {filter_criteria}")
-        filtered_docs = []
-        for doc, score in results_with_scores:
-            metadata = doc.metadata
-            match = True
-            for key, value in filter_criteria.items():
-                if key not in metadata or str(metadata.get(key)).lower() != str(value).lower(): # Comparación insensible a mayúsculas
-                    match = False
-                    break
-            if match:
-                filtered_docs.append(doc)
-
-        print(f"Devolviendo {len(filtered_docs)} resultados después del filtro.")
-        return filtered_docs
+        print(f"Aplicando filtro (pre-filtrado en el índice): {filter_criteria}")
+        embedding = np.asarray(vector_store._embed_query(query), dtype=np.float32)
+        results_with_scores = search_by_vector_prefiltered(embedding, k, filter_row_positions(filter_criteria))
+        print(f"Devolviendo {len(results_with_scores)} resultados que cumplen el filtro.")
+        return [doc for doc, score in results_with_scores]
 
     except Exception as e:
         print(f"Error durante la búsqueda de documentos: {e}")
-        return []
\ No newline at end of file
+        return []
+
+
+# --- Pre-filtrado por metadatos dentro del índice FAISS ---
+# Los filtros se resuelven sobre el DataFrame (índices secundarios de dataframe_loader o
+# comparación vectorizada) y se traducen a un bitmap de ids FAISS que se pasa a la
+# búsqueda (IDSelectorBitmap): el índice solo puntúa los vectores permitidos y devuelve
+# el top-k correcto bajo el filtro, en lugar de recuperar k y descartar los que no cumplen.
+_faiss_ids_by_row: Optional[np.ndarray] = None # posición de fila en el DataFrame -> id FAISS (-1 si no está indexada)
+_rows_by_faiss_id: Optional[np.ndarray] = None # id FAISS -> posición de fila (-1 si su fila no está en el DataFrame)
+_faiss_ids_key: Optional[Tuple[int, Optional[str]]] = None
+_filter_bitmaps: "OrderedDict[Tuple, Tuple[np.ndarray, int]]" = OrderedDict() # filas permitidas -> (bitmap de ids FAISS, nº de ids)
+_prefilter_lock = threading.Lock()
+
+
+def _get_id_mappings(vector_store: FAISS) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Correspondencias posición de fila -> id FAISS y id FAISS -> posición de fila,
+    construidas una vez por índice y versión del dataset.
+    """
+    global _faiss_ids_by_row, _rows_by_faiss_id, _faiss_ids_key
+    key = (id(vector_store), get_dataset_version())
+    with _prefilter_lock:
+        if _faiss_ids_by_row is not None and _faiss_ids_key == key:
+            return _faiss_ids_by_row, _rows_by_faiss_id
+    df = get_dataframe()
+    faiss_ids, labels = [], []
+    row_id_column = vector_store.docstore.metadata_column(ROW_ID_METADATA_KEY) if isinstance(vector_store.docstore, ArrowDocstore) else None
+    if row_id_column is not None:
+        # Docstore Arrow: la columna completa sin materializar los documentos
+        items = enumerate(row_id_column.to_pylist())
+    else:
+        items = ((faiss_id, getattr(vector_store.docstore.search(docstore_id), "metadata", {}).get(ROW_ID_METADATA_KEY))
+                 for faiss_id, docstore_id in vector_store.index_to_docstore_id.items())
+    for faiss_id, row_id in items:
+        try:
+            labels.append(int(row_id))
+        except (TypeError, ValueError):
+            continue
+        faiss_ids.append(faiss_id)
+    positions = df.index.get_indexer(labels) if labels else np.array([], dtype=np.int64)
+    mapping = np.full(len(df), -1, dtype=np.int64)
+    valid = positions >= 0
+    mapping[positions[valid]] = np.asarray(faiss_ids, dtype=np.int64)[valid]
+    inverse = np.full(vector_store.index.ntotal, -1, dtype=np.int64)
+    indexed_rows = np.flatnonzero(mapping >= 0)
+    inverse[mapping[indexed_rows]] = indexed_rows
+    with _prefilter_lock:
+        _faiss_ids_by_row, _rows_by_faiss_id, _faiss_ids_key = mapping, inverse, key
+        _filter_bitmaps.clear()
+    logger.info(f"Correspondencia filas <-> ids FAISS construida: {int(valid.sum())} de {len(df)} filas indexadas.")
+    return mapping, inverse
+
+
+def _get_faiss_ids_by_row(vector_store: FAISS) -> np.ndarray:
+    """Correspondencia posición de fila -> id FAISS (-1 si la fila no está indexada)."""
+    return _get_id_mappings(vector_store)[0]
+
+
+def search_positions_batch(queries: List[str], k: int, max_distance: Optional[float] = None) -> List[List[int]]:
+    """
+    Posiciones de fila del DataFrame de los 'k' documentos más cercanos a cada consulta,
+    por relevancia. Las consultas se codifican y se buscan en un solo lote. Como en
+    search_row_ids, se descartan los resultados a más de 'max_distance' (0 = sin umbral).
+    """
+    max_distance = settings.RETRIEVAL_MAX_DISTANCE if max_distance is None else max_distance
+    vector_store = get_faiss_db()
+    if not vector_store or not queries:
+        return [[] for _ in queries]
+    # El modelo es simétrico (embed_query == embed_documents([q])[0]): se codifica en lote
+    vectors = np.asarray(vector_store._embed_documents(list(queries)), dtype=np.float32)
+    if vector_store._normalize_L2:
+        faiss.normalize_L2(vectors)
+    distances, ids = vector_store.index.search(vectors, min(k, vector_store.index.ntotal))
+    rows_by_faiss_id = _get_id_mappings(vector_store)[1]
+    results: List[List[int]] = []
+    for query_distances, query_ids in zip(distances, ids):
+        keep = query_ids >= 0
+        if max_distance:
+            keep &= query_distances <= max_distance
+        rows = rows_by_faiss_id[query_ids[keep]]
+        results.append(rows[rows >= 0].tolist())
+    return results
+
+
+def _column_matches(column: pd.Series, value: Any) -> np.ndarray:
+    """Máscara de igualdad con el valor de un filtro de metadatos (sin mayúsculas ni acentos en texto)."""
+    if pd.api.types.is_datetime64_any_dtype(column.dtype):
+        return (column == pd.to_datetime(value, errors="coerce")).fillna(False).to_numpy(dtype=bool)
+    if pd.api.types.is_numeric_dtype(column.dtype):
+        return (column == pd.to_numeric(value, errors="coerce")).fillna(False).to_numpy(dtype=bool)
+    keys = column.map(normalize_index_key, na_action="ignore")
+    return (keys == normalize_index_key(value)).fillna(False).to_numpy(dtype=bool)
+
+
+def filter_row_positions(filter_criteria: Dict[str, Any]) -> Optional[np.ndarray]:
+    """
+    Posiciones (ordenadas) de las filas del DataFrame que cumplen todos los pares
+    columna == valor de 'filter_criteria' (texto sin mayúsculas ni acentos, como en
+    _column_matches). Una columna inexistente no coincide con ninguna fila.
+    """
+    df = get_dataframe()
+    if df is None or not filter_criteria:
+        return None
+    positions: Optional[np.ndarray] = None
+    for column, value in filter_criteria.items():
+        if column not in df.columns:
+            return np.array([], dtype=np.int64)
+        rows = lookup_folded_index_positions(df, column, value)
+        if rows is None:
+            rows = np.flatnonzero(_column_matches(df[column], value))
+        positions = rows if positions is None else np.intersect1d(positions, rows, assume_unique=True)
+        if positions.size == 0:
+            break
+    return positions
+
+
+def _bitmap_for_positions(vector_store: FAISS, row_positions: np.ndarray) -> Tuple[np.ndarray, int]:
+    """Bitmap (orden de bits little-endian, como IDSelectorBitmap) de los ids FAISS permitidos y su número."""
+    faiss_ids = _get_faiss_ids_by_row(vector_store)[row_positions]
+    faiss_ids = faiss_ids[faiss_ids >= 0]
+    allowed = np.zeros(vector_store.index.ntotal, dtype=bool)
+    allowed[faiss_ids] = True
+    return np.packbits(allowed, bitorder="little"), int(faiss_ids.size)
+
+
+def _document_for_faiss_id(vector_store: FAISS, faiss_id: int) -> Any:
+    """Documento del id FAISS; con el docstore Arrow se lee directamente por fila."""
+    if isinstance(vector_store.docstore, ArrowDocstore):
+        return vector_store.docstore.get_by_faiss_id(faiss_id)
+    return vector_store.docstore.search(vector_store.index_to_docstore_id[faiss_id])
+
+
+def search_by_vector_prefiltered(embedding: np.ndarray, k: int, row_positions: Optional[np.ndarray]) -> List[Tuple[Document, float]]:
+    """
+    Los 'k' documentos más cercanos a 'embedding' entre las filas 'row_positions' (todas si
+    es None), con su distancia. El filtro se aplica dentro del recorrido del índice.
+    """
+    vector_store = get_faiss_db()
+    if not vector_store:
+        return []
+    vector = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+    if vector_store._normalize_L2:
+        faiss.normalize_L2(vector)
+
+    params = None
+    if row_positions is not None:
+        row_positions = np.asarray(row_positions, dtype=np.int64)
+        cache_key = (id(vector_store), row_positions.tobytes())
+        with _prefilter_lock:
+            cached = _filter_bitmaps.get(cache_key)
+            if cached is not None:
+                _filter_bitmaps.move_to_end(cache_key)
+        if cached is None:
+            cached = _bitmap_for_positions(vector_store, row_positions)
+            with _prefilter_lock:
+                _filter_bitmaps[cache_key] = cached
+                while len(_filter_bitmaps) > settings.FAISS_FILTER_CACHE_SIZE:
+                    _filter_bitmaps.popitem(last=False)
+        bitmap, allowed_count = cached
+        if allowed_count == 0:
+            return []
+        k = min(k, allowed_count)
+        params = _search_parameters(vector_store.index, faiss.IDSelectorBitmap(vector_store.index.ntotal, faiss.swig_ptr(bitmap)))
+
+    distances, ids = vector_store.index.search(vector, k, params=params)
+    results: List[Tuple[Document, float]] = []
+    for faiss_id, distance in zip(ids[0], distances[0]):
+        if faiss_id < 0:
+            continue
+        doc = _document_for_faiss_id(vector_store, int(faiss_id))
+        if isinstance(doc, Document):
+            results.append((doc, float(distance)))
+    with _retrieval_stats_lock:
+        _retrieval_stats["prefiltered_searches"] += 1 if row_positions is not None else 0
+    return results
+
+
+# --- Recuperación de filas del DataFrame (nodo 'retriever' del grafo) ---
+# Cada documento del índice es una fila del CSV; 'source_row_index' en sus metadatos
+# es la etiqueta de esa fila en el DataFrame. La búsqueda vectorial sobre 'parsed_text'
+# tolera el ruido del OCR ("Philadel phia", "borg ing.") que rompe las búsquedas exactas.
+ROW_ID_METADATA_KEY = "source_row_index"
+
+_retrieval_stats_lock = threading.Lock()
+_retrieval_stats: Dict[str, Any] = {"searches": 0, "empty": 0, "rows_returned": 0, "total_seconds": 0.0, "prefiltered_searches": 0}
+
+
+def search_row_ids(query: str, k: Optional[int] = None, max_distance: Optional[float] = None) -> List[int]:
+    """
+    Búsqueda vectorial de 'query' que devuelve las etiquetas de fila del DataFrame de los
+    'k' documentos más cercanos (por relevancia, sin duplicados). Los resultados con una
+    distancia L2 mayor que 'max_distance' se descartan (0 o None = sin umbral).
+    """
+    k = k or settings.RETRIEVAL_TOP_K
+    max_distance = settings.RETRIEVAL_MAX_DISTANCE if max_distance is None else max_distance
+    vector_store = get_faiss_db()
+    if not vector_store or not query or not query.strip():
+        return []
+
+    start = time.perf_counter()
+    try:
+        results_with_scores: List[Tuple[Document, float]] = vector_store.similarity_search_with_score(query, k=k)
+    except Exception as e:
+        logger.error(f"Error durante la búsqueda vectorial de filas: {e}")
+        return []
+    row_ids: List[int] = []
+    seen = set()
+    for doc, score in results_with_scores:
+        if max_distance and score > max_distance:
+            continue
+        try:
+            row_id = int(doc.metadata.get(ROW_ID_METADATA_KEY))
+        except (TypeError, ValueError):
+            continue
+        if row_id not in seen:
+            seen.add(row_id)
+            row_ids.append(row_id)
+    elapsed = time.perf_counter() - start
+
+    with _retrieval_stats_lock:
+        _retrieval_stats["searches"] += 1
+        _retrieval_stats["empty"] += 0 if row_ids else 1
+        _retrieval_stats["rows_returned"] += len(row_ids)
+        _retrieval_stats["total_seconds"] += elapsed
+    logger.info(f"Recuperación vectorial: {len(row_ids)} filas para '{query[:60]}' en {elapsed * 1000:.1f} ms.")
+    return row_ids
+
+
+def get_retrieval_stats() -> Dict[str, Any]:
+    """Búsquedas realizadas, búsquedas sin resultados, filas medias devueltas y latencia media (ms)."""
+    with _retrieval_stats_lock:
+        stats: Dict[str, Any] = dict(_retrieval_stats)
+    searches = stats.pop("searches")
+    total_seconds = stats.pop("total_seconds")
+    return {
+        "enabled": settings.RETRIEVAL_ENABLED,
+        "index_loaded": _vector_store is not None,
+        "searches": searches,
+        "empty": stats["empty"],
+        "avg_rows": round(stats["rows_returned"] / searches, 2) if searches else 0.0,
+        "avg_latency_ms": round(total_seconds / searches * 1000, 2) if searches else None,
+        "prefiltered_searches": stats["prefiltered_searches"],
+        "cached_filter_bitmaps": len(_filter_bitmaps),
+    }
@@ -0,0 +1,284 @@
+# app/vector_store/hybrid_retriever.py
+import time
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Optional, Dict, List, Any, Iterable
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from app.core.config import settings
+from app.core.dataframe_loader import get_dataframe, get_dataset_version
+from app.core.text_index import TEXT_INDEX_COLUMNS, tokenize
+from app.vector_store import faiss_store
+
+logger = logging.getLogger(__name__)
+
+# Búsqueda híbrida: una rama léxica (BM25 sobre parsed_text y cargo_list, con el mismo
+# tokenizador que el índice invertido) y una rama densa (FAISS) se ejecutan en paralelo
+# y sus rankings se fusionan por rangos recíprocos (RRF). BM25 encuentra coincidencias
+# exactas de términos raros (nombres, mercancías); FAISS tolera el ruido del OCR.
+# Si una rama supera el presupuesto de latencia se descarta y se usa solo la otra.
+# Cada rama tiene sus propios hilos y un máximo de ejecuciones en curso: una rama
+# descartada sigue ocupando su hilo hasta terminar, así que si todas están ocupadas la
+# rama se omite en esa búsqueda en lugar de encolarse detrás de ellas (y agotar el
+# presupuesto de las búsquedas siguientes).
+# Cada rama solo aporta filas con evidencia mínima (BM25 >= HYBRID_MIN_BM25_SCORE,
+# distancia FAISS <= RETRIEVAL_MAX_DISTANCE): si ninguna la tiene, el resultado es vacío.
+
+
+# --- Rama léxica: BM25 ---
+class BM25Index:
+    """Pesos BM25 precalculados en una matriz dispersa filas x términos (posiciones 0..n-1 del DataFrame)."""
+
+    def __init__(self, weights: sparse.csr_matrix, vocabulary: Dict[str, int], dataset_version: Optional[str]):
+        self.weights = weights
+        self.vocabulary = vocabulary
+        self.num_rows = weights.shape[0]
+        self.dataset_version = dataset_version
+        self._weights_t = weights.T.tocsr() # términos x filas: producto consulta x índice
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, columns: Iterable[str] = TEXT_INDEX_COLUMNS, k1: float = 1.5, b: float = 0.75,
+              dataset_version: Optional[str] = None) -> "BM25Index":
+        columns = [col for col in columns if col in df.columns]
+        vocabulary: Dict[str, int] = {}
+        rows, cols, tfs = [], [], []
+        doc_lengths = np.zeros(len(df), dtype=np.float64)
+        # Documento = concatenación de las columnas indexadas de la fila
+        texts = df[columns].astype(object).where(df[columns].notna(), "").agg(" ".join, axis=1).tolist() if columns else []
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths[row] = sum(counts.values())
+            for term, tf in counts.items():
+                rows.append(row)
+                cols.append(vocabulary.setdefault(term, len(vocabulary)))
+                tfs.append(tf)
+        rows_arr = np.asarray(rows, dtype=np.int64)
+        cols_arr = np.asarray(cols, dtype=np.int64)
+        tf_arr = np.asarray(tfs, dtype=np.float64)
+
+        num_docs = max(len(df), 1)
+        doc_freq = np.bincount(cols_arr, minlength=len(vocabulary)).astype(np.float64)
+        idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        avg_length = doc_lengths.mean() if len(df) and doc_lengths.mean() > 0 else 1.0
+        norm = k1 * (1 - b + b * doc_lengths[rows_arr] / avg_length)
+        values = idf[cols_arr] * tf_arr * (k1 + 1) / (tf_arr + norm)
+        weights = sparse.csr_matrix((values, (rows_arr, cols_arr)), shape=(len(df), len(vocabulary)), dtype=np.float32)
+        return cls(weights, vocabulary, dataset_version)
+
+    def search_batch(self, queries: List[str], k: int, min_score: float = 0.0) -> List[List[int]]:
+        """Posiciones de fila de los 'k' documentos con mayor puntuación BM25 (> 0 y >= 'min_score') para cada consulta."""
+        query_rows, query_cols, query_counts = [], [], []
+        for i, query in enumerate(queries):
+            for term, count in Counter(tokenize(query or "")).items():
+                term_id = self.vocabulary.get(term)
+                if term_id is not None:
+                    query_rows.append(i)
+                    query_cols.append(term_id)
+                    query_counts.append(count)
+        query_matrix = sparse.csr_matrix(
+            (np.asarray(query_counts, dtype=np.float32), (query_rows, query_cols)),
+            shape=(len(queries), len(self.vocabulary)),
+        )
+        scores = (query_matrix @ self._weights_t).toarray()
+        results: List[List[int]] = []
+        for row_scores in scores:
+            candidates = np.flatnonzero((row_scores > 0) & (row_scores >= min_score))
+            if candidates.size > k:
+                candidates = candidates[np.argpartition(-row_scores[candidates], k - 1)[:k]]
+            # Orden por puntuación descendente; empates por posición de fila
+            results.append(candidates[np.lexsort((candidates, -row_scores[candidates]))].tolist())
+        return results
+
+
+_bm25_instance: Optional[BM25Index] = None
+_bm25_lock = threading.Lock()
+
+
+def get_bm25_index() -> Optional[BM25Index]:
+    """Devuelve el índice BM25 del DataFrame cargado (singleton), reconstruido si cambia el dataset."""
+    global _bm25_instance
+    version = get_dataset_version()
+    if _bm25_instance is not None and _bm25_instance.dataset_version == version:
+        return _bm25_instance
+    with _bm25_lock:
+        if _bm25_instance is not None and _bm25_instance.dataset_version == version:
+            return _bm25_instance
+        df = get_dataframe()
+        if df is None:
+            return None
+        start = time.perf_counter()
+        _bm25_instance = BM25Index.build(df, k1=settings.BM25_K1, b=settings.BM25_B, dataset_version=version)
+        logger.info(f"Índice BM25 construido: {_bm25_instance.num_rows} filas, {len(_bm25_instance.vocabulary)} términos "
+                    f"en {(time.perf_counter() - start) * 1000:.0f} ms.")
+        return _bm25_instance
+
+
+def _lexical_leg(queries: List[str], k: int) -> List[List[int]]:
+    index = get_bm25_index()
+    return index.search_batch(queries, k, settings.HYBRID_MIN_BM25_SCORE) if index is not None else [[] for _ in queries]
+
+
+def _dense_leg(queries: List[str], k: int) -> List[List[int]]:
+    return faiss_store.search_positions_batch(queries, k)
+
+
+# --- Fusión por rangos recíprocos ---
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int, rrf_k: int = 60) -> List[int]:
+    """
+    Fusiona rankings de posiciones de fila: puntuación = suma de 1 / (rrf_k + rango), rango
+    desde 1. Solo se fusionan las filas que alguna rama aportó (con su evidencia mínima).
+    """
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=lambda row: (-scores[row], row))[:k]
+
+
+# --- Ejecución concurrente con presupuesto de latencia ---
+_LEGS = {"lexical": _lexical_leg, "dense": _dense_leg}
+_leg_executors: Dict[str, ThreadPoolExecutor] = {}
+_in_flight: Dict[str, int] = {name: 0 for name in _LEGS}
+_executor_lock = threading.Lock()
+_stats_lock = threading.Lock()
+_stats: Dict[str, int] = {"searches": 0, "queries": 0, "empty": 0, "lexical_dropped": 0, "dense_dropped": 0,
+                          "lexical_busy": 0, "dense_busy": 0, "lexical_errors": 0, "dense_errors": 0}
+_leg_durations: Dict[str, deque] = {name: deque(maxlen=500) for name in _LEGS}
+
+
+def _release_leg(name: str) -> None:
+    with _executor_lock:
+        _in_flight[name] -= 1
+
+
+def _submit_leg(name: str, queries: List[str], k: int) -> Optional[Future]:
+    """
+    Lanza una rama en sus propios hilos (el recuperador ya se ejecuta dentro del executor
+    compartido). Devuelve None si la rama ya tiene HYBRID_MAX_IN_FLIGHT_PER_LEG ejecuciones
+    en curso: así nunca espera en cola y el presupuesto solo cuenta su ejecución.
+    """
+    limit = max(1, settings.HYBRID_MAX_IN_FLIGHT_PER_LEG)
+    with _executor_lock:
+        if _in_flight[name] >= limit:
+            return None
+        executor = _leg_executors.get(name)
+        if executor is None:
+            executor = _leg_executors[name] = ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"hybrid-{name}")
+        _in_flight[name] += 1
+    try:
+        future = executor.submit(_timed_leg, name, queries, k)
+    except RuntimeError:
+        _release_leg(name) # Executor cerrado durante el apagado
+        return None
+    future.add_done_callback(lambda _: _release_leg(name))
+    return future
+
+
+def _timed_leg(name: str, queries: List[str], k: int) -> List[List[int]]:
+    start = time.perf_counter()
+    result = _LEGS[name](queries, k)
+    with _stats_lock:
+        _leg_durations[name].append(time.perf_counter() - start)
+    return result
+
+
+def hybrid_search_batch(queries: List[str], k: Optional[int] = None, budget_ms: Optional[int] = None) -> List[List[int]]:
+    """
+    Búsqueda híbrida de un lote de consultas. Devuelve, para cada una, las etiquetas de fila
+    del DataFrame de los 'k' mejores resultados de la fusión RRF de BM25 y FAISS (lista vacía
+    si ninguna rama encuentra filas con evidencia suficiente). Si una rama
+    no termina dentro de 'budget_ms', se descarta (si ninguna termina, se espera a la primera).
+    """
+    k = k or settings.RETRIEVAL_TOP_K
+    budget_ms = settings.HYBRID_LATENCY_BUDGET_MS if budget_ms is None else budget_ms
+    queries = [query or "" for query in queries]
+    if not queries:
+        return []
+    df = get_dataframe()
+    if df is None:
+        return [[] for _ in queries]
+
+    candidates = max(k, settings.HYBRID_CANDIDATES_PER_LEG)
+    futures: Dict[Future, str] = {}
+    busy: List[str] = []
+    for name in _LEGS:
+        future = _submit_leg(name, queries, candidates)
+        if future is None:
+            busy.append(name)
+        else:
+            futures[future] = name
+    rankings_by_leg: Dict[str, List[List[int]]] = {}
+    done, pending = set(), set()
+    if futures:
+        done, pending = wait(futures, timeout=budget_ms / 1000 if budget_ms > 0 else None)
+        if not done:
+            done, pending = wait(futures, return_when=FIRST_COMPLETED)
+    else:
+        # Todas las ramas ocupadas por búsquedas anteriores: BM25 se ejecuta en este hilo
+        rankings_by_leg["lexical"] = _timed_leg("lexical", queries, candidates)
+
+    with _stats_lock:
+        _stats["searches"] += 1
+        _stats["queries"] += len(queries)
+        for name in busy:
+            _stats[f"{name}_busy"] += 1
+        for future in pending:
+            # La rama sigue en su hilo hasta terminar, pero su resultado ya no se espera
+            _stats[f"{futures[future]}_dropped"] += 1
+    for name in busy:
+        logger.warning(f"Búsqueda híbrida: la rama '{name}' tiene todas sus ejecuciones ocupadas y se omite.")
+    for future in pending:
+        logger.warning(f"Búsqueda híbrida: la rama '{futures[future]}' superó el presupuesto de {budget_ms} ms y se descarta.")
+    for future in done:
+        name = futures[future]
+        try:
+            rankings_by_leg[name] = future.result()
+        except Exception as e:
+            logger.error(f"Búsqueda híbrida: error en la rama '{name}': {e}")
+            with _stats_lock:
+                _stats[f"{name}_errors"] += 1
+
+    results: List[List[int]] = []
+    for i in range(len(queries)):
+        fused = reciprocal_rank_fusion([rankings[i] for rankings in rankings_by_leg.values()], k, settings.HYBRID_RRF_K)
+        results.append(df.index[fused].tolist() if fused else [])
+    empty = sum(1 for rows in results if not rows)
+    if empty:
+        with _stats_lock:
+            _stats["empty"] += empty
+    return results
+
+
+def search_row_ids(query: str, k: Optional[int] = None) -> List[int]:
+    """Etiquetas de fila de los 'k' mejores resultados de la búsqueda híbrida para una consulta."""
+    if not query or not query.strip():
+        return []
+    return hybrid_search_batch([query], k)[0]
+
+
+def shutdown_hybrid_retriever() -> None:
+    """Libera los hilos de las ramas (sin esperar a las que se descartaron por presupuesto)."""
+    with _executor_lock:
+        executors = list(_leg_executors.values())
+        _leg_executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def get_hybrid_retrieval_stats() -> Dict[str, Any]:
+    """Búsquedas, consultas sin resultados, ramas descartadas (presupuesto), omitidas (ocupadas) o con error, ejecuciones en curso y latencia media/p95 (ms) de cada rama."""
+    with _stats_lock:
+        stats: Dict[str, Any] = dict(_stats)
+    with _executor_lock:
+        stats.update({f"{name}_in_flight": count for name, count in _in_flight.items()})
+        durations = {name: sorted(values) for name, values in _leg_durations.items()}
+    stats["enabled"] = settings.RETRIEVAL_HYBRID_ENABLED
+    stats["budget_ms"] = settings.HYBRID_LATENCY_BUDGET_MS
+    stats["bm25_terms"] = len(_bm25_instance.vocabulary) if _bm25_instance is not None else None
+    for name, values in durations.items():
+        stats[f"{name}_avg_ms"] = round(sum(values) / len(values) * 1000, 2) if values else None
+        stats[f"{name}_p95_ms"] = round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 2) if values else None
+    return stats
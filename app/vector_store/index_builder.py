@@ -0,0 +1,277 @@
+# app/vector_store/index_builder.py
+# Construcción reproducible del índice FAISS desde el CSV, en cualquiera de sus variantes:
+#   flat   búsqueda exacta (IndexFlatL2), referencia de recall
+#   hnsw   grafo HNSW sobre vectores float32 (más memoria, búsqueda sublineal)
+#   ivfpq  listas invertidas + product quantization (memoria mínima, recall menor)
+#   sq8    cuantización escalar de 8 bits (~4x menos memoria que flat, recall casi exacto)
+# Cada documento es una fila del CSV (page_content = parsed_text; metadatos = resto de
+# columnas no nulas + 'source_row_index'), igual que el índice original. Además del
+# .faiss y del docstore Arrow, se escribe '<nombre>.<variante>.build.json' con los
+# parámetros de construcción, el hash del docstore y un informe de recall@k / latencia /
+# tamaño frente a flat. El docstore es común a todas las variantes: si ya existe con otro
+# contenido (otro CSV), la construcción se rechaza salvo con --overwrite-docstore.
+# En las variantes aproximadas se elige el efSearch / nprobe más bajo que alcanza el
+# objetivo de recall y queda guardado en el índice.
+#
+# Uso:
+#   python -m app.vector_store.index_builder --variant sq8
+#   python -m app.vector_store.index_builder --variant hnsw --recall-target 0.98
+#   python -m app.vector_store.index_builder --variant ivfpq --vectors-from vector_store_index/data_index.faiss
+import os
+import json
+import time
+import logging
+import argparse
+from typing import Optional, Dict, List, Any, Tuple
+import faiss
+import numpy as np
+import pandas as pd
+from langchain_core.documents import Document
+from app.core.config import settings
+from app.vector_store.docstore import write_arrow_docstore, docstore_path, documents_content_hash, load_arrow_docstore
+from app.vector_store.faiss_store import INDEX_VARIANTS, ROW_ID_METADATA_KEY, index_file_path, build_report_path
+
+logger = logging.getLogger(__name__)
+
+TEXT_COLUMN = "parsed_text"
+HNSW_EF_CANDIDATES = [16, 24, 32, 48, 64, 96, 128, 192, 256, 512]
+IVF_NPROBE_CANDIDATES = [1, 2, 4, 6, 8, 12, 16, 24, 32, 48, 64, 128]
+
+
+# --- Documentos y vectores ---
+def load_documents(csv_path: str) -> List[Document]:
+    """Un documento por fila del CSV, con el mismo contenido y metadatos que el índice original."""
+    raw = pd.read_csv(csv_path, dtype=str)
+    documents: List[Document] = []
+    metadata_columns = [col for col in raw.columns if col != TEXT_COLUMN]
+    for row_index, row in enumerate(raw.itertuples(index=False)):
+        values = row._asdict()
+        metadata = {col: values[col] for col in metadata_columns if pd.notna(values[col])}
+        metadata[ROW_ID_METADATA_KEY] = str(row_index)
+        text = values.get(TEXT_COLUMN)
+        documents.append(Document(page_content=text if isinstance(text, str) else "", metadata=metadata))
+    return documents
+
+
+def embed_documents(documents: List[Document], batch_size: int = 256) -> np.ndarray:
+    """Embeddings (normalizados según el modelo configurado) de page_content, por lotes."""
+    from app.core.embeddings import get_embeddings_model
+    model = get_embeddings_model()
+    if model is None:
+        raise RuntimeError("Modelo de embeddings no disponible; usa --vectors-from para reutilizar los vectores de un índice plano.")
+    texts = [doc.page_content for doc in documents]
+    batches = [model.embed_documents(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+    return np.asarray([vector for batch in batches for vector in batch], dtype=np.float32)
+
+
+def vectors_from_index(path: str, expected: int) -> np.ndarray:
+    """Reutiliza los vectores de un índice existente (exactos solo si es plano)."""
+    index = faiss.read_index(path)
+    if index.ntotal != expected:
+        raise ValueError(f"El índice {path} tiene {index.ntotal} vectores y el CSV {expected} filas.")
+    if not isinstance(index, faiss.IndexFlat):
+        logger.warning(f"{path} no es un índice plano: los vectores reconstruidos son aproximados.")
+    return index.reconstruct_n(0, index.ntotal)
+
+
+# --- Variantes ---
+def default_params(variant: str, num_vectors: int, dim: int) -> Dict[str, Any]:
+    """Parámetros por defecto de cada variante, ajustados al tamaño del corpus."""
+    if variant == "hnsw":
+        return {"M": 32, "ef_construction": 200}
+    if variant == "ivfpq":
+        # Al menos ~39 vectores de entrenamiento por centroide (recomendación de FAISS)
+        nlist = max(1, min(int(4 * np.sqrt(num_vectors)), num_vectors // 39))
+        nbits = 8 if num_vectors >= 39 * 256 else max(4, int(np.log2(max(num_vectors // 39, 16))))
+        m = next(m for m in (48, 32, 24, 16, 12, 8, 6, 4, 3, 2, 1) if dim % m == 0)
+        return {"nlist": nlist, "m": m, "nbits": nbits}
+    return {}
+
+
+def build_index(variant: str, vectors: np.ndarray, params: Dict[str, Any]) -> Any:
+    """Construye (y entrena si hace falta) el índice de la variante con todos los vectores."""
+    dim = vectors.shape[1]
+    if variant == "flat":
+        index = faiss.IndexFlatL2(dim)
+    elif variant == "hnsw":
+        index = faiss.IndexHNSWFlat(dim, params["M"])
+        index.hnsw.efConstruction = params["ef_construction"]
+    elif variant == "ivfpq":
+        index = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, params["nlist"], params["m"], params["nbits"])
+    elif variant == "sq8":
+        index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    else:
+        raise ValueError(f"Variante desconocida '{variant}'. Opciones: {', '.join(INDEX_VARIANTS)}")
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+# --- Informe frente a la búsqueda exacta ---
+def _recall_and_latency(index: Any, queries: np.ndarray, truth: np.ndarray, k: int) -> Tuple[float, float, float]:
+    latencies = []
+    found = np.empty_like(truth)
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+        found[i] = ids[0]
+    recall = float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+    latencies_ms = np.asarray(latencies) * 1000
+    return recall, float(latencies_ms.mean()), float(np.percentile(latencies_ms, 95))
+
+
+def _tune_search_parameter(index: Any, variant: str, queries: np.ndarray, truth: np.ndarray, k: int,
+                           recall_target: float) -> Tuple[Optional[Dict[str, int]], List[Dict[str, Any]]]:
+    """Recorre efSearch / nprobe y fija el menor valor que alcanza el objetivo (o el de mayor recall)."""
+    if variant == "hnsw":
+        name, candidates, setter = "ef_search", HNSW_EF_CANDIDATES, lambda v: setattr(index.hnsw, "efSearch", v)
+    elif variant == "ivfpq":
+        ivf = faiss.extract_index_ivf(index)
+        candidates = [n for n in IVF_NPROBE_CANDIDATES if n < ivf.nlist] + [ivf.nlist]
+        name, setter = "nprobe", lambda v: setattr(ivf, "nprobe", v)
+    else:
+        return None, []
+    sweep: List[Dict[str, Any]] = []
+    chosen: Optional[Dict[str, Any]] = None
+    for value in candidates:
+        setter(value)
+        recall, avg_ms, p95_ms = _recall_and_latency(index, queries, truth, k)
+        sweep.append({name: value, "recall": round(recall, 4), "avg_latency_ms": round(avg_ms, 4), "p95_latency_ms": round(p95_ms, 4)})
+        if recall >= recall_target:
+            chosen = sweep[-1]
+            break
+    if chosen is None:
+        chosen = max(sweep, key=lambda entry: entry["recall"])
+        logger.warning(f"Ningún {name} alcanza recall@{k} >= {recall_target}; se usa {name}={chosen[name]} (recall {chosen['recall']}).")
+    setter(chosen[name])
+    return {name: chosen[name]}, sweep
+
+
+def evaluate_against_flat(index: Any, variant: str, vectors: np.ndarray, k: int, num_queries: int,
+                          recall_target: float, seed: int = 42) -> Dict[str, Any]:
+    """
+    recall@k, latencia por consulta y tamaño serializado de la variante frente al índice
+    plano. Las consultas son vectores del corpus con ruido gaussiano (no coinciden
+    exactamente con ningún documento).
+    """
+    rng = np.random.default_rng(seed)
+    sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+    queries = vectors[sample] + rng.normal(scale=0.05, size=(len(sample), vectors.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    flat = faiss.IndexFlatL2(vectors.shape[1])
+    flat.add(vectors)
+    _, truth = flat.search(queries, k)
+    _, flat_avg_ms, flat_p95_ms = _recall_and_latency(flat, queries, truth, k)
+
+    search_params, sweep = _tune_search_parameter(index, variant, queries, truth, k, recall_target)
+    recall, avg_ms, p95_ms = _recall_and_latency(index, queries, truth, k)
+    flat_bytes = int(faiss.serialize_index(flat).size)
+    index_bytes = int(faiss.serialize_index(index).size)
+    return {
+        "k": k,
+        "queries": len(queries),
+        "recall_target": recall_target,
+        "recall_at_k": round(recall, 4),
+        "meets_recall_target": recall >= recall_target,
+        "search_params": search_params,
+        "avg_latency_ms": round(avg_ms, 4),
+        "p95_latency_ms": round(p95_ms, 4),
+        "flat_avg_latency_ms": round(flat_avg_ms, 4),
+        "flat_p95_latency_ms": round(flat_p95_ms, 4),
+        "index_bytes": index_bytes,
+        "flat_index_bytes": flat_bytes,
+        "memory_reduction": round(flat_bytes / index_bytes, 2) if index_bytes else None,
+        "parameter_sweep": sweep,
+    }
+
+
+# --- Entrada principal ---
+def build(variant: str, csv_path: str, output_folder: str, index_name: str, params: Optional[Dict[str, Any]] = None,
+          vectors_from: Optional[str] = None, k: int = 10, num_queries: int = 200, recall_target: float = 0.95,
+          overwrite_docstore: bool = False) -> Dict[str, Any]:
+    """
+    Construye la variante, escribe el índice, el docstore Arrow y el informe. Devuelve el
+    informe. Lanza ValueError si el docstore existente tiene otro contenido y no se pide
+    'overwrite_docstore' (las demás variantes dejarían de corresponder a sus documentos).
+    """
+    start = time.perf_counter()
+    documents = load_documents(csv_path)
+    content_hash = documents_content_hash(documents)
+    existing = load_arrow_docstore(output_folder, index_name)
+    if existing is not None and existing.content_hash() != content_hash:
+        if not overwrite_docstore:
+            raise ValueError(f"El docstore {existing.path} tiene otros documentos que {csv_path}; reescribirlo invalidaría "
+                             f"las variantes ya construidas. Usa --overwrite-docstore y reconstruye todas las variantes.")
+        logger.warning(f"Se reescribe el docstore {existing.path} con otro contenido: reconstruye las demás variantes.")
+        existing = None
+    vectors = vectors_from_index(vectors_from, len(documents)) if vectors_from else embed_documents(documents)
+    embed_seconds = time.perf_counter() - start
+
+    build_params = {**default_params(variant, len(vectors), vectors.shape[1]), **(params or {})}
+    start = time.perf_counter()
+    index = build_index(variant, vectors, build_params)
+    build_seconds = time.perf_counter() - start
+    evaluation = evaluate_against_flat(index, variant, vectors, k, num_queries, recall_target)
+
+    os.makedirs(output_folder, exist_ok=True)
+    index_path = index_file_path(output_folder, index_name, variant)
+    faiss.write_index(index, index_path) # Incluye el efSearch / nprobe elegido
+    # El docstore es común a todas las variantes (fila i = id FAISS i); con el mismo
+    # contenido se conservan sus ids
+    docstore_ids = [existing.index_to_docstore_id[i] for i in range(len(documents))] if existing is not None else [str(i) for i in range(len(documents))]
+    write_arrow_docstore(docstore_path(output_folder, index_name), docstore_ids, documents)
+
+    report = {
+        "variant": variant,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "csv_path": csv_path,
+        "documents": len(documents),
+        "dimension": int(vectors.shape[1]),
+        "embedding_model": settings.EMBEDDING_MODEL_NAME,
+        "vectors_from": vectors_from,
+        "docstore_sha256": content_hash,
+        "build_params": build_params,
+        "faiss_version": faiss.__version__,
+        "index_path": index_path,
+        "embed_seconds": round(embed_seconds, 3),
+        "build_seconds": round(build_seconds, 3),
+        "evaluation": evaluation,
+    }
+    with open(build_report_path(output_folder, index_name, variant), "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Construye una variante del índice FAISS desde el CSV y mide su recall frente a flat.")
+    parser.add_argument("--variant", choices=INDEX_VARIANTS, default="flat")
+    parser.add_argument("--csv", default=settings.CSV_FILE_PATH, help="CSV de origen (una fila = un documento)")
+    parser.add_argument("--output", default=settings.FAISS_INDEX_FOLDER, help="Carpeta de salida del índice")
+    parser.add_argument("--index-name", default=settings.FAISS_INDEX_NAME)
+    parser.add_argument("--vectors-from", default=None, help="Reutilizar los vectores de un índice plano existente en lugar de recalcular embeddings")
+    parser.add_argument("--param", action="append", default=[], metavar="CLAVE=VALOR",
+                        help="Parámetro de construcción (ej. M=48, ef_construction=400, nlist=64, m=48, nbits=8)")
+    parser.add_argument("--k", type=int, default=10, help="k del recall@k del informe")
+    parser.add_argument("--queries", type=int, default=200, help="Número de consultas de evaluación")
+    parser.add_argument("--recall-target", type=float, default=0.95, help="Recall@k objetivo para elegir efSearch / nprobe")
+    parser.add_argument("--overwrite-docstore", action="store_true",
+                        help="Reescribir el docstore aunque tenga otro contenido (hay que reconstruir las demás variantes)")
+    args = parser.parse_args(argv)
+
+    params = {key: int(value) for key, value in (item.split("=", 1) for item in args.param)}
+    report = build(args.variant, args.csv, args.output, args.index_name, params, args.vectors_from,
+                   args.k, args.queries, args.recall_target, args.overwrite_docstore)
+    evaluation = report["evaluation"]
+    print(f"Índice '{report['variant']}' escrito en {report['index_path']} ({report['documents']} documentos, {report['build_seconds']}s).")
+    print(f"  recall@{evaluation['k']} = {evaluation['recall_at_k']} (objetivo {evaluation['recall_target']}, "
+          f"{'cumplido' if evaluation['meets_recall_target'] else 'NO cumplido'}), parámetros de búsqueda: {evaluation['search_params']}")
+    print(f"  latencia media {evaluation['avg_latency_ms']} ms (flat {evaluation['flat_avg_latency_ms']} ms), "
+          f"tamaño {evaluation['index_bytes']} bytes (flat {evaluation['flat_index_bytes']}, {evaluation['memory_reduction']}x menos)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,77 @@
+# tests/bench_concurrency.py
+# Prueba de carga: mide cómo escala el throughput de /api/query con la concurrencia.
+# Requiere el servidor en ejecución (python runserver.py) y un LLM configurado.
+#
+# Uso:
+#   python tests/bench_concurrency.py
+#   HCHAT_API_URL=http://127.0.0.1:8008/api/query BENCH_LEVELS=1,4,8 python tests/bench_concurrency.py
+import asyncio
+import os
+import statistics
+import time
+from typing import List, Tuple
+
+import httpx
+
+# --- Configuración ---
+API_URL = os.getenv("HCHAT_API_URL", "http://127.0.0.1:8008/api/query")
+CONCURRENCY_LEVELS = [int(x) for x in os.getenv("BENCH_LEVELS", "1,2,4,8,16").split(",")]
+REQUESTS_PER_LEVEL = int(os.getenv("BENCH_REQUESTS", "32"))
+REQUEST_TIMEOUT = float(os.getenv("BENCH_TIMEOUT", "120"))
+
+QUERIES = [
+    "Dame todos los datos del barco 'Perla'",
+    "Gráfico de los 10 tipos de barco más comunes",
+    "Lista los nombres de los barcos que llegaron a La Habana en 1851",
+    "¿Qué barcos vinieron de Halifax?",
+]
+# --- Fin Configuración ---
+
+
+async def _send(client: httpx.AsyncClient, query: str) -> Tuple[float, bool]:
+    """Envía una consulta y devuelve (latencia en segundos, éxito)."""
+    start = time.perf_counter()
+    try:
+        response = await client.post(API_URL, json={"query": query})
+        ok = response.status_code == 200 and not response.json().get("error")
+    except Exception as e:
+        print(f"  Error en petición: {e}")
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def run_level(concurrency: int, total_requests: int) -> None:
+    """Lanza 'total_requests' peticiones manteniendo 'concurrency' en vuelo."""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    failures = 0
+
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
+        async def worker(i: int) -> None:
+            nonlocal failures
+            async with semaphore:
+                latency, ok = await _send(client, QUERIES[i % len(QUERIES)])
+                latencies.append(latency)
+                if not ok:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(i) for i in range(total_requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50 = statistics.median(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    print(f"concurrencia={concurrency:>3} | peticiones={total_requests:>4} | "
+          f"throughput={total_requests / elapsed:6.2f} req/s | "
+          f"p50={p50:6.2f}s | p95={p95:6.2f}s | fallos={failures}")
+
+
+async def main() -> None:
+    print(f"Prueba de carga contra: {API_URL}")
+    for level in CONCURRENCY_LEVELS:
+        await run_level(level, max(REQUESTS_PER_LEVEL, level))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
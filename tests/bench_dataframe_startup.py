@@ -0,0 +1,61 @@
+# tests/bench_dataframe_startup.py
+# Benchmark de arranque: compara parsear el CSV + preprocesar contra cargar el
+# snapshot Arrow (memory-mapped) del DataFrame ya preprocesado.
+#
+# Uso:
+#   python tests/bench_dataframe_startup.py
+#   BENCH_SCALES=1,10,100 python tests/bench_dataframe_startup.py   # replica el CSV N veces
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.core.config import settings
+from app.core.dataframe_loader import (
+    compute_file_hash,
+    load_snapshot,
+    read_and_preprocess_csv,
+    write_snapshot,
+)
+
+# --- Configuración ---
+SCALES = [int(x) for x in os.getenv("BENCH_SCALES", "1,10,50").split(",")]
+REPEATS = int(os.getenv("BENCH_REPEATS", "3"))
+# --- Fin Configuración ---
+
+
+def _best_of(func, repeats: int) -> float:
+    """Mejor tiempo (segundos) de 'repeats' ejecuciones."""
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    base = pd.read_csv(settings.CSV_FILE_PATH)
+    print(f"CSV base: {settings.CSV_FILE_PATH} ({len(base)} filas)")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in SCALES:
+            csv_path = os.path.join(tmp_dir, f"bench_x{scale}.csv")
+            pd.concat([base] * scale, ignore_index=True).to_csv(csv_path, index=False)
+            snapshot_dir = os.path.join(tmp_dir, "snapshots")
+            csv_hash = compute_file_hash(csv_path)
+
+            df = read_and_preprocess_csv(csv_path)
+            write_snapshot(df, csv_path, csv_hash, snapshot_dir)
+
+            t_csv = _best_of(lambda: read_and_preprocess_csv(csv_path), REPEATS)
+            t_snapshot = _best_of(lambda: load_snapshot(csv_path, csv_hash, snapshot_dir), REPEATS)
+            print(f"x{scale:<4} filas={len(df):>9} | CSV+preproceso={t_csv * 1000:9.1f} ms | "
+                  f"snapshot={t_snapshot * 1000:9.1f} ms | aceleración={t_csv / t_snapshot:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
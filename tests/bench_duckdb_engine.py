@@ -0,0 +1,100 @@
+# tests/bench_duckdb_engine.py
+# Benchmark del motor de get_tabular_data: ruta pandas (df.eval + sort) frente a DuckDB
+# (filtro, orden y límite en SQL) sobre un archivo sintético de 10M filas, obtenido
+# remuestreando filas del dataset real. También comprueba que ambos resultados son idénticos.
+#
+# Uso:
+#   python tests/bench_duckdb_engine.py
+#   BENCH_ROWS=2000000 BENCH_REPEATS=3 DUCKDB_THREADS=4 python tests/bench_duckdb_engine.py
+import os
+import sys
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.core.config import settings
+from app.core.dataframe_loader import get_dataframe
+from app.pandasai_utils.skills import get_tabular_data
+from app.pandasai_utils import duckdb_engine
+
+logging.disable(logging.CRITICAL) # Las skills loguean en cada llamada
+
+# --- Configuración ---
+ROWS = int(os.getenv("BENCH_ROWS", "10000000"))
+REPEATS = int(os.getenv("BENCH_REPEATS", "3"))
+# Columnas del archivo sintético (el texto libre se omite para acotar la memoria)
+COLUMNS = [
+    "publication_date", "news_section", "travel_departure_port", "travel_arrival_port",
+    "ship_type", "ship_name", "master_role", "travel_duration_days",
+]
+CASES = {
+    "filtro por tipo + columnas": dict(
+        filter_conditions="ship_type == 'frag. am.' and travel_departure_port != 'Nueva York'",
+        columns_to_select=["ship_name", "travel_departure_port", "publication_date"],
+    ),
+    "rango + orden + límite": dict(
+        filter_conditions="travel_duration_days > 20 and travel_duration_days < 40",
+        sort_by=[{"column": "publication_date", "order": "desc"}],
+        limit=50,
+    ),
+    "año + varios puertos + orden": dict(
+        filter_conditions="publication_date.dt.year == 1854 and travel_departure_port in ['Nueva York', 'Nueva Orleans', 'Charleston']",
+        sort_by=[{"column": "travel_duration_days", "order": "desc"}, {"column": "ship_name", "order": "asc"}],
+        limit=100,
+    ),
+    "disyunción, sin límite": dict(
+        filter_conditions="(ship_type == 'berg. am.') | (travel_duration_days >= 60)",
+        columns_to_select=["ship_name", "ship_type", "travel_duration_days"],
+    ),
+}
+# --- Fin Configuración ---
+
+
+def build_archive(base: pd.DataFrame, rows: int, seed: int = 42) -> pd.DataFrame:
+    """Remuestrea filas del dataset real y desplaza las fechas para simular un archivo mayor."""
+    rng = np.random.default_rng(seed)
+    archive = base[[col for col in COLUMNS if col in base.columns]].take(rng.integers(0, len(base), rows))
+    archive = archive.reset_index(drop=True)
+    archive["publication_date"] = archive["publication_date"] + pd.to_timedelta(rng.integers(-30, 30, rows), unit="D")
+    return archive
+
+
+def measure(df: pd.DataFrame, engine: str, kwargs: dict):
+    """Devuelve (mejor latencia en ms, resultado) con el motor indicado."""
+    settings.TABULAR_ENGINE = engine
+    impl = getattr(get_tabular_data, "func", get_tabular_data)
+    best, result = float("inf"), None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = impl(df, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+
+def main() -> None:
+    if not duckdb_engine.is_available():
+        print("DuckDB no está instalado.")
+        return
+    base = get_dataframe()
+    if base is None:
+        print("No se pudo cargar el DataFrame base.")
+        return
+    start = time.perf_counter()
+    archive = build_archive(base, ROWS)
+    print(f"Archivo sintético: {len(archive):,} filas, {archive.memory_usage(deep=True).sum() / 1e6:.0f} MB "
+          f"(generado en {time.perf_counter() - start:.1f}s). Hilos DuckDB: {settings.DUCKDB_THREADS or 'todos'}.")
+
+    for name, kwargs in CASES.items():
+        pandas_ms, pandas_result = measure(archive, "pandas", kwargs)
+        duckdb_ms, duckdb_result = measure(archive, "duckdb", kwargs)
+        pd.testing.assert_frame_equal(pandas_result, duckdb_result)
+        print(f"  {name:<30} pandas: {pandas_ms:9.1f} ms | duckdb: {duckdb_ms:9.1f} ms | "
+              f"x{pandas_ms / duckdb_ms:5.1f} | {len(duckdb_result):,} filas (idénticas)")
+    print(duckdb_engine.get_duckdb_engine_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# tests/bench_faiss_prefilter.py
+# Benchmark de la búsqueda vectorial filtrada: recall@k y latencia del post-filtrado
+# anterior (recuperar k vecinos y descartar los que no cumplen el filtro) frente al
+# pre-filtrado con bitmap de ids FAISS (IDSelectorBitmap), para filtros de distinta
+# selectividad. Las consultas son vectores del propio índice (no requiere generar
+# embeddings de texto); la referencia es la búsqueda exacta restringida a las filas
+# que cumplen el filtro.
+#
+# Uso:
+#   python tests/bench_faiss_prefilter.py
+#   BENCH_K=20 BENCH_QUERIES=200 python tests/bench_faiss_prefilter.py
+import os
+import sys
+import time
+import logging
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.core.dataframe_loader import get_dataframe
+from app.vector_store import faiss_store
+
+logging.disable(logging.CRITICAL)
+
+# --- Configuración ---
+K = int(os.getenv("BENCH_K", "10"))
+QUERIES = int(os.getenv("BENCH_QUERIES", "100"))
+POSTFILTER_FETCH = [int(x) for x in os.getenv("BENCH_POSTFILTER_FETCH", "20,200").split(",")] # k del post-filtrado
+SELECTIVITIES = [float(x) for x in os.getenv("BENCH_SELECTIVITIES", "0.5,0.2,0.05,0.01,0.002").split(",")]
+METADATA_FILTERS = [
+    {"ship_type": "berg. am."},
+    {"travel_arrival_port": "La Habana", "ship_type": "vapor am."},
+    {"master_name": "Brown"},
+]
+SEED = 42
+# --- Fin Configuración ---
+
+
+def _timed(fn, repeats):
+    start = time.perf_counter()
+    results = [fn(i) for i in range(repeats)]
+    return results, (time.perf_counter() - start) / repeats * 1000
+
+
+def bench_filter(label, vector_store, vectors, row_labels, allowed_positions, query_ids):
+    """Recall@K y latencia media (ms) de cada estrategia para un conjunto de filas permitidas."""
+    df = get_dataframe()
+    allowed_labels = set(df.index[allowed_positions].tolist())
+    allowed_mask = np.array([lbl in allowed_labels for lbl in row_labels])
+    allowed_vectors = vectors[allowed_mask]
+    allowed_row_labels = row_labels[allowed_mask]
+    queries = vectors[query_ids]
+
+    # Referencia exacta: distancias a todas las filas permitidas
+    truth = []
+    for q in queries:
+        d = ((allowed_vectors - q) ** 2).sum(axis=1)
+        truth.append(set(allowed_row_labels[np.argsort(d, kind="stable")[:K]].tolist()))
+
+    def recall(found):
+        scores = [len(f & t) / len(t) for f, t in zip(found, truth) if t]
+        return np.mean(scores) if scores else 1.0
+
+    rows = []
+    for fetch in POSTFILTER_FETCH:
+        def post(i, fetch=fetch):
+            _, ids = vector_store.index.search(queries[i:i + 1], fetch)
+            kept = [row_labels[j] for j in ids[0] if j >= 0 and row_labels[j] in allowed_labels]
+            return set(kept[:K])
+        found, ms = _timed(post, len(queries))
+        rows.append((f"post-filtrado k={fetch}", recall(found), np.mean([len(f) for f in found]), ms))
+
+    def pre(i):
+        results = faiss_store.search_by_vector_prefiltered(queries[i], K, allowed_positions)
+        return {int(doc.metadata[faiss_store.ROW_ID_METADATA_KEY]) for doc, _ in results}
+    faiss_store.search_by_vector_prefiltered(queries[0], K, allowed_positions) # construye el bitmap (caché)
+    found, ms = _timed(pre, len(queries))
+    rows.append(("pre-filtrado (bitmap)", recall(found), np.mean([len(f) for f in found]), ms))
+
+    print(f"\n{label}: {len(allowed_positions)} filas permitidas ({len(allowed_positions) / len(df):.1%})")
+    for name, rec, avg_len, ms in rows:
+        print(f"  {name:<24} recall@{K}={rec:6.3f}  resultados medios={avg_len:5.1f}  latencia={ms:7.3f} ms")
+
+
+def main():
+    df = get_dataframe()
+    vector_store = faiss_store.get_faiss_db()
+    if df is None or vector_store is None:
+        print("DataFrame o índice FAISS no disponibles; no se puede ejecutar el benchmark.")
+        return
+    index = vector_store.index
+    vectors = index.reconstruct_n(0, index.ntotal)
+    row_labels = np.array([
+        int(vector_store.docstore.search(vector_store.index_to_docstore_id[i]).metadata[faiss_store.ROW_ID_METADATA_KEY])
+        for i in range(index.ntotal)
+    ])
+    rng = np.random.default_rng(SEED)
+    query_ids = rng.choice(index.ntotal, size=min(QUERIES, index.ntotal), replace=False)
+    print(f"Índice: {index.ntotal} vectores (dim {index.d}), {len(query_ids)} consultas, K={K}")
+
+    for selectivity in SELECTIVITIES:
+        size = max(1, int(round(len(df) * selectivity)))
+        positions = np.sort(rng.choice(len(df), size=size, replace=False))
+        bench_filter(f"Filas aleatorias {selectivity:.1%}", vector_store, vectors, row_labels, positions, query_ids)
+
+    for criteria in METADATA_FILTERS:
+        positions = faiss_store.filter_row_positions(criteria)
+        if positions is None or positions.size == 0:
+            print(f"\nFiltro {criteria}: sin filas; se omite.")
+            continue
+        bench_filter(f"Filtro {criteria}", vector_store, vectors, row_labels, positions, query_ids)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# tests/bench_get_tabular_data.py
+# Microbenchmark de la skill get_tabular_data: latencia y memoria pico (tracemalloc)
+# de la implementación anterior (copia completa + query + sort) frente a la actual
+# (filtrar y proyectar en un paso, selección top-k), para varios tamaños del dataset.
+#
+# Uso:
+#   python tests/bench_get_tabular_data.py
+#   BENCH_SCALES=1,10,100 python tests/bench_get_tabular_data.py
+import os
+import sys
+import time
+import logging
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from app.core.dataframe_loader import get_dataframe
+from app.pandasai_utils.skills import get_tabular_data, normalize_filter_expression
+
+logging.disable(logging.CRITICAL) # Las skills loguean en cada llamada
+
+# --- Configuración ---
+SCALES = [int(x) for x in os.getenv("BENCH_SCALES", "1,10,50").split(",")]
+REPEATS = int(os.getenv("BENCH_REPEATS", "5"))
+CASES = {
+    "filtro estrecho + columnas": dict(
+        filter_conditions="ship_type == 'berg. am.'",
+        columns_to_select=["ship_name", "master_name", "publication_date"],
+    ),
+    "top 10 por duración": dict(
+        sort_by=[{"column": "travel_duration_days", "order": "desc"}],
+        limit=10,
+    ),
+    "filtro + orden + límite": dict(
+        filter_conditions="travel_duration_days > 20",
+        sort_by=[{"column": "publication_date", "order": "asc"}],
+        limit=20,
+    ),
+}
+# --- Fin Configuración ---
+
+
+def legacy_get_tabular_data(df, columns_to_select=None, filter_conditions=None, sort_by=None, limit=None):
+    """Implementación anterior: copia completa del DataFrame antes de filtrar y orden completo."""
+    df_result = df.copy()
+    if filter_conditions:
+        df_result = df_result.query(normalize_filter_expression(filter_conditions))
+    if columns_to_select:
+        df_result = df_result[[c for c in columns_to_select if c in df_result.columns]]
+    if sort_by:
+        df_result = df_result.sort_values(
+            by=[s["column"] for s in sort_by],
+            ascending=[s.get("order", "asc") == "asc" for s in sort_by],
+        )
+    if limit:
+        df_result = df_result.head(limit)
+    return df_result
+
+
+def measure(func, df, kwargs):
+    """Devuelve (mejor latencia en ms, memoria pico en MB)."""
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        func(df, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(df, **kwargs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best * 1000, peak / 1e6
+
+
+def main() -> None:
+    base = get_dataframe()
+    if base is None:
+        print("No se pudo cargar el DataFrame base.")
+        return
+    new_impl = getattr(get_tabular_data, "func", get_tabular_data)
+
+    for scale in SCALES:
+        df = pd.concat([base] * scale, ignore_index=True)
+        print(f"\n=== x{scale}: {len(df)} filas ===")
+        for name, kwargs in CASES.items():
+            old_ms, old_mb = measure(legacy_get_tabular_data, df, kwargs)
+            new_ms, new_mb = measure(new_impl, df, kwargs)
+            print(f"  {name:<28} antes: {old_ms:8.2f} ms {old_mb:8.2f} MB | "
+                  f"ahora: {new_ms:8.2f} ms {new_mb:8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+# tests/conftest.py
+# Configuración común de pytest. Los tests se ejecutan desde la raíz del proyecto (las
+# rutas de settings son relativas a ella) y usan el CSV real de data/.
+#
+# Uso:
+#   python -m pytest -q tests
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# Scripts manuales (requieren claves de API o modelos descargados): no son tests de pytest
+collect_ignore = [
+    "pandas-ai-test.py",
+    "test_api_google.py",
+    "test_faiss_query.py",
+    "test_hybrid_retrieval.py",
+    "test_pandasai.py",
+    "test_similarity.py",
+    "test_similarity_search_by_name.py",
+    "text_agent_retriebal.py",
+]
+
+
+@pytest.fixture(scope="session")
+def dataframe() -> pd.DataFrame:
+    """DataFrame cargado por la aplicación (con el plan de tipos compactos)."""
+    from app.core.dataframe_loader import get_dataframe
+    df = get_dataframe()
+    if df is None:
+        pytest.skip("DataFrame no disponible (falta el CSV de datos).")
+    return df
+
+
+@pytest.fixture(scope="session")
+def reference_frame(dataframe: pd.DataFrame) -> pd.DataFrame:
+    """Copia con las categóricas como texto: referencia de df.query() con strings."""
+    categorical = [col for col, dtype in dataframe.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    return dataframe.astype({col: object for col in categorical})
@@ -0,0 +1,194 @@
+# tests/test_caches.py
+# Cachés de la aplicación: respuestas del LLM (SQLite), código de PandasAI (SQLite) y
+# respuestas finales por similitud semántica (FAISS). Cada test usa bases temporales.
+import hashlib
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+from langchain_core.embeddings import Embeddings
+from langchain_core.outputs import Generation
+
+from app.core import code_cache, dataframe_loader, llm_cache, semantic_cache
+from app.core.config import settings
+
+
+# --- Caché de respuestas del LLM ---
+@pytest.fixture
+def llm_cache_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "LLM_CACHE_PATH", str(tmp_path / "llm_cache.sqlite"))
+    monkeypatch.setattr(llm_cache, "_connection", None)
+    yield
+    llm_cache._connection.close()
+
+
+def test_llm_cache_hit_ignores_whitespace(llm_cache_db):
+    cache = llm_cache.get_llm_cache("google:gemini:0.0")
+    cache.update("¿Cuántos   barcos\nhay?", "llm", [Generation(text="Hay 10.")])
+    cached = cache.lookup("¿Cuántos barcos hay?", "llm")
+    assert [generation.text for generation in cached] == ["Hay 10."]
+    assert cache.lookup("¿Cuántos barcos hay?", "otro-llm") is None
+
+
+def test_llm_cache_namespaces_are_isolated(llm_cache_db):
+    llm_cache.get_llm_cache("a").update("prompt", "llm", [Generation(text="A")])
+    assert llm_cache.get_llm_cache("b").lookup("prompt", "llm") is None
+
+
+def test_llm_cache_expires_entries(llm_cache_db, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_CACHE_TTL_SECONDS", 60)
+    cache = llm_cache.get_llm_cache("ns")
+    cache.update("prompt", "llm", [Generation(text="viejo")])
+    llm_cache._get_connection().execute("UPDATE llm_cache SET created_at = created_at - 120")
+    assert cache.lookup("prompt", "llm") is None
+
+
+def test_llm_cache_evicts_least_recently_used(llm_cache_db, monkeypatch):
+    monkeypatch.setattr(settings, "LLM_CACHE_MAX_ENTRIES", 2)
+    cache = llm_cache.get_llm_cache("ns")
+    cache.update("p1", "llm", [Generation(text="1")])
+    cache.update("p2", "llm", [Generation(text="2")])
+    conn = llm_cache._get_connection()
+    conn.execute("UPDATE llm_cache SET last_access = last_access - 100") # p1 y p2 quedan antiguas
+    assert cache.lookup("p1", "llm") is not None # p1 pasa a ser la más reciente
+    cache.update("p3", "llm", [Generation(text="3")])
+    assert cache.lookup("p2", "llm") is None
+    assert cache.lookup("p1", "llm") is not None
+    assert cache.lookup("p3", "llm") is not None
+    assert llm_cache.purge_llm_cache() == 2
+
+
+def test_llm_cache_corrupt_entry_is_a_miss(llm_cache_db):
+    cache = llm_cache.get_llm_cache("ns")
+    cache.update("prompt", "llm", [Generation(text="ok")])
+    llm_cache._get_connection().execute("UPDATE llm_cache SET value = 'no es json'")
+    hits = llm_cache._stats["hits"]
+    assert cache.lookup("prompt", "llm") is None
+    assert llm_cache._stats["hits"] == hits
+    assert llm_cache._get_connection().execute("SELECT COUNT(*) FROM llm_cache").fetchone() == (0,)
+
+
+def test_llm_cache_disabled(monkeypatch):
+    monkeypatch.setattr(settings, "LLM_CACHE_ENABLED", False)
+    assert llm_cache.get_llm_cache("ns") is None
+
+
+# --- Caché de código de PandasAI ---
+@pytest.fixture
+def code_cache_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "CODE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "CODE_CACHE_PATH", str(tmp_path / "code_cache.sqlite"))
+    monkeypatch.setattr(code_cache, "_connection", None)
+    monkeypatch.setattr(code_cache, "_current_fingerprint", None)
+    yield
+    code_cache._connection.close()
+
+
+def test_code_cache_round_trip(code_cache_db):
+    code_cache.store_code("Barcos por tipo", "esquema-1", "result = df.ship_type.value_counts()")
+    assert code_cache.lookup_code("  barcos   POR tipo ", "esquema-1") == "result = df.ship_type.value_counts()"
+    code_cache.discard_code("barcos por tipo", "esquema-1")
+    assert code_cache.lookup_code("barcos por tipo", "esquema-1") is None
+
+
+def test_code_cache_invalidated_by_schema_change(code_cache_db):
+    code_cache.store_code("consulta", "esquema-1", "result = 1")
+    assert code_cache.lookup_code("consulta", "esquema-2") is None
+    assert code_cache.lookup_code("consulta", "esquema-1") is None # borrada al ver el esquema nuevo
+
+
+def test_schema_fingerprint_tracks_dtypes(dataframe):
+    descriptions = {"ship_type": "Tipo de barco"}
+    fingerprint = code_cache.schema_fingerprint(dataframe, descriptions)
+    assert fingerprint == code_cache.schema_fingerprint(dataframe.copy(deep=False), descriptions)
+    assert fingerprint != code_cache.schema_fingerprint(dataframe.astype({"ship_type": object}), descriptions)
+    assert fingerprint != code_cache.schema_fingerprint(dataframe, {"ship_type": "Otra descripción"})
+
+
+# --- Caché semántica ---
+class _BagOfWordsEmbeddings(Embeddings):
+    """Embeddings deterministas (palabras con hash a 64 dimensiones), sin descargar modelos."""
+
+    def embed_query(self, text):
+        vector = np.zeros(64, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % 64] += 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+@pytest.fixture
+def semantic(monkeypatch):
+    monkeypatch.setattr(settings, "SEMANTIC_CACHE_ENABLED", True)
+    monkeypatch.setattr(semantic_cache, "get_embeddings_model", lambda: _BagOfWordsEmbeddings())
+    monkeypatch.setattr(semantic_cache, "get_dataset_version", lambda: "v1")
+    semantic_cache.clear()
+    yield semantic_cache
+    semantic_cache.clear()
+
+
+RESPONSE = {"final_response_text": "Hay 10 tipos.", "final_response_image": None}
+
+
+def test_semantic_cache_hit_for_equivalent_query(semantic):
+    semantic.store("¿Cuántos tipos de barco hay?", "text", RESPONSE)
+    cached = semantic.lookup("cuántos tipos de barco hay")
+    assert cached == dict(RESPONSE, intent="text")
+    assert semantic.lookup("¿Qué capitanes llegaron de Halifax?") is None
+
+
+def test_semantic_cache_requires_same_numbers(semantic):
+    semantic.store("Top 10 puertos de salida", "visual", RESPONSE)
+    assert semantic.lookup("Top 5 puertos de salida") is None
+    assert semantic.lookup("top 10 puertos de salida") is not None
+
+
+@pytest.mark.parametrize("stored, other", [
+    ("barcos del capitán Smith", "barcos del capitán Smyth"),
+    ("salidas de Halifax", "llegadas a Halifax"),
+    ("barcos que llegaron a Halifax", "barcos que no llegaron a Halifax"),
+    ("barcos con carga de 'cacao'", "barcos con carga de 'azucar'"),
+])
+def test_semantic_cache_requires_same_signature(semantic, monkeypatch, stored, other):
+    monkeypatch.setattr(settings, "SEMANTIC_CACHE_THRESHOLD", 0.1)
+    semantic.store(stored, "text", RESPONSE)
+    assert semantic.lookup(other) is None
+    assert semantic.lookup(stored) is not None
+
+
+def test_semantic_cache_invalidated_by_dataset_version(semantic, monkeypatch):
+    semantic.store("¿Cuántos tipos de barco hay?", "text", RESPONSE)
+    monkeypatch.setattr(semantic_cache, "get_dataset_version", lambda: "v2")
+    assert semantic.lookup("¿Cuántos tipos de barco hay?") is None
+
+
+def test_semantic_cache_evicts_least_recently_used(semantic, monkeypatch):
+    monkeypatch.setattr(settings, "SEMANTIC_CACHE_MAX_ENTRIES", 2)
+    semantic.store("barcos de Halifax", "text", RESPONSE)
+    semantic.store("barcos de Charleston", "text", RESPONSE)
+    assert semantic.lookup("barcos de Halifax") is not None
+    semantic.store("barcos de Boston", "text", RESPONSE)
+    assert semantic.lookup("barcos de Charleston") is None
+    assert semantic.lookup("barcos de Halifax") is not None
+
+
+def test_semantic_cache_invalidated_after_dataset_reload(semantic, dataframe, tmp_path, monkeypatch):
+    for name in ("_dataframe_instance", "_dataset_version", "_secondary_indexes", "_folded_index_keys", "_memory_report"):
+        monkeypatch.setattr(dataframe_loader, name, getattr(dataframe_loader, name))
+    csv_path = tmp_path / "datos.csv"
+    source = pd.read_csv(settings.CSV_FILE_PATH, nrows=40)
+    source.iloc[:20].to_csv(csv_path, index=False)
+    monkeypatch.setattr(settings, "CSV_FILE_PATH", str(csv_path))
+    monkeypatch.setattr(settings, "DATAFRAME_SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    monkeypatch.setattr(semantic_cache, "get_dataset_version", dataframe_loader.get_dataset_version)
+    assert dataframe_loader.load_and_preprocess_dataframe(force_reload=True) is not None
+    semantic.store("¿Cuántos tipos de barco hay?", "text", RESPONSE)
+    assert semantic.lookup("¿Cuántos tipos de barco hay?") is not None
+
+    source.to_csv(csv_path, index=False)
+    assert len(dataframe_loader.load_and_preprocess_dataframe(force_reload=True)) == 40
+    assert semantic.lookup("¿Cuántos tipos de barco hay?") is None
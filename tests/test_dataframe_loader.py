@@ -0,0 +1,53 @@
+# tests/test_dataframe_loader.py
+# Plan de tipos compactos del cargador, vista de texto que recibe el código de PandasAI e
+# índices secundarios (igualdad exacta: mismo resultado sobre cualquier DataFrame).
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.core.dataframe_loader import (
+    CATEGORICAL_CANDIDATE_COLUMNS, lookup_folded_index_positions, lookup_index_positions, plain_text_view,
+)
+from app.pandasai_utils.skills import get_tabular_data
+
+
+def test_only_low_cardinality_columns_are_categorical(dataframe):
+    categorical = {col for col, dtype in dataframe.dtypes.items() if isinstance(dtype, pd.CategoricalDtype)}
+    assert categorical <= set(CATEGORICAL_CANDIDATE_COLUMNS)
+    assert not isinstance(dataframe["travel_duration"].dtype, pd.CategoricalDtype)
+    assert not isinstance(dataframe["travel_port_of_call_list"].dtype, pd.CategoricalDtype)
+
+
+def test_plain_text_view_for_generated_code(dataframe, reference_frame):
+    view = plain_text_view(dataframe)
+    assert not any(isinstance(dtype, pd.CategoricalDtype) for dtype in view.dtypes)
+    pd.testing.assert_frame_equal(view, reference_frame)
+    view["ship_type"] = view["ship_type"].fillna("valor nuevo")
+    assert (view["ship_type"] == "valor nuevo").sum() == dataframe["ship_type"].isna().sum()
+    assert isinstance(dataframe["ship_type"].dtype, pd.CategoricalDtype)
+    counts = view["ship_type"].value_counts()
+    assert (counts > 0).all()
+
+
+def test_secondary_index_is_exact(dataframe):
+    expected = np.flatnonzero((dataframe["travel_departure_port"] == "Nueva York").to_numpy())
+    np.testing.assert_array_equal(lookup_index_positions(dataframe, "travel_departure_port", "Nueva York"), expected)
+    assert len(lookup_index_positions(dataframe, "travel_departure_port", "nueva york")) == 0
+    assert lookup_index_positions(dataframe.iloc[:1700], "travel_departure_port", "Nueva York") is None
+
+
+def test_folded_lookup_is_a_separate_operation(dataframe):
+    folded = lookup_folded_index_positions(dataframe, "travel_departure_port", "LIVERPOOL")
+    ports = dataframe["travel_departure_port"].astype(object).str.lower()
+    np.testing.assert_array_equal(folded, np.flatnonzero((ports == "liverpool").to_numpy()))
+
+
+@pytest.mark.parametrize("value", ["Nueva York", "nueva york", "NUEVA YORK"])
+def test_get_tabular_data_equality_is_frame_independent(dataframe, value):
+    skill = getattr(get_tabular_data, "func", get_tabular_data)
+    expression = f"travel_departure_port == {value!r}"
+    full = skill(dataframe, filter_conditions=expression)
+    subset = skill(dataframe.iloc[:1700], filter_conditions=expression)
+    expected = dataframe["travel_departure_port"] == value
+    assert len(full) == expected.sum()
+    assert len(subset) == expected.iloc[:1700].sum()
@@ -0,0 +1,108 @@
+# tests/test_fast_router.py
+# Reglas del pre-enrutador: las consultas que encajan por completo en una regla se
+# resuelven sin LLM; las que añaden filtros que la regla no captura van al LLM (None).
+import pytest
+
+from app.agents import fast_router
+from app.agents.fast_router import normalize_text, route_query
+
+
+def _most_common(dataframe, column):
+    return dataframe[column].dropna().astype(str).value_counts().index[0]
+
+
+@pytest.mark.parametrize("query, column, top_n", [
+    ("Gráfico de los 10 tipos de barco más comunes", "ship_type", 10),
+    ("Muéstrame un gráfico de barras con los 5 puertos de salida más frecuentes", "travel_departure_port", 5),
+    ("Grafica los quince puertos de llegada mas frecuentes", "travel_arrival_port", 15),
+    ("top 10 capitanes en un gráfico", "master_name", 10),
+])
+def test_top_n_plot(dataframe, query, column, top_n):
+    routed = route_query(query)
+    assert routed is not None
+    assert routed["intent"] == "visual"
+    assert routed["skill_call"]["name"] == "plot_top_n_frequencies"
+    assert routed["skill_call"]["args"]["column_name"] == column
+    assert routed["skill_call"]["args"]["top_n"] == top_n
+
+
+@pytest.mark.parametrize("query", [
+    "Gráfico de los tipos de barco más comunes en 1851",
+    "Gráfico de los tipos de barco más comunes de los barcos que llegaron a La Habana",
+    "Gráfico de los tipos de barco más comunes excepto los de tipo berg",
+    "Gráfico de los 10 puertos de salida más frecuentes de los vapores",
+])
+def test_top_n_plot_with_extra_filters_goes_to_llm(dataframe, query):
+    assert route_query(query) is None
+
+
+@pytest.mark.parametrize("query, group_by", [
+    ("¿Cuántos barcos hay por tipo?", "ship_type"),
+    ("Número de registros por año", "publication_year"),
+    ("Cantidad de viajes por puerto de salida", "travel_departure_port"),
+])
+def test_count_by_group(dataframe, query, group_by):
+    routed = route_query(query)
+    assert routed is not None
+    assert routed["skill_call"]["name"] == "count_by_group"
+    assert routed["skill_call"]["args"]["group_by"] == group_by
+
+
+def test_count_by_group_with_extra_filter_goes_to_llm(dataframe):
+    assert route_query("¿Cuántos barcos hay por tipo en 1851 que llegaron a La Habana?") is None
+
+
+def test_ship_data_uses_canonical_value(dataframe):
+    ship_name = _most_common(dataframe, "ship_name")
+    routed = route_query(f"Dame todos los datos del barco {ship_name.upper()}")
+    assert routed is not None
+    assert routed["skill_call"]["args"]["filter_conditions"] == f"ship_name == {ship_name!r}"
+
+
+def test_ships_from_port_with_year(dataframe):
+    port = _most_common(dataframe, "travel_departure_port")
+    routed = route_query(f"Barcos que salieron de {port} en 1851")
+    assert routed is not None
+    assert routed["skill_call"]["args"]["filter_conditions"] == f"travel_departure_port == {port!r} and publication_date.dt.year == 1851"
+
+
+def test_ships_by_master(dataframe):
+    master = _most_common(dataframe, "master_name")
+    routed = route_query(f"Barcos del capitán {master}")
+    assert routed is not None
+    assert routed["skill_call"]["args"]["filter_conditions"] == f"master_name == {master!r}"
+
+
+def test_unknown_entity_goes_to_llm(dataframe):
+    assert route_query("Dame todos los datos del barco Nombre Que No Existe En El Dataset") is None
+    assert route_query("¿Qué tiempo hace hoy?") is None
+
+
+def test_normalize_text():
+    assert normalize_text("  ¿Cuántos   BARCOS  llegaron?  ") == "cuantos barcos llegaron"
+
+
+def test_best_rule_wins_over_earlier_low_confidence(dataframe, monkeypatch):
+    routed = {"intent": "text", "skill": "count_by_group", "args": {"group_by": "ship_type"}}
+    monkeypatch.setattr(fast_router, "RULES", [
+        ("low", lambda normalized: (fast_router.LOW_CONFIDENCE, {})),
+        ("high", lambda normalized: (fast_router.HIGH_CONFIDENCE, routed)),
+    ])
+    result = route_query("cualquier consulta")
+    assert result is not None
+    assert result["route"] == "high"
+
+
+def test_vocabulary_rebuilt_on_dataset_change(dataframe, monkeypatch):
+    vocabulary = fast_router._get_vocabulary()
+    assert fast_router._get_vocabulary() is vocabulary
+    monkeypatch.setattr(fast_router, "get_dataset_version", lambda: "otra-version")
+    assert fast_router._get_vocabulary() is not vocabulary
+
+
+def test_port_with_case_variants_keeps_all_exact_values(dataframe):
+    routed = route_query("Barcos que salieron de LIVERPOOL")
+    assert routed is not None
+    condition = routed["skill_call"]["args"]["filter_conditions"]
+    assert condition.startswith("travel_departure_port in [")
+    assert "'Liverpool'" in condition and "'liverpool'" in condition
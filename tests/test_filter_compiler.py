@@ -0,0 +1,106 @@
+# tests/test_filter_compiler.py
+# El compilador de filtros debe seleccionar las mismas filas que df.query() sobre el
+# DataFrame con columnas de texto, y rechazar las construcciones fuera de la lista blanca.
+import numpy as np
+import pytest
+
+from app.pandasai_utils.filter_compiler import FilterCompileError, evaluate_filter
+from app.pandasai_utils.skills import get_tabular_data
+
+EXPRESSIONS = [
+    "ship_type == 'berg. am.'",
+    "ship_type != 'berg. am.'",
+    "ship_type == 'berg. am.' and publication_date.dt.year == 1851",
+    "ship_type == 'berg. am.' & publication_date.dt.year == 1851",
+    "ship_type == 'berg. am.' | travel_arrival_port == 'La Habana'",
+    "travel_duration_days > 10 & ship_type == 'berg. am.' | news_section == 'S'",
+    "(travel_duration_days > 10) & (news_section == 'E')",
+    "ship_type == ['berg. am.', 'vapor am.']",
+    "ship_type != ['berg. am.', 'vapor am.']",
+    "ship_type in ['berg. am.', 'vapor am.']",
+    "ship_type not in ['berg. am.', 'vapor am.']",
+    "ship_type > 'c'",
+    "'c' < ship_type",
+    "ship_type <= 'berg. am.'",
+    "travel_duration_days >= 5 and travel_duration_days < 20",
+    "travel_duration_days * 2 > 30",
+    "publication_date.dt.month == 12",
+    "not ship_type == 'berg. am.'",
+    "~(news_section == 'E')",
+    "travel_duration_days.isna()",
+    "master_name.notna()",
+]
+STRING_EXPRESSIONS = [
+    "ship_type.str.contains('am', na=False)",
+    "cargo_list.str.contains('az', case=False, na=False)",
+    "travel_departure_port.str.startswith('N', na=False)",
+]
+
+
+def _query_positions(reference_frame, expression):
+    selected = reference_frame.query(expression, engine="python")
+    return reference_frame.index.get_indexer(selected.index)
+
+
+@pytest.mark.parametrize("expression", EXPRESSIONS + STRING_EXPRESSIONS)
+def test_matches_dataframe_query(dataframe, reference_frame, expression):
+    mask = evaluate_filter(dataframe, expression)
+    np.testing.assert_array_equal(np.flatnonzero(mask), _query_positions(reference_frame, expression))
+
+
+# Variantes de mayúsculas y acentos: '==' es exacto sobre el DataFrame cargado (con índice
+# secundario) y sobre cualquier subconjunto, y '!=' es su complemento.
+VARIANT_EXPRESSIONS = [
+    "ship_type == 'Berg. Am.'",
+    "ship_type != 'Berg. Am.'",
+    "ship_type == 'berg. am.'",
+    "travel_departure_port == 'nueva york'",
+    "travel_departure_port == 'Nueva York'",
+    "travel_departure_port == 'Nuéva York'",
+    "travel_departure_port != 'NUEVA YORK'",
+    "ship_type in ['Berg. Am.', 'berg. am.']",
+    "ship_type == ['BERG. AM.', 'vapor am.']",
+    "travel_departure_port == 'Nueva York' and ship_type == 'Berg. Am.'",
+]
+
+
+@pytest.mark.parametrize("expression", VARIANT_EXPRESSIONS)
+@pytest.mark.parametrize("rows", [slice(None), slice(0, 1700), slice(100, 900)])
+def test_equality_variants_match_query_on_any_frame(dataframe, reference_frame, expression, rows):
+    mask = evaluate_filter(dataframe.iloc[rows], expression)
+    np.testing.assert_array_equal(np.flatnonzero(mask), _query_positions(reference_frame.iloc[rows], expression))
+
+
+def test_equality_and_inequality_are_complementary(dataframe):
+    equal = evaluate_filter(dataframe, "ship_type == 'Berg. Am.'")
+    not_equal = evaluate_filter(dataframe, "ship_type != 'Berg. Am.'")
+    assert (equal ^ not_equal).all()
+
+
+def test_between_on_categorical(dataframe, reference_frame):
+    mask = evaluate_filter(dataframe, "ship_type.between('b', 'c')")
+    assert mask.sum() == reference_frame["ship_type"].between("b", "c").sum()
+
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('ls')",
+    "df.ship_type == 'x'",
+    "ship_type.upper() == 'X'",
+    "(lambda: True)()",
+    "ship_type.str.replace('a', 'b')",
+    "ship_type == ",
+])
+def test_rejects_disallowed_constructs(dataframe, expression):
+    with pytest.raises(FilterCompileError):
+        evaluate_filter(dataframe, expression)
+
+
+def test_unknown_column_is_an_error(dataframe):
+    with pytest.raises(FilterCompileError):
+        evaluate_filter(dataframe, "no_such_column == 1")
+
+
+def test_get_tabular_data_surfaces_invalid_filter(dataframe):
+    skill = getattr(get_tabular_data, "func", get_tabular_data)
+    with pytest.raises(RuntimeError):
+        skill(dataframe, filter_conditions="ship_type.upper() == 'X'")
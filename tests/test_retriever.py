@@ -0,0 +1,182 @@
+# tests/test_retriever.py
+# Recuperador: qué consultas se acotan a las filas recuperadas, cómo se acotan las skills,
+# y la evidencia mínima de la búsqueda híbrida (sin evidencia no se acota nada). La rama
+# densa usa el índice FAISS del repositorio con consultas que son vectores del propio
+# índice, sin cargar el modelo de embeddings.
+import asyncio
+import os
+import re
+import threading
+import time
+
+import faiss
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from app.agents import pandasai_agent
+from app.core.config import settings
+from app.orchestration import agent_nodes
+from app.orchestration.graph_builder import route_after_moderator
+from app.vector_store import faiss_store, hybrid_retriever
+from app.vector_store.docstore import docstore_path
+
+
+# --- Enrutamiento: solo las búsquedas de registros pasan por el recuperador ---
+@pytest.mark.parametrize("state, expected", [
+    ({"search_query": "bergantín con cacao de Philadel phia", "intent": "text",
+      "skill_call": {"name": "get_tabular_data", "args": {}}}, "retrieve"),
+    ({"search_query": "bergantín con cacao de Philadel phia", "intent": "text", "skill_call": None}, "retrieve"),
+    ({"search_query": "New York", "intent": "text", "skill_call": {"name": "count_by_group", "args": {}}}, "execute"),
+    ({"search_query": "New York", "intent": "visual", "skill_call": {"name": "plot_top_n_frequencies", "args": {}}}, "execute"),
+    ({"search_query": None, "intent": "text", "skill_call": {"name": "get_tabular_data", "args": {}}}, "execute"),
+])
+def test_route_after_moderator(monkeypatch, state, expected):
+    monkeypatch.setattr(settings, "RETRIEVAL_ENABLED", True)
+    assert route_after_moderator(state) == expected
+
+
+def test_retrieval_disabled_never_routes_to_retriever(monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_ENABLED", False)
+    assert route_after_moderator({"search_query": "x", "skill_call": None}) == "execute"
+
+
+# --- Ejecución de skills acotada a las filas recuperadas ---
+def _tabular_call(filter_conditions=None):
+    args = {"columns_to_select": ["ship_name", "ship_type"], "query_description": "test"}
+    if filter_conditions:
+        args["filter_conditions"] = filter_conditions
+    return {"name": "get_tabular_data", "args": args}
+
+
+def test_skill_call_is_restricted_to_retrieved_rows(dataframe):
+    row_ids = dataframe.index[[3, 10, 200]].tolist()
+    output = pandasai_agent.run_skill_call(_tabular_call(), row_ids)
+    assert output["pandasai_error"] is None
+    assert [record["ship_name"] for record in output["pandasai_result"]] == dataframe["ship_name"].iloc[[3, 10, 200]].tolist()
+
+
+def test_unknown_row_ids_use_the_full_dataframe(dataframe):
+    output = pandasai_agent.run_skill_call(_tabular_call("ship_type == 'berg. am.'"), [-1, -2])
+    assert len(output["pandasai_result"]) == (dataframe["ship_type"] == "berg. am.").sum()
+
+
+def test_empty_narrowed_result_reruns_on_full_dataframe(dataframe):
+    other_rows = dataframe.index[dataframe["ship_type"] != "frag. esp."][:5].tolist()
+    output = pandasai_agent.run_skill_call(_tabular_call("ship_type == 'frag. esp.'"), other_rows)
+    assert len(output["pandasai_result"]) == (dataframe["ship_type"] == "frag. esp.").sum()
+
+
+def test_narrowed_result_keeps_the_entity_filter(dataframe):
+    rows = dataframe.index[:50].tolist()
+    output = pandasai_agent.run_skill_call(_tabular_call("ship_type == 'berg. am.'"), rows)
+    assert len(output["pandasai_result"]) == (dataframe["ship_type"].iloc[:50] == "berg. am.").sum()
+
+
+# --- Búsqueda híbrida ---
+def test_reciprocal_rank_fusion():
+    assert hybrid_retriever.reciprocal_rank_fusion([[1, 2, 3], [3, 1, 9]], 3) == [1, 3, 2]
+    assert hybrid_retriever.reciprocal_rank_fusion([[], []], 5) == []
+
+
+def test_bm25_minimum_score(dataframe):
+    index = hybrid_retriever.get_bm25_index()
+    assert index.search_batch(["xyzzy"], 10) == [[]]
+    weak = index.search_batch(["de la"], 2000)[0]
+    strong = index.search_batch(["de la"], 2000, min_score=1.0)[0]
+    assert len(strong) < len(weak)
+
+
+class _IndexVectorEmbeddings(Embeddings):
+    """'filaN' -> vector N del índice; 'lejosN' -> su opuesto (a distancia máxima). Sin términos del corpus."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def embed_query(self, text):
+        kind, position = re.fullmatch(r"(fila|lejos)(\d+)", text).groups()
+        vector = self.index.reconstruct(int(position))
+        return (vector if kind == "fila" else -vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+@pytest.fixture
+def vector_store(dataframe, monkeypatch):
+    folder, name = settings.FAISS_INDEX_FOLDER, settings.FAISS_INDEX_NAME
+    index_path = faiss_store.index_file_path(folder, name)
+    if not os.path.exists(index_path) or not os.path.exists(docstore_path(folder, name)):
+        pytest.skip("Índice FAISS o docstore Arrow no disponibles.")
+    embeddings = _IndexVectorEmbeddings(faiss.read_index(index_path))
+    monkeypatch.setattr(settings, "FAISS_INDEX_VARIANT", "flat")
+    monkeypatch.setattr(faiss_store, "get_embeddings_model", lambda: embeddings)
+    monkeypatch.setattr(faiss_store, "_vector_store", None)
+    store = faiss_store.get_faiss_db()
+    assert store is not None
+    return store
+
+
+def test_dense_leg_applies_distance_threshold(vector_store, monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_MAX_DISTANCE", 1.2)
+    near, far = faiss_store.search_positions_batch(["fila7", "lejos7"], 20)
+    assert near[0] == 7
+    assert far == []
+    assert len(faiss_store.search_positions_batch(["lejos7"], 20, max_distance=0)[0]) == 20
+
+
+def test_hybrid_without_evidence_returns_no_rows(vector_store, monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_MAX_DISTANCE", 1.2)
+    monkeypatch.setattr(settings, "HYBRID_LATENCY_BUDGET_MS", 0)
+    assert hybrid_retriever.hybrid_search_batch(["lejos7"]) == [[]]
+    assert hybrid_retriever.hybrid_search_batch(["fila7"])[0][0] == 7
+
+
+def test_retriever_node_falls_back_without_rows(vector_store, monkeypatch):
+    monkeypatch.setattr(settings, "RETRIEVAL_HYBRID_ENABLED", False)
+    monkeypatch.setattr(settings, "RETRIEVAL_MAX_DISTANCE", 1.2)
+    assert asyncio.run(agent_nodes.run_retriever({"search_query": "lejos7"})) == {"retrieved_row_ids": None}
+    row_ids = asyncio.run(agent_nodes.run_retriever({"search_query": "fila7"}))["retrieved_row_ids"]
+    assert row_ids[0] == 7
+
+
+def test_prefiltered_search_only_returns_allowed_rows(vector_store, dataframe):
+    allowed = np.flatnonzero((dataframe["ship_type"] == "berg. am.").to_numpy())
+    embedding = vector_store.index.reconstruct(0)
+    results = faiss_store.search_by_vector_prefiltered(embedding, 10, allowed)
+    allowed_labels = set(dataframe.index[allowed].tolist())
+    assert len(results) == 10
+    assert all(int(doc.metadata[faiss_store.ROW_ID_METADATA_KEY]) in allowed_labels for doc, _ in results)
+
+
+def test_dropped_legs_do_not_starve_later_searches(dataframe, monkeypatch):
+    # La rama densa se bloquea: la primera búsqueda la descarta por presupuesto y la deja
+    # ocupando su hilo. Las siguientes la omiten al instante en lugar de encolarse detrás.
+    release = threading.Event()
+    monkeypatch.setitem(hybrid_retriever._LEGS, "dense", lambda queries, k: release.wait(5) and [[] for _ in queries])
+    monkeypatch.setattr(settings, "HYBRID_MAX_IN_FLIGHT_PER_LEG", 1)
+    monkeypatch.setattr(settings, "HYBRID_LATENCY_BUDGET_MS", 100)
+    hybrid_retriever.shutdown_hybrid_retriever()
+    expected = hybrid_retriever.get_bm25_index().search_batch(["bergantín cacao"], 1, settings.HYBRID_MIN_BM25_SCORE)[0]
+    assert expected
+    before = hybrid_retriever.get_hybrid_retrieval_stats()
+    try:
+        assert hybrid_retriever.hybrid_search_batch(["bergantín cacao"], 1) == [dataframe.index[expected].tolist()]
+        start = time.perf_counter()
+        for _ in range(5):
+            assert hybrid_retriever.hybrid_search_batch(["bergantín cacao"], 1) == [dataframe.index[expected].tolist()]
+        assert time.perf_counter() - start < 0.1 * 5
+        stats = hybrid_retriever.get_hybrid_retrieval_stats()
+        assert stats["dense_dropped"] - before["dense_dropped"] == 1
+        assert stats["dense_busy"] - before["dense_busy"] == 5
+        assert stats["lexical_dropped"] == before["lexical_dropped"]
+    finally:
+        release.set()
+        hybrid_retriever.shutdown_hybrid_retriever()
+
+
+def test_row_mappings_are_cached_per_dataset_version(vector_store):
+    faiss_ids_by_row, rows_by_faiss_id = faiss_store._get_id_mappings(vector_store)
+    assert faiss_store._get_id_mappings(vector_store)[1] is rows_by_faiss_id
+    indexed = np.flatnonzero(faiss_ids_by_row >= 0)
+    assert (rows_by_faiss_id[faiss_ids_by_row[indexed]] == indexed).all()
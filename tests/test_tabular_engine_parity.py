@@ -0,0 +1,67 @@
+# tests/test_tabular_engine_parity.py
+# get_tabular_data debe devolver exactamente lo mismo (filas, orden y columnas) con
+# TABULAR_ENGINE="pandas" y con TABULAR_ENGINE="duckdb".
+import pandas as pd
+import pytest
+
+from app.core.config import settings
+from app.pandasai_utils import duckdb_engine
+from app.pandasai_utils.skills import get_tabular_data
+
+pytestmark = pytest.mark.skipif(not duckdb_engine.is_available(), reason="duckdb no está instalado")
+
+CASES = [
+    dict(filter_conditions="ship_type == 'frag. am.' and travel_departure_port != 'Nueva York'"),
+    dict(filter_conditions="travel_duration_days > 20 and travel_duration_days < 40",
+         sort_by=[{"column": "publication_date", "order": "desc"}]),
+    dict(filter_conditions="publication_date.dt.year == 1854 and travel_departure_port in ['Nueva York', 'Nueva Orleans', 'Charleston']",
+         sort_by=[{"column": "travel_duration_days", "order": "desc"}, {"column": "ship_name", "order": "asc"}]),
+    dict(filter_conditions="(ship_type == 'berg. am.') | (travel_duration_days >= 60)",
+         columns_to_select=["ship_name", "ship_type", "travel_duration_days"]),
+    dict(filter_conditions="ship_type > 'c'", limit=25,
+         sort_by=[{"column": "ship_name", "order": "asc"}]),
+    dict(filter_conditions="ship_type != 'berg. am.' and ship_type <= 'goleta'"),
+    dict(filter_conditions="cargo_list.str.contains('az', case=False, na=False)",
+         sort_by=[{"column": "travel_duration_days", "order": "asc"}], limit=10),
+    dict(filter_conditions="master_name.isna() or travel_duration_days.isnull()"),
+    dict(sort_by=[{"column": "travel_duration_days", "order": "desc"}], limit=15),
+]
+
+
+def _run(dataframe, monkeypatch, engine, kwargs):
+    monkeypatch.setattr(settings, "TABULAR_ENGINE", engine)
+    skill = getattr(get_tabular_data, "func", get_tabular_data)
+    return skill(dataframe, **kwargs)
+
+
+@pytest.mark.parametrize("kwargs", CASES, ids=lambda kwargs: kwargs.get("filter_conditions") or "sort_only")
+def test_duckdb_matches_pandas(dataframe, monkeypatch, kwargs):
+    expected = _run(dataframe, monkeypatch, "pandas", kwargs)
+    result = _run(dataframe, monkeypatch, "duckdb", kwargs)
+    assert not expected.empty
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_duckdb_translates_categorical_ordering(dataframe):
+    positions = duckdb_engine.select_positions(dataframe, "ship_type > 'c'", [], [], None)
+    assert positions is not None
+    assert len(positions) == (dataframe["ship_type"].astype(object) > "c").sum()
+
+
+def test_duckdb_table_is_built_once_per_dataset_version(dataframe, monkeypatch):
+    duckdb_engine.select_positions(dataframe, "ship_type > 'c'", [], [], None)
+    builds = []
+    build_table = duckdb_engine._build_table
+    monkeypatch.setattr(duckdb_engine, "_build_table", lambda *args: builds.append(args) or build_table(*args))
+    for expression in ("travel_duration_days > 20", "ship_type == 'berg. am.'"):
+        assert duckdb_engine.select_positions(dataframe, expression, ["ship_name"], [True], 10) is not None
+    assert duckdb_engine.select_positions(dataframe.iloc[::3], "ship_type > 'c'", [], [], None) is not None
+    assert builds == []
+
+
+@pytest.mark.parametrize("kwargs", CASES, ids=lambda kwargs: kwargs.get("filter_conditions") or "sort_only")
+def test_duckdb_matches_pandas_on_subsets(dataframe, monkeypatch, kwargs):
+    subset = dataframe.iloc[::-3] # Orden distinto del original: los empates siguen el del subconjunto
+    expected = _run(subset, monkeypatch, "pandas", kwargs)
+    result = _run(subset, monkeypatch, "duckdb", kwargs)
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,36 @@
+# tests/test_text_index.py
+# Búsqueda por palabras clave con el índice invertido: sobre subconjuntos del DataFrame
+# cargado se reutiliza el índice global y 'row_id' identifica la fila en el dataset.
+import numpy as np
+import pytest
+
+from app.core import text_index
+from app.pandasai_utils.skills import search_keywords
+
+QUERIES = ["cacao", "azucar OR cacao", '"nueva york"']
+
+
+def _search(df, keywords):
+    skill = getattr(search_keywords, "func", search_keywords)
+    return skill(df, keywords=keywords, columns_to_select=["ship_name"])
+
+
+@pytest.mark.parametrize("keywords", QUERIES)
+def test_subset_reuses_global_index(dataframe, monkeypatch, keywords):
+    full = _search(dataframe, keywords)
+    assert not full.empty
+    subset = dataframe.iloc[np.arange(0, len(dataframe), 3)]
+
+    def no_temporary_index(*args, **kwargs):
+        raise AssertionError("no debe construirse un índice temporal para un subconjunto")
+    monkeypatch.setattr(text_index.InvertedIndex, "build", no_temporary_index)
+    result = _search(subset, keywords)
+    assert result["row_id"].tolist() == [label for label in full["row_id"] if label in set(subset.index)]
+    assert result["ship_name"].tolist() == dataframe.loc[result["row_id"], "ship_name"].tolist()
+
+
+def test_foreign_frame_uses_temporary_index(dataframe):
+    other = dataframe.iloc[:200].reset_index(drop=True).copy()
+    other.index = other.index + 10_000
+    result = _search(other, "cacao")
+    assert set(result["row_id"]) <= set(other.index)